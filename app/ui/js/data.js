@@ -8,11 +8,28 @@ let metricsEnabled = false;
 let currentRange = '7d';
 let currentPage = 1;
 let totalPages = 1;
+let pageCursors = [null]; // pageCursors[n] is the 'before' cursor for page n + 1
+let nextCursor = null;
+let historyEvents = []; // rows shown on the current page
+let historyTotal = 0;
+let summaryData = null; // last summary shown, kept current by live updates
 const PAGE_SIZE = 50;
-const AUTO_REFRESH_INTERVAL = 30000; // 30 seconds
+const SUMMARY_FIELDS = [
+  'total_events', 'asr_events', 'tts_events', 'asr_seconds_recorded', 'asr_seconds_transcribed',
+  'tts_seconds_generated', 'total_input_chars', 'total_output_chars'
+];
+const EVENT_FLUSH_INTERVAL = 5000; // 5 seconds
+const EVENT_FLUSH_SIZE = 20; // flush early once this many events are buffered
+const EVENT_BUFFER_LIMIT = 500; // oldest events are dropped beyond this
+const EVENT_BATCH_LIMIT = 500; // most events per request (the server's METRICS_MAX_BATCH)
 
-// Auto-refresh state
-let autoRefreshTimer = null;
+// Live update state (an EventSource on /api/metrics/live)
+let liveSource = null;
+
+// Event buffer state (events are sent in batches to /api/metrics/events)
+let pendingEvents = [];
+let flushTimer = null;
+let flushInFlight = null;
 
 // DOM elements
 let elements = {};
@@ -44,6 +61,8 @@ export async function init(container) {
     metricAsrTranscribed: container.querySelector('#metricAsrTranscribed'),
     metricTtsGenerated: container.querySelector('#metricTtsGenerated'),
     metricTotalEvents: container.querySelector('#metricTotalEvents'),
+    metricAsrP95: container.querySelector('#metricAsrP95'),
+    metricTtsP95: container.querySelector('#metricTtsP95'),
     historyTableBody: container.querySelector('#historyTableBody'),
     exportHistoryBtn: container.querySelector('#exportHistoryBtn'),
     clearHistoryBtn: container.querySelector('#clearHistoryBtn'),
@@ -60,6 +79,9 @@ export async function init(container) {
   metricsEnabled = config?.enabled ?? false;
 
   if (metricsEnabled) {
+    // Send buffered events when the page is hidden or closed
+    setupEventFlushOnHide();
+
     // Show UI
     elements.disabledNotice.style.display = 'none';
     elements.summaryPanel.style.display = 'block';
@@ -112,12 +134,12 @@ function setupEventHandlers() {
     showMessage('Data refreshed', 'success');
   });
   
-  // Auto-refresh toggle
+  // Live update toggle
   elements.autoRefreshToggle?.addEventListener('change', (e) => {
     if (e.target.checked) {
-      startAutoRefresh();
+      startLiveUpdates();
     } else {
-      stopAutoRefresh();
+      stopLiveUpdates();
     }
   });
 
@@ -140,7 +162,8 @@ function setupEventHandlers() {
   });
 
   elements.historyNextBtn?.addEventListener('click', async () => {
-    if (currentPage < totalPages) {
+    if (nextCursor) {
+      pageCursors[currentPage] = nextCursor;
       currentPage++;
       await loadHistory();
     }
@@ -149,24 +172,60 @@ function setupEventHandlers() {
 
 // Refresh all data
 async function refreshData() {
+  await flushEvents();
   await loadSummary();
   await loadHistory();
 }
 
-// Start auto-refresh timer
-function startAutoRefresh() {
-  if (autoRefreshTimer) return; // Already running
-  autoRefreshTimer = setInterval(async () => {
-    await refreshData();
-  }, AUTO_REFRESH_INTERVAL);
+// Subscribe to pushed events instead of polling
+// The server sends each stored batch once, with the summary totals it adds,
+// so an open tab runs no queries while nothing happens. EventSource
+// reconnects by itself and resumes from the last message it saw.
+function startLiveUpdates() {
+  if (liveSource) return; // Already running
+  liveSource = new EventSource('/api/metrics/live');
+  liveSource.addEventListener('events', (e) => applyLiveEvents(JSON.parse(e.data)));
+  liveSource.addEventListener('reset', () => refreshData());
+}
+
+function stopLiveUpdates() {
+  if (liveSource) {
+    liveSource.close();
+    liveSource = null;
+  }
+}
+
+// Start of the current range, in ms (matches the server's range cutoffs, in UTC)
+function rangeStart(range) {
+  const now = new Date();
+  if (range === 'today') return now.setUTCHours(0, 0, 0, 0);
+  if (range === '7d') return now.getTime() - 7 * 86400000;
+  if (range === '30d') return now.getTime() - 30 * 86400000;
+  return -Infinity;
 }
 
-// Stop auto-refresh timer
-function stopAutoRefresh() {
-  if (autoRefreshTimer) {
-    clearInterval(autoRefreshTimer);
-    autoRefreshTimer = null;
+// Fold pushed events into the summary and the first history page
+function applyLiveEvents({ events, summary, since }) {
+  // Totals can be added to only if every event falls inside the range
+  // (replayed offline events may not); p95s are left until the next reload
+  if (summaryData && Date.parse(since + 'Z') >= rangeStart(currentRange)) {
+    for (const field of SUMMARY_FIELDS) summaryData[field] += summary[field];
+    renderSummary(summaryData);
+  } else {
+    loadSummary();
+  }
+  
+  historyTotal += events.length;
+  if (currentPage === 1) {
+    // Events older than the last row belong on later pages; the page grows
+    // rather than dropping rows, so the next-page cursor stays valid
+    const oldest = nextCursor ? historyEvents[historyEvents.length - 1]?.timestamp : null;
+    const fresh = events.filter(event => !oldest || event.timestamp >= oldest);
+    historyEvents = fresh.concat(historyEvents)
+      .sort((a, b) => b.timestamp.localeCompare(a.timestamp) || b.id - a.id);
+    renderHistoryTable(historyEvents);
   }
+  renderPageInfo();
 }
 
 // Load summary statistics
@@ -175,39 +234,61 @@ async function loadSummary() {
     const response = await fetch(`/api/metrics/summary?range=${currentRange}`);
     if (!response.ok) throw new Error('Failed to load summary');
     
-    const data = await response.json();
-    
-    // Update metric cards
-    elements.metricAsrRecorded.textContent = formatMinutes(data.asr_seconds_recorded);
-    elements.metricAsrTranscribed.textContent = formatMinutes(data.asr_seconds_transcribed);
-    elements.metricTtsGenerated.textContent = formatMinutes(data.tts_seconds_generated);
-    elements.metricTotalEvents.textContent = data.total_events;
+    summaryData = await response.json();
+    renderSummary(summaryData);
     
   } catch (err) {
     console.error('Failed to load metrics summary:', err);
     showMessage('Failed to load metrics', 'error');
   }
+  
+  await loadLatency();
+}
+
+// Update metric cards
+function renderSummary(data) {
+  elements.metricAsrRecorded.textContent = formatMinutes(data.asr_seconds_recorded);
+  elements.metricAsrTranscribed.textContent = formatMinutes(data.asr_seconds_transcribed);
+  elements.metricTtsGenerated.textContent = formatMinutes(data.tts_seconds_generated);
+  elements.metricTotalEvents.textContent = data.total_events;
+}
+
+// Load p95 durations for the range (from the timeseries totals)
+async function loadLatency() {
+  const p95 = { asr_transcribe: null, tts_synthesize: null };
+  try {
+    const response = await fetch(`/api/metrics/timeseries?range=${currentRange}`);
+    if (response.ok) {
+      const data = await response.json();
+      for (const total of data.totals) {
+        if (total.event_type in p95) p95[total.event_type] = total.p95;
+      }
+    }
+  } catch (err) {
+    console.warn('Failed to load latency percentiles:', err);
+  }
+  
+  if (elements.metricAsrP95) elements.metricAsrP95.textContent = formatSeconds(p95.asr_transcribe);
+  if (elements.metricTtsP95) elements.metricTtsP95.textContent = formatSeconds(p95.tts_synthesize);
 }
 
 // Load history
 async function loadHistory() {
   try {
-    const offset = (currentPage - 1) * PAGE_SIZE;
-    const response = await fetch(`/api/metrics/history?limit=${PAGE_SIZE}&offset=${offset}`);
+    // Pages are fetched by cursor, so deep pages cost the same as the first
+    const cursor = pageCursors[currentPage - 1];
+    const params = new URLSearchParams({ limit: PAGE_SIZE });
+    if (cursor) params.set('before', cursor);
+    const response = await fetch(`/api/metrics/history?${params}`);
     if (!response.ok) throw new Error('Failed to load history');
     
     const data = await response.json();
     
-    // Calculate pagination
-    totalPages = Math.ceil(data.total / PAGE_SIZE) || 1;
-    
-    // Update pagination controls
-    elements.historyPrevBtn.disabled = currentPage <= 1;
-    elements.historyNextBtn.disabled = currentPage >= totalPages;
-    elements.historyPageInfo.textContent = `Page ${currentPage} of ${totalPages}`;
-    
-    // Render table
-    renderHistoryTable(data.events);
+    nextCursor = data.next_cursor;
+    historyTotal = data.total;
+    historyEvents = data.events;
+    renderPageInfo();
+    renderHistoryTable(historyEvents);
     
   } catch (err) {
     console.error('Failed to load history:', err);
@@ -215,6 +296,14 @@ async function loadHistory() {
   }
 }
 
+// Update pagination controls
+function renderPageInfo() {
+  totalPages = Math.max(Math.ceil(historyTotal / PAGE_SIZE) || 1, currentPage);
+  elements.historyPrevBtn.disabled = currentPage <= 1;
+  elements.historyNextBtn.disabled = !nextCursor;
+  elements.historyPageInfo.textContent = `Page ${currentPage} of ${totalPages}`;
+}
+
 // Render history table
 function renderHistoryTable(events) {
   if (!events || events.length === 0) {
@@ -242,28 +331,19 @@ function renderHistoryTable(events) {
 }
 
 // Export history as JSON
+// The browser downloads the streamed export directly, so large histories
+// are never buffered in page memory.
 async function exportHistory() {
-  try {
-    const response = await fetch('/api/metrics/export');
-    if (!response.ok) throw new Error('Failed to export');
-    
-    const data = await response.json();
-    
-    // Create download
-    const blob = new Blob([JSON.stringify(data, null, 2)], { type: 'application/json' });
-    const url = URL.createObjectURL(blob);
-    const a = document.createElement('a');
-    a.href = url;
-    a.download = `yap-metrics-${new Date().toISOString().split('T')[0]}.json`;
-    a.click();
-    URL.revokeObjectURL(url);
-    
-    showMessage('History exported', 'success');
-    
-  } catch (err) {
-    console.error('Failed to export history:', err);
-    showMessage('Failed to export history', 'error');
-  }
+  await flushEvents();
+  
+  const a = document.createElement('a');
+  a.href = '/api/metrics/export?format=json';
+  a.download = `yap-metrics-${new Date().toISOString().split('T')[0]}.json`;
+  document.body.appendChild(a);
+  a.click();
+  a.remove();
+  
+  showMessage('History export started', 'success');
 }
 
 // Clear history
@@ -274,6 +354,7 @@ async function clearHistory() {
     
     // Reload data
     currentPage = 1;
+    pageCursors = [null];
     await loadSummary();
     await loadHistory();
     
@@ -286,26 +367,101 @@ async function clearHistory() {
 }
 
 // Record an event (called by ASR/TTS modules)
+// Events are buffered and sent in batches; see flushEvents()
 export async function recordEvent(eventType, data = {}) {
   if (!metricsEnabled) return;
   
-  try {
-    await fetch('/api/metrics/event', {
-      method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({
-        event_type: eventType,
-        duration_seconds: data.duration || 0,
-        input_chars: data.inputChars || 0,
-        output_chars: data.outputChars || 0,
-        status: data.status || 'success',
-        text_content: data.text || null,
-        metadata: data.metadata || null
-      })
-    });
-  } catch (err) {
-    console.warn('Failed to record metric event:', err);
+  pendingEvents.push({
+    event_type: eventType,
+    duration_seconds: data.duration || 0,
+    input_chars: data.inputChars || 0,
+    output_chars: data.outputChars || 0,
+    status: data.status || 'success',
+    text_content: data.text || null,
+    metadata: data.metadata || null,
+    timestamp: new Date().toISOString(),
+    // Lets the server ignore a resend of an event it already stored
+    // (randomUUID needs a secure context; without it the field is omitted)
+    uuid: crypto.randomUUID?.()
+  });
+  if (pendingEvents.length > EVENT_BUFFER_LIMIT) {
+    pendingEvents.splice(0, pendingEvents.length - EVENT_BUFFER_LIMIT);
+  }
+  
+  if (pendingEvents.length >= EVENT_FLUSH_SIZE) {
+    await flushEvents();
+  } else if (!flushTimer) {
+    flushTimer = setTimeout(flushEvents, EVENT_FLUSH_INTERVAL);
+  }
+}
+
+// Send buffered events, up to EVENT_BATCH_LIMIT per request
+async function flushEvents() {
+  if (flushTimer) {
+    clearTimeout(flushTimer);
+    flushTimer = null;
   }
+  // Only one flush at a time; later events wait for the next one
+  if (flushInFlight) return flushInFlight;
+  if (pendingEvents.length === 0) return;
+  
+  const batch = pendingEvents.splice(0, EVENT_BATCH_LIMIT);
+  
+  flushInFlight = (async () => {
+    try {
+      const response = await fetch('/api/metrics/events', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(batch)
+      });
+      // A 4xx other than 429 will fail the same way every time; resending
+      // it would only hold back every event recorded after it
+      if (!response.ok && response.status !== 429 && response.status < 500) {
+        console.warn('Metric events rejected, dropping batch: HTTP ' + response.status);
+        return;
+      }
+      if (!response.ok) throw new Error('HTTP ' + response.status);
+    } catch (err) {
+      console.warn('Failed to record metric events, will retry:', err);
+      // Put the batch back in front of anything recorded meanwhile; if it
+      // was stored and only the response was lost, the uuids make the
+      // resend a no-op
+      pendingEvents = batch.concat(pendingEvents).slice(-EVENT_BUFFER_LIMIT);
+      if (!flushTimer) {
+        flushTimer = setTimeout(flushEvents, EVENT_FLUSH_INTERVAL);
+      }
+    } finally {
+      flushInFlight = null;
+      // Events recorded while this request was out (or beyond the batch
+      // limit) would otherwise wait for the next recordEvent()
+      if (pendingEvents.length > 0 && !flushTimer) {
+        flushTimer = setTimeout(flushEvents, EVENT_FLUSH_INTERVAL);
+      }
+    }
+  })();
+  return flushInFlight;
+}
+
+// Hand buffered events to the browser when the page goes away
+function setupEventFlushOnHide() {
+  const flushWithBeacon = () => {
+    if (!navigator.sendBeacon) return;
+    while (pendingEvents.length > 0) {
+      const batch = pendingEvents.slice(0, EVENT_BATCH_LIMIT);
+      const blob = new Blob([JSON.stringify(batch)], { type: 'application/json' });
+      if (!navigator.sendBeacon('/api/metrics/events', blob)) return;
+      pendingEvents.splice(0, batch.length);
+    }
+    if (flushTimer) {
+      clearTimeout(flushTimer);
+      flushTimer = null;
+    }
+  };
+  
+  document.addEventListener('visibilitychange', () => {
+    if (document.visibilityState === 'hidden') flushWithBeacon();
+  });
+  window.addEventListener('pagehide', flushWithBeacon);
 }
 
 // Check if metrics are enabled
@@ -322,6 +478,12 @@ function formatMinutes(seconds) {
   return (seconds / 60).toFixed(1);
 }
 
+// Format a duration in seconds, or '-' if unknown
+function formatSeconds(seconds) {
+  if (seconds === null || seconds === undefined) return '-';
+  return `${seconds.toFixed(1)}s`;
+}
+
 // Format timestamp
 function formatTimestamp(iso) {
   const date = new Date(iso);
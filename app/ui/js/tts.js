@@ -11,6 +11,7 @@ function getDataModule() {
 
 // TTS State
 let voices = [];
+let voiceDetails = {}; // name -> measured performance from /voices?details=true
 let currentAudioUrl = null;
 let currentAudioBlob = null;
 let markdownPreviewEnabled = false;
@@ -255,13 +256,21 @@ function highlightChunk(index) {
 // Load available voices
 async function loadVoices() {
   try {
-    const response = await fetch('/tts/voices');
+    const response = await fetch('/tts/voices?details=true');
     if (!response.ok) {
       throw new Error('Failed to fetch voices: ' + response.status);
     }
 
     const data = await response.json();
 
+    // Keep measured speed for voices returned as objects
+    voiceDetails = {};
+    if (Array.isArray(data)) {
+      data.forEach(v => {
+        if (v && typeof v === 'object' && v.name) voiceDetails[v.name] = v;
+      });
+    }
+
     // Normalize response to array of strings
     if (Array.isArray(data)) {
       voices = data.map(v => typeof v === 'string' ? v : (v.name || v.id || String(v)));
@@ -311,7 +320,7 @@ function populateVoiceSelect() {
   voices.forEach(voice => {
     const option = document.createElement('option');
     option.value = voice;
-    option.textContent = voice;
+    option.textContent = formatVoiceLabel(voice);
     if (voice === defaultVoice) {
       option.selected = true;
     }
@@ -321,6 +330,13 @@ function populateVoiceSelect() {
   updateSynthesizeButton();
 }
 
+// Label a voice with its measured speed, e.g. "en_GB-cori-high (4.2x realtime)"
+function formatVoiceLabel(voice) {
+  const rtf = voiceDetails[voice]?.rtf;
+  if (!rtf) return voice;
+  return `${voice} (${(1 / rtf).toFixed(1)}x realtime)`;
+}
+
 function updateSynthesizeButton() {
   if (!elements.synthesizeBtn || !elements.textInput || !elements.voiceSelect) return;
   elements.synthesizeBtn.disabled = !elements.textInput.value.trim() || !elements.voiceSelect.value;
@@ -699,7 +715,8 @@ async function synthesize() {
     // Note: We don't have exact audio duration here, would need to load audio to get it
     getDataModule().recordEvent('tts_synthesize', {
       inputChars: text.length,
-      status: 'success'
+      status: 'success',
+      metadata: { voice }
     });
 
     // Auto-play
@@ -713,7 +730,8 @@ async function synthesize() {
     // Record failed synthesis
     getDataModule().recordEvent('tts_synthesize', {
       inputChars: text.length,
-      status: 'error'
+      status: 'error',
+      metadata: { voice }
     });
   } finally {
     elements.synthesizeBtn.disabled = false;
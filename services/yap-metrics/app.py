@@ -5,15 +5,42 @@ All data is stored on the server in SQLite and never transmitted externally.
 """
 
 import os
+import re
+import hmac
+import html
 import json
+import base64
+import csv
+import io
+import codecs
+import zlib
+import queue
 import sqlite3
-from datetime import datetime, timedelta
+import sys
+import time
+import asyncio
+import heapq
+import math
+import email.utils
+import urllib.parse
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from typing import Optional, List
+from uuid import UUID, uuid5
 from contextlib import contextmanager
 
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, Header, Depends, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
+
+from profiler import Profiler
+from sketch import DDSketch, SketchAggregate, merge_sketches
+import payload
 
 # Configuration from environment
 # METRICS_ENABLED defaults to true so users can see the feature immediately
@@ -22,6 +49,32 @@ METRICS_STORE_TEXT = os.getenv("METRICS_STORE_TEXT", "false").lower() == "true"
 METRICS_RETENTION_DAYS = int(os.getenv("METRICS_RETENTION_DAYS", "30"))
 METRICS_MAX_EVENTS = int(os.getenv("METRICS_MAX_EVENTS", "5000"))
 METRICS_DB_PATH = os.getenv("METRICS_DB_PATH", "/data/metrics.sqlite")
+METRICS_DB_READERS = int(os.getenv("METRICS_DB_READERS", "4"))
+METRICS_CLEANUP_INTERVAL = int(os.getenv("METRICS_CLEANUP_INTERVAL", "300"))
+METRICS_CLEANUP_BATCH = int(os.getenv("METRICS_CLEANUP_BATCH", "500"))
+# Background incremental vacuum and ANALYZE, once no events arrived for METRICS_MAINTENANCE_IDLE
+METRICS_MAINTENANCE_INTERVAL = int(os.getenv("METRICS_MAINTENANCE_INTERVAL", "3600"))
+METRICS_MAINTENANCE_IDLE = int(os.getenv("METRICS_MAINTENANCE_IDLE", "30"))
+METRICS_VACUUM_PAGES = int(os.getenv("METRICS_VACUUM_PAGES", "500"))
+METRICS_MAX_BATCH = int(os.getenv("METRICS_MAX_BATCH", "500"))
+METRICS_EXPORT_CHUNK = int(os.getenv("METRICS_EXPORT_CHUNK", "500"))
+METRICS_IMPORT_CHUNK = int(os.getenv("METRICS_IMPORT_CHUNK", "5000"))
+# Write-behind: acknowledge events once queued and commit them in groups
+METRICS_WRITE_BEHIND = os.getenv("METRICS_WRITE_BEHIND", "false").lower() == "true"
+METRICS_FLUSH_INTERVAL_MS = int(os.getenv("METRICS_FLUSH_INTERVAL_MS", "250"))
+METRICS_FLUSH_EVENTS = int(os.getenv("METRICS_FLUSH_EVENTS", "500"))
+METRICS_BUFFER_SIZE = int(os.getenv("METRICS_BUFFER_SIZE", "10000"))
+# 'memory' keeps the database in memory, with METRICS_DB_PATH as a periodic snapshot
+METRICS_STORAGE = os.getenv("METRICS_STORAGE", "sqlite").lower()
+METRICS_SNAPSHOT_INTERVAL = int(os.getenv("METRICS_SNAPSHOT_INTERVAL", "60"))
+# Store events in one file per 'day', 'week' or 'month' instead of only METRICS_DB_PATH
+METRICS_PARTITION = os.getenv("METRICS_PARTITION", "none").lower()
+METRICS_PARTITION_DIR = os.getenv(
+    "METRICS_PARTITION_DIR", os.path.join(os.path.dirname(METRICS_DB_PATH), "partitions")
+)
+
+# Debug profiler is only reachable when a token is configured
+PROFILER_TOKEN = os.getenv("PROFILER_TOKEN", "")
 
 # CORS configuration
 CORS_ORIGINS = os.getenv("CORS_ORIGINS", "http://localhost:*,https://localhost:*").split(",")
@@ -41,55 +94,1234 @@ app.add_middleware(
 )
 
 
+@app.exception_handler(RequestValidationError)
+async def validation_error(request: Request, exc: RequestValidationError):
+    """FastAPI's usual 422, minus echoed inputs JSON cannot encode (NaN, Infinity)"""
+    errors = [
+        {**error, "input": None} if isinstance(error.get("input"), float) and not math.isfinite(error["input"])
+        else error
+        for error in exc.errors()
+    ]
+    return JSONResponse(status_code=422, content={"detail": jsonable_encoder(errors)})
+
+
+# Database executors
+# sqlite3 calls block, so endpoints never run them on the event loop. Reads
+# share a small thread pool; writes go through a single thread, which is
+# also the order SQLite would serialize them in anyway.
+_read_executor = ThreadPoolExecutor(max_workers=METRICS_DB_READERS, thread_name_prefix="metrics-db-read")
+_write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="metrics-db-write")
+
+
+async def run_read(func, *args):
+    """Run a blocking database read on the reader pool"""
+    return await asyncio.get_running_loop().run_in_executor(_read_executor, func, *args)
+
+
+async def run_write(func, *args):
+    """Run a blocking database write on the single writer thread"""
+    return await asyncio.get_running_loop().run_in_executor(_write_executor, func, *args)
+
+
 # Database helpers
-@contextmanager
+class PoolClosed(Exception):
+    """Raised on borrowing from a closed pool (its partition file was dropped)"""
+
+
+class ConnectionPool:
+    """
+    A small pool of long-lived SQLite connections.
+
+    Connections are opened lazily (up to size) and reused, so requests do
+    not pay connection setup and keep their prepared statement cache. Each
+    connection uses WAL journaling, so readers never block the writer.
+    """
+
+    PRAGMAS = (
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=NORMAL",  # durable with WAL; fsync at checkpoints only
+        "PRAGMA busy_timeout=5000",
+        "PRAGMA cache_size=-8000",     # 8 MB page cache per connection
+        "PRAGMA mmap_size=67108864",   # 64 MB memory-mapped reads
+        "PRAGMA temp_store=MEMORY",
+    )
+
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+        self._closed = False
+        # Statistics generation each open connection has loaded
+        self._statistics = 0
+        self._loaded = {}
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, cached_statements=256,
+                               uri=self.path.startswith("file:"))
+        conn.row_factory = sqlite3.Row
+        # Only while the file is empty (before WAL fixes its header; see
+        # migrate() for older files): on an existing one, setting it always
+        # rewrites the header, a write from every new connection
+        if conn.execute("PRAGMA page_count").fetchone()[0] == 0:
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        for pragma in self.PRAGMAS:
+            conn.execute(pragma)
+        # Used to maintain the duration sketches in the rollup tables
+        conn.create_function("sketch_merge", 2, merge_sketches, deterministic=True)
+        conn.create_aggregate("sketch_agg", 1, SketchAggregate)
+        # Stored text and metadata are compressed (see payload.py)
+        conn.create_function("payload_compress", 1, payload.compress, deterministic=True)
+        conn.create_function("payload_decompress", 1, payload.decompress, deterministic=True)
+        self._loaded[conn] = self._statistics
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection; it is rolled back and returned afterwards"""
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                # Checked and opened under the lock, so nothing reopens (and
+                # recreates) a dropped partition's file once close() is called
+                if self._closed:
+                    raise PoolClosed(self.path)
+                conn = None
+                if self._opened < self.size:
+                    conn = self._connect()
+                    self._opened += 1
+            if conn is None:
+                conn = self._idle.get(timeout=30)
+        if conn is None:
+            # close() left this behind to wake borrowers; pass it on
+            self._idle.put(None)
+            raise PoolClosed(self.path)
+        if self._loaded[conn] != self._statistics:
+            self._loaded[conn] = self._statistics
+            conn.execute("ANALYZE sqlite_schema")
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            with self._lock:
+                closed = self._closed
+                if closed:
+                    self._opened -= 1
+                    self._loaded.pop(conn, None)
+                else:
+                    self._idle.put(conn)
+            if closed:
+                conn.close()
+
+    def reload_statistics(self):
+        """
+        Have each connection reload the query planner's statistics before
+        its next use; a connection only reads them with the schema, so an
+        ANALYZE on another connection goes unseen otherwise
+        """
+        self._statistics += 1
+
+    def close(self):
+        """Close all idle connections, and any in use as they are returned"""
+        with self._lock:
+            self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            if conn is None:
+                continue
+            conn.close()
+            with self._lock:
+                self._opened -= 1
+                self._loaded.pop(conn, None)
+        # Wakes anyone waiting for a connection; they raise PoolClosed
+        self._idle.put(None)
+
+
+# Partitions
+# With METRICS_PARTITION set to 'day', 'week' or 'month', events are written
+# to one SQLite file per period in METRICS_PARTITION_DIR (for example
+# metrics-month-2024-05.sqlite). Each file is a complete metrics database
+# with its own rollups, payloads and search index, so every write is still
+# a single-file transaction, and age retention deletes whole files instead
+# of rows. Reads fan out over the files overlapping the requested range and
+# merge the results. METRICS_DB_PATH is always read as well: it holds every
+# event when partitioning is off, and those recorded before it was turned on.
+PARTITION_PERIODS = ("none", "day", "week", "month")
+PARTITION_FILE = re.compile(r"^metrics-(day|week|month)-(\d{4}-\d{2}(?:-\d{2})?)\.sqlite$")
+
+
+class Partition:
+    """A database file with its own connection pool"""
+
+    def __init__(self, path, start=None, end=None):
+        self.path = path
+        # ISO bounds of the period it holds; None for the main database
+        self.start = start
+        self.end = end
+        # One connection per reader thread plus one for the writer
+        self.pool = ConnectionPool(path, METRICS_DB_READERS + 1)
+
+    def connection(self):
+        """Borrow a pooled connection (use as a context manager)"""
+        return self.pool.connection()
+
+
+def partition_period(timestamp, period):
+    """Return (file name, start, end) of the day, week or month holding an ISO timestamp"""
+    start = datetime.fromisoformat(timestamp[:10])
+    if period == "day":
+        end = start + timedelta(days=1)
+        key = start.date().isoformat()
+    elif period == "week":
+        start -= timedelta(days=start.weekday())
+        end = start + timedelta(days=7)
+        key = start.date().isoformat()
+    else:  # month
+        start = start.replace(day=1)
+        end = (start + timedelta(days=32)).replace(day=1)
+        key = start.strftime("%Y-%m")
+    return f"metrics-{period}-{key}.sqlite", start.isoformat(), end.isoformat()
+
+
+STORAGE_BACKENDS = ("sqlite", "memory")
+
+
+def main_database():
+    """Where the main database lives: METRICS_DB_PATH, or memory named after it"""
+    if METRICS_STORAGE == "memory":
+        # A memdb database whose name starts with '/' is shared by every
+        # connection in the process, for as long as one of them is open
+        return f"file:{urllib.parse.quote(os.path.abspath(METRICS_DB_PATH))}?vfs=memdb"
+    return METRICS_DB_PATH
+
+
+_main = Partition(main_database())
+_pool = _main.pool
+_partitions = {}  # path -> Partition, period files only
+_partitions_lock = threading.Lock()
+
+
 def get_db():
-    """Get database connection with proper cleanup"""
-    conn = sqlite3.connect(METRICS_DB_PATH)
-    conn.row_factory = sqlite3.Row
+    """Get a pooled connection to the main database (use as a context manager)"""
+    return _pool.connection()
+
+
+def partitions(start=None, end=None):
+    """
+    Return the databases that may hold events in [start, end), newest first.
+
+    Period files are ordered by their start; the main database comes last.
+    """
+    with _partitions_lock:
+        found = [
+            partition for partition in _partitions.values()
+            if (start is None or partition.end > start) and (end is None or partition.start < end)
+        ]
+    found.sort(key=lambda partition: partition.start, reverse=True)
+    return found + [_main]
+
+
+def connections(databases):
+    """
+    Borrow a connection to each of databases in turn, for reads across them.
+
+    Yields (partition, conn). A partition file retention dropped after it
+    was listed is skipped: its events are gone either way.
+    """
+    for partition in databases:
+        try:
+            with partition.connection() as conn:
+                yield partition, conn
+        except PoolClosed:
+            continue
+
+
+def open_partition(name, start, end):
+    """Open a partition file (creating and migrating it if needed) and register it"""
+    os.makedirs(METRICS_PARTITION_DIR, exist_ok=True)
+    partition = Partition(os.path.join(METRICS_PARTITION_DIR, name), start, end)
+    with partition.connection() as conn:
+        migrate(conn)
+        # Event ids start at the period's day number << 32, so they are
+        # unique across files without any coordination between them
+        first_id = (datetime.fromisoformat(start) - datetime(1970, 1, 1)).days << 32
+        conn.execute("""
+            INSERT INTO sqlite_sequence (name, seq)
+            SELECT 'events', ? WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'events')
+        """, (first_id,))
+        conn.commit()
+    with _partitions_lock:
+        _partitions[partition.path] = partition
+    return partition
+
+
+def load_partitions():
+    """Open every partition file in METRICS_PARTITION_DIR (even with partitioning off)"""
+    if not os.path.isdir(METRICS_PARTITION_DIR):
+        return
+    for name in sorted(os.listdir(METRICS_PARTITION_DIR)):
+        match = PARTITION_FILE.match(name)
+        if match and os.path.join(METRICS_PARTITION_DIR, name) not in _partitions:
+            period, key = match.groups()
+            open_partition(*partition_period(key if period != "month" else f"{key}-01", period))
+
+
+def partition_for(timestamp):
+    """Return the database an event at this ISO timestamp is stored in (writer thread only)"""
+    if METRICS_PARTITION == "none":
+        return _main
+    with _partitions_lock:
+        for partition in _partitions.values():
+            if partition.start <= timestamp < partition.end:
+                return partition
+    return open_partition(*partition_period(timestamp, METRICS_PARTITION))
+
+
+def drop_partition(partition):
+    """Delete a partition file outright; return the number of events it held"""
+    with _partitions_lock:
+        _partitions.pop(partition.path, None)
+    with partition.connection() as conn:
+        count = conn.execute("SELECT COUNT(*) AS count FROM events").fetchone()["count"]
+    partition.pool.close()
+    for suffix in ("", "-wal", "-shm"):
+        try:
+            os.remove(partition.path + suffix)
+        except FileNotFoundError:
+            pass
+    return count
+
+
+# Memory storage
+# With METRICS_STORAGE=memory the main database is held in memory (SQLite's
+# memdb VFS) instead of in METRICS_DB_PATH, for read-only or flash-backed
+# deployments where the file is unavailable or its fsyncs are slow. It is
+# the same schema, so every endpoint, rollup and index works unchanged, and
+# METRICS_MAX_EVENTS retention evicts the oldest events to bound its size.
+# METRICS_DB_PATH becomes a snapshot: loaded at startup, and replaced
+# atomically every METRICS_SNAPSHOT_INTERVAL seconds (if anything changed)
+# and at shutdown. Events since the last snapshot are lost if the process
+# dies. Partitioning is not available in this mode.
+_snapshot_stats = {
+    "snapshots": 0,
+    "last_snapshot": None,
+    "last_duration_ms": None,
+    "last_bytes": None,
+    "last_error": None,
+}
+_snapshot_conn = None
+_snapshot_version = None
+
+
+def restore_snapshot(conn):
+    """Load METRICS_DB_PATH into the empty memory database on conn; return whether it did"""
+    if conn.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchone() or not os.path.exists(METRICS_DB_PATH):
+        return False
+    source = sqlite3.connect(METRICS_DB_PATH)
+    try:
+        # A database last used with METRICS_STORAGE=sqlite is in WAL mode,
+        # which memdb cannot open
+        source.execute("PRAGMA journal_mode=DELETE")
+        source.backup(conn)
+    finally:
+        source.close()
+    return True
+
+
+def memory_version():
+    """A number that changes whenever another connection commits to the memory database"""
+    global _snapshot_conn
+    if _snapshot_conn is None:
+        # Kept open, since data_version only counts commits seen since it opened
+        _snapshot_conn = sqlite3.connect(_main.path, uri=True, check_same_thread=False)
+        _snapshot_conn.execute("PRAGMA busy_timeout=5000")
+    return _snapshot_conn.execute("PRAGMA data_version").fetchone()[0]
+
+
+def write_snapshot():
+    """
+    Copy the memory database over METRICS_DB_PATH, atomically (by renaming
+    a temporary copy); return its size in bytes, or None if nothing changed
+    since the last snapshot
+    """
+    global _snapshot_version
+    version = memory_version()
+    if version == _snapshot_version:
+        return None
+    temporary = METRICS_DB_PATH + ".snapshot"
+    for path in (temporary, temporary + "-journal"):
+        if os.path.exists(path):
+            os.remove(path)
+    target = sqlite3.connect(temporary)
+    try:
+        # All pages in one step: a single consistent read of the database
+        _snapshot_conn.backup(target)
+    finally:
+        target.close()
+    os.replace(temporary, METRICS_DB_PATH)
+    directory = os.open(os.path.dirname(os.path.abspath(METRICS_DB_PATH)), os.O_RDONLY)
     try:
-        yield conn
+        os.fsync(directory)  # Make the rename itself durable
     finally:
-        conn.close()
+        os.close(directory)
+    _snapshot_version = version
+    return os.path.getsize(METRICS_DB_PATH)
+
+
+async def take_snapshot():
+    """Write a snapshot (on the reader pool: it only reads) and record the outcome"""
+    started = time.perf_counter()
+    try:
+        size = await run_read(write_snapshot)
+    except (OSError, sqlite3.Error) as e:
+        _snapshot_stats["last_error"] = str(e)
+        print(f"Snapshot to {METRICS_DB_PATH} failed: {e}")
+        return
+    if size is not None:
+        _snapshot_stats["snapshots"] += 1
+        _snapshot_stats["last_snapshot"] = datetime.utcnow().isoformat()
+        _snapshot_stats["last_duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        _snapshot_stats["last_bytes"] = size
+        _snapshot_stats["last_error"] = None
+
+
+async def snapshot_loop():
+    """Snapshot the memory database every METRICS_SNAPSHOT_INTERVAL seconds"""
+    while True:
+        await asyncio.sleep(METRICS_SNAPSHOT_INTERVAL)
+        await take_snapshot()
+
+
+def close_snapshots():
+    global _snapshot_conn
+    if _snapshot_conn is not None:
+        _snapshot_conn.close()
+        _snapshot_conn = None
+
+
+# Schema migrations
+# Each migration upgrades the schema by one version in its own transaction;
+# init_db() applies any the database has not seen yet, in order, and records
+# the result in schema_version. Append new migrations; never edit old ones.
+def migrate_base_schema(conn):
+    """v1: events and rollup tables (adopts databases from before versioning)"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT NOT NULL,
+            event_type TEXT NOT NULL,
+            duration_seconds REAL DEFAULT 0,
+            input_chars INTEGER DEFAULT 0,
+            output_chars INTEGER DEFAULT 0,
+            status TEXT DEFAULT 'success',
+            text_content TEXT,
+            metadata TEXT
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_events_timestamp ON events(timestamp)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_events_type ON events(event_type)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_events_timestamp_id ON events(timestamp, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_events_type_timestamp_id ON events(event_type, timestamp, id)")
+    for table, _ in ROLLUPS:
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                bucket TEXT NOT NULL,
+                event_type TEXT NOT NULL,
+                count INTEGER NOT NULL DEFAULT 0,
+                duration_seconds REAL NOT NULL DEFAULT 0,
+                input_chars INTEGER NOT NULL DEFAULT 0,
+                output_chars INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (bucket, event_type)
+            ) WITHOUT ROWID
+        """)
+
+
+# ISO timestamp -> integer milliseconds since 1970 UTC, and event type ->
+# category, in SQL. Inserts and queries use the same expressions so stored
+# values and converted bounds always match exactly.
+EPOCH_MS_SQL = "CAST(round((julianday({}) - 2440587.5) * 86400000) AS INTEGER)"
+CATEGORY_SQL = "CASE substr({}, 1, 4) WHEN 'asr_' THEN 'asr' WHEN 'tts_' THEN 'tts' END"
+
+# Metadata keys copied into columns of events, so summaries and series can
+# be grouped by them in SQL (metadata itself is stored compressed)
+DIMENSIONS = ("voice", "model", "language", "device", "target")
+DIMENSIONS_PATTERN = f"^({'|'.join(DIMENSIONS)})$"
+
+
+def add_derived_column(conn, column, definition, expression):
+    """Add a column computed from other columns, backfill it, and keep it filled"""
+    # Plain columns rather than generated ones: SQLite cannot use an index
+    # on a generated column as a covering index
+    conn.execute(f"ALTER TABLE events ADD COLUMN {column} {definition}")
+    conn.execute(f"UPDATE events SET {column} = {expression.format('timestamp', 'event_type')}")
+    # insert_event() fills the column itself; this catches any other writer
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS events_fill_{column} AFTER INSERT ON events
+        WHEN NEW.{column} IS NULL
+        BEGIN
+            UPDATE events SET {column} = {expression.format('NEW.timestamp', 'NEW.event_type')}
+            WHERE id = NEW.id;
+        END
+    """)
+
+
+def migrate_epoch_timestamp(conn):
+    """v2: epoch_ms, the ISO timestamp as an integer"""
+    add_derived_column(conn, "epoch_ms", "INTEGER", EPOCH_MS_SQL.format("{0}"))
+
+
+def migrate_category(conn):
+    """v3: category, 'asr' or 'tts' from the event type prefix"""
+    add_derived_column(conn, "category", "TEXT", CATEGORY_SQL.format("{1}"))
+
+
+def migrate_covering_indexes(conn):
+    """v4: integer-keyed indexes for history, retention and summaries"""
+    # History pages and retention walk (epoch_ms, id); filtered history
+    # seeks within one event type or category
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_events_epoch ON events(epoch_ms)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_events_type_epoch ON events(event_type, epoch_ms)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_events_category_epoch ON events(category, epoch_ms)")
+    # Covers the raw-event edge of a summary without touching the table
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_events_summary
+        ON events(epoch_ms, event_type, duration_seconds, input_chars, output_chars)
+    """)
+    for index in ("idx_events_timestamp", "idx_events_type", "idx_events_timestamp_id",
+                  "idx_events_type_timestamp_id"):
+        conn.execute(f"DROP INDEX IF EXISTS {index}")
+
+
+def migrate_rollup_sketches(conn):
+    """v5: a duration quantile sketch per rollup bucket"""
+    for table, _ in ROLLUPS:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN duration_sketch BLOB")
+    rebuild_rollups_from(conn)
+
+
+def migrate_text_search(conn):
+    """v6: FTS5 full-text index over stored text, kept in sync by triggers"""
+    # External content: the index stores tokens only and reads text (for
+    # snippets) back from events
+    conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS events_fts USING fts5(
+            text_content, content='events', content_rowid='id', tokenize='porter unicode61'
+        )
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS events_fts_insert AFTER INSERT ON events
+        WHEN NEW.text_content IS NOT NULL
+        BEGIN
+            INSERT INTO events_fts (rowid, text_content) VALUES (NEW.id, NEW.text_content);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS events_fts_delete AFTER DELETE ON events
+        WHEN OLD.text_content IS NOT NULL
+        BEGIN
+            INSERT INTO events_fts (events_fts, rowid, text_content) VALUES ('delete', OLD.id, OLD.text_content);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS events_fts_update AFTER UPDATE OF text_content ON events
+        BEGIN
+            INSERT INTO events_fts (events_fts, rowid, text_content)
+            SELECT 'delete', OLD.id, OLD.text_content WHERE OLD.text_content IS NOT NULL;
+            INSERT INTO events_fts (rowid, text_content)
+            SELECT NEW.id, NEW.text_content WHERE NEW.text_content IS NOT NULL;
+        END
+    """)
+    conn.execute("INSERT INTO events_fts (events_fts) VALUES ('rebuild')")
+
+
+def migrate_payload_table(conn):
+    """v7: compressed text and metadata in event_payloads, out of the events rows"""
+    # Keyed by event id; the sizes are the uncompressed UTF-8 lengths, kept
+    # for the storage report
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS event_payloads (
+            event_id INTEGER PRIMARY KEY,
+            text_content BLOB,
+            metadata BLOB,
+            text_size INTEGER,
+            metadata_size INTEGER
+        )
+    """)
+    conn.execute("""
+        INSERT INTO event_payloads (event_id, text_content, metadata, text_size, metadata_size)
+        SELECT id, payload_compress(text_content), payload_compress(metadata),
+               length(CAST(text_content AS BLOB)), length(CAST(metadata AS BLOB))
+        FROM events WHERE text_content IS NOT NULL OR metadata IS NOT NULL
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS events_delete_payload AFTER DELETE ON events
+        BEGIN
+            DELETE FROM event_payloads WHERE event_id = OLD.id;
+        END
+    """)
+    
+    # Re-point the search index at the decompressed text
+    for trigger in ("events_fts_insert", "events_fts_delete", "events_fts_update"):
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    conn.execute("DROP TABLE IF EXISTS events_fts")
+    conn.execute("ALTER TABLE events DROP COLUMN text_content")
+    conn.execute("ALTER TABLE events DROP COLUMN metadata")
+    conn.execute("""
+        CREATE VIEW IF NOT EXISTS event_text AS
+        SELECT event_id AS id, payload_decompress(text_content) AS text_content
+        FROM event_payloads WHERE text_content IS NOT NULL
+    """)
+    conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS events_fts USING fts5(
+            text_content, content='event_text', content_rowid='id', tokenize='porter unicode61'
+        )
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS event_payloads_fts_insert AFTER INSERT ON event_payloads
+        WHEN NEW.text_content IS NOT NULL
+        BEGIN
+            INSERT INTO events_fts (rowid, text_content)
+            VALUES (NEW.event_id, payload_decompress(NEW.text_content));
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS event_payloads_fts_delete AFTER DELETE ON event_payloads
+        WHEN OLD.text_content IS NOT NULL
+        BEGIN
+            INSERT INTO events_fts (events_fts, rowid, text_content)
+            VALUES ('delete', OLD.event_id, payload_decompress(OLD.text_content));
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS event_payloads_fts_update AFTER UPDATE OF text_content ON event_payloads
+        BEGIN
+            INSERT INTO events_fts (events_fts, rowid, text_content)
+            SELECT 'delete', OLD.event_id, payload_decompress(OLD.text_content) WHERE OLD.text_content IS NOT NULL;
+            INSERT INTO events_fts (rowid, text_content)
+            SELECT NEW.event_id, payload_decompress(NEW.text_content) WHERE NEW.text_content IS NOT NULL;
+        END
+    """)
+    conn.execute("INSERT INTO events_fts (events_fts) VALUES ('rebuild')")
+
+
+def migrate_client_uuid(conn):
+    """v8: optional client-supplied event uuid, unique so retries are ignored"""
+    # The 16 raw bytes; the partial index leaves events without one out
+    conn.execute("ALTER TABLE events ADD COLUMN uuid BLOB")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_events_uuid ON events(uuid) WHERE uuid IS NOT NULL")
+
+
+def migrate_metadata_dimensions(conn):
+    """v9: metadata dimension columns (voice, model, ...) for grouped summaries"""
+    for dimension in DIMENSIONS:
+        conn.execute(f"ALTER TABLE events ADD COLUMN {dimension} TEXT")
+    conn.execute(f"""
+        UPDATE events SET {', '.join(f"{d} = json_extract(metadata.json, '$.{d}')" for d in DIMENSIONS)}
+        FROM (
+            SELECT event_id, payload_decompress(metadata) AS json FROM event_payloads WHERE metadata IS NOT NULL
+        ) AS metadata
+        WHERE events.id = metadata.event_id AND json_valid(metadata.json)
+    """)
+    for dimension in DIMENSIONS:
+        # Partial, so only events carrying the key pay for the index, and
+        # covering, so grouped summaries and series never touch the table
+        conn.execute(f"""
+            CREATE INDEX IF NOT EXISTS idx_events_{dimension}
+            ON events(epoch_ms, {dimension}, event_type, status, duration_seconds, input_chars, output_chars)
+            WHERE {dimension} IS NOT NULL
+        """)
+
+
+MIGRATIONS = [
+    migrate_base_schema,
+    migrate_epoch_timestamp,
+    migrate_category,
+    migrate_covering_indexes,
+    migrate_rollup_sketches,
+    migrate_text_search,
+    migrate_payload_table,
+    migrate_client_uuid,
+    migrate_metadata_dimensions,
+]
+
+
+def schema_version(conn):
+    """Return the schema version recorded in the database (0 if none)"""
+    conn.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+    row = conn.execute("SELECT MAX(version) AS version FROM schema_version").fetchone()
+    return row["version"] or 0
+
+
+def migrate(conn):
+    """Apply pending migrations in order; return the list of versions applied"""
+    current = schema_version(conn)
+    if current > len(MIGRATIONS):
+        raise RuntimeError(
+            f"Database schema version {current} is newer than this service ({len(MIGRATIONS)})"
+        )
+    applied = []
+    for version, migration in enumerate(MIGRATIONS[current:], start=current + 1):
+        conn.execute("BEGIN")
+        try:
+            migration(conn)
+            conn.execute("INSERT INTO schema_version (version) VALUES (?)", (version,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print(f"Applied schema migration {migration.__doc__}")
+        applied.append(version)
+    # Not a numbered migration: VACUUM cannot run inside one's transaction,
+    # and the file header records the mode anyway. New files are created
+    # with it (see ConnectionPool._connect); older ones are rebuilt once.
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        # The rebuilt copy is as large as the database; keep it out of memory
+        conn.execute("PRAGMA temp_store=FILE")
+        conn.execute("VACUUM")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        print("Enabled incremental auto-vacuum")
+    return applied
 
 
 def init_db():
     """Initialize database tables"""
-    os.makedirs(os.path.dirname(METRICS_DB_PATH), exist_ok=True)
+    global _snapshot_version
+    if METRICS_PARTITION not in PARTITION_PERIODS:
+        raise RuntimeError(f"METRICS_PARTITION must be one of {', '.join(PARTITION_PERIODS)}")
+    if METRICS_STORAGE not in STORAGE_BACKENDS:
+        raise RuntimeError(f"METRICS_STORAGE must be one of {', '.join(STORAGE_BACKENDS)}")
+    memory = METRICS_STORAGE == "memory"
+    if memory and METRICS_PARTITION != "none":
+        raise RuntimeError("METRICS_PARTITION needs METRICS_STORAGE=sqlite")
+    if not memory or METRICS_SNAPSHOT_INTERVAL:
+        os.makedirs(os.path.dirname(METRICS_DB_PATH), exist_ok=True)
     
     with get_db() as conn:
-        conn.execute("""
-            CREATE TABLE IF NOT EXISTS events (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp TEXT NOT NULL,
-                event_type TEXT NOT NULL,
-                duration_seconds REAL DEFAULT 0,
-                input_chars INTEGER DEFAULT 0,
-                output_chars INTEGER DEFAULT 0,
-                status TEXT DEFAULT 'success',
-                text_content TEXT,
-                metadata TEXT
+        restored = memory and restore_snapshot(conn)
+        if restored:
+            # The snapshot file already holds everything restored
+            _snapshot_version = memory_version()
+        migrate(conn)
+    if not memory:
+        load_partitions()
+    
+    for partition in partitions():
+        with partition.connection() as conn:
+            # Databases from before rollups existed are backfilled once
+            has_events = conn.execute("SELECT 1 FROM events LIMIT 1").fetchone()
+            has_rollups = conn.execute("SELECT 1 FROM rollup_daily LIMIT 1").fetchone()
+            if has_events and not has_rollups:
+                rebuild_rollups_from(conn)
+                conn.commit()
+
+
+# Rollups
+# Per-hour and per-day totals for each event type, kept in step with the
+# events table inside the same transaction as every insert and delete.
+# Summaries read whole buckets from here and only touch raw events for the
+# partial hour at the start of the range, so their cost does not grow with
+# history. Buckets are keyed by their ISO start time, like event timestamps.
+# Each bucket also keeps a DDSketch of durations (see sketch.py), merged in
+# SQL by sketch_merge(), so percentiles come from rollups too.
+def hour_bucket(timestamp):
+    return timestamp[:13] + ":00:00"
+
+
+def day_bucket(timestamp):
+    return timestamp[:10] + "T00:00:00"
+
+
+ROLLUPS = (("rollup_hourly", hour_bucket), ("rollup_daily", day_bucket))
+
+# The same bucketing in SQL, for rebuilding rollups from events
+ROLLUP_BUCKET_SQL = {
+    "rollup_hourly": "substr(timestamp, 1, 13) || ':00:00'",
+    "rollup_daily": "substr(timestamp, 1, 10) || 'T00:00:00'",
+}
+
+ROLLUP_UPSERT_SQL = """
+    INSERT INTO {table} (bucket, event_type, count, duration_seconds, input_chars, output_chars, duration_sketch)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (bucket, event_type) DO UPDATE SET
+        count = count + excluded.count,
+        duration_seconds = duration_seconds + excluded.duration_seconds,
+        input_chars = input_chars + excluded.input_chars,
+        output_chars = output_chars + excluded.output_chars,
+        duration_sketch = sketch_merge(duration_sketch, excluded.duration_sketch)
+"""
+
+
+def apply_rollups(conn, rows, sign=1):
+    """
+    Add event rows to the rollup tables, or subtract them with sign=-1.
+
+    rows are (timestamp, event_type, duration_seconds, input_chars,
+    output_chars) tuples. The caller commits, so rollups change in the same
+    transaction as the events they describe.
+    """
+    for table, bucket in ROLLUPS:
+        totals = {}
+        sketches = {}
+        for timestamp, event_type, duration, input_chars, output_chars in rows:
+            key = (bucket(timestamp), event_type)
+            total = totals.setdefault(key, [0, 0.0, 0, 0])
+            total[0] += 1
+            total[1] += duration or 0
+            total[2] += input_chars or 0
+            total[3] += output_chars or 0
+            sketches.setdefault(key, DDSketch()).add(duration, sign)
+        conn.executemany(ROLLUP_UPSERT_SQL.format(table=table), [
+            (key[0], key[1], *(sign * value for value in total), sketches[key].to_bytes())
+            for key, total in totals.items()
+        ])
+        if sign < 0:
+            conn.executemany(
+                f"DELETE FROM {table} WHERE bucket = ? AND event_type = ? AND count <= 0",
+                list(totals)
             )
+
+
+def rebuild_rollups_from(conn):
+    """Recompute all rollups from the events table on conn (the caller commits)"""
+    for table, _ in ROLLUPS:
+        conn.execute(f"DELETE FROM {table}")
+        conn.execute(f"""
+            INSERT INTO {table} (bucket, event_type, count, duration_seconds, input_chars, output_chars, duration_sketch)
+            SELECT {ROLLUP_BUCKET_SQL[table]}, event_type, COUNT(*),
+                   COALESCE(SUM(duration_seconds), 0), COALESCE(SUM(input_chars), 0),
+                   COALESCE(SUM(output_chars), 0), sketch_agg(duration_seconds)
+            FROM events GROUP BY 1, 2
         """)
-        conn.execute("CREATE INDEX IF NOT EXISTS idx_events_timestamp ON events(timestamp)")
-        conn.execute("CREATE INDEX IF NOT EXISTS idx_events_type ON events(event_type)")
+
+
+def rebuild_rollups():
+    """Recompute all rollups from the events tables; return the event count"""
+    count = 0
+    for partition in partitions():
+        with partition.connection() as conn:
+            rebuild_rollups_from(conn)
+            count += conn.execute("SELECT COUNT(*) AS count FROM events").fetchone()["count"]
+            conn.commit()
+    _summary_cache.invalidate()
+    return count
+
+
+# Retention
+# Cleanup runs in the background (every METRICS_CLEANUP_INTERVAL seconds, or
+# sooner once inserts push the table past METRICS_MAX_EVENTS by a margin)
+# instead of after every insert. Rows are deleted in bounded batches through
+# the timestamp index, each batch its own write so inserts interleave.
+# Partition files are deleted whole once their period has expired; their
+# rows are only deleted one by one to enforce METRICS_MAX_EVENTS.
+_retention_stats = {
+    "runs": 0,
+    "last_run": None,
+    "last_duration_ms": None,
+    "last_deleted": 0,
+    "total_deleted": 0,
+    "row_estimate": 0,
+}
+_retention_wakeup: Optional[asyncio.Event] = None
+
+
+def retention_threshold():
+    """Row count at which cleanup is triggered ahead of schedule"""
+    return METRICS_MAX_EVENTS + max(100, METRICS_MAX_EVENTS // 10)
+
+
+def retention_cutoff():
+    """
+    Return (age_cutoff, count_cutoff): timestamps before which events are past
+    METRICS_RETENTION_DAYS, or beyond METRICS_MAX_EVENTS (None if there are
+    not that many events).
+    """
+    age_cutoff = (datetime.utcnow() - timedelta(days=METRICS_RETENTION_DAYS)).isoformat()
+    offset = max(METRICS_MAX_EVENTS - 1, 0)
+    for _, conn in connections(partitions()):
+        # Timestamp of the Nth newest event; anything older exceeds max events
+        row = conn.execute(
+            "SELECT timestamp FROM events ORDER BY epoch_ms DESC LIMIT 1 OFFSET ?", (offset,)
+        ).fetchone()
+        if row:
+            return age_cutoff, row["timestamp"]
+        offset -= conn.execute("SELECT COUNT(*) AS count FROM events").fetchone()["count"]
+    return age_cutoff, None
+
+
+def delete_events_before(cutoff, limit, partition=None):
+    """Delete up to limit of the oldest events before cutoff (from the main database by default); return count"""
+    with (partition or _main).connection() as conn:
+        rows = conn.execute(f"""
+            SELECT id, timestamp, event_type, duration_seconds, input_chars, output_chars
+            FROM events WHERE epoch_ms < {EPOCH_MS_SQL.format('?')} ORDER BY epoch_ms LIMIT ?
+        """, (cutoff, limit)).fetchall()
+        apply_rollups(conn, [tuple(row)[1:] for row in rows], sign=-1)
+        conn.executemany("DELETE FROM events WHERE id = ?", [(row["id"],) for row in rows])
         conn.commit()
+        return len(rows)
 
 
-def cleanup_old_events():
+def count_events():
+    """Count all stored events"""
+    count = 0
+    for _, conn in connections(partitions()):
+        count += conn.execute("SELECT COUNT(*) AS count FROM events").fetchone()["count"]
+    return count
+
+
+async def cleanup_old_events():
     """Remove events older than retention period and enforce max events"""
-    with get_db() as conn:
-        # Remove old events
-        cutoff = (datetime.utcnow() - timedelta(days=METRICS_RETENTION_DAYS)).isoformat()
-        conn.execute("DELETE FROM events WHERE timestamp < ?", (cutoff,))
-        
-        # Enforce max events (keep newest)
-        conn.execute("""
-            DELETE FROM events WHERE id NOT IN (
-                SELECT id FROM events ORDER BY timestamp DESC LIMIT ?
-            )
-        """, (METRICS_MAX_EVENTS,))
+    started = time.perf_counter()
+    age_cutoff, count_cutoff = await run_read(retention_cutoff)
+    cutoff = max(age_cutoff, count_cutoff or age_cutoff)
+    deleted = 0
+    for partition in partitions(end=cutoff):
+        if partition.end is not None and partition.end <= cutoff:
+            deleted += await run_write(drop_partition, partition)
+            continue
+        # By age, partitions expire whole rather than row by row
+        partition_cutoff = cutoff if partition is _main else count_cutoff
+        if partition_cutoff is None:
+            continue
+        while True:
+            batch = await run_write(delete_events_before, partition_cutoff, METRICS_CLEANUP_BATCH, partition)
+            deleted += batch
+            if batch < METRICS_CLEANUP_BATCH:
+                break
+    
+    _retention_stats["runs"] += 1
+    _retention_stats["last_run"] = datetime.utcnow().isoformat()
+    _retention_stats["last_duration_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    _retention_stats["last_deleted"] = deleted
+    _retention_stats["total_deleted"] += deleted
+    _retention_stats["row_estimate"] = await run_read(count_events)
+    if deleted:
+        _summary_cache.invalidate()
+    if deleted and _live_feed:
+        _live_feed.publish("reset", {})
+
+
+def note_inserted(count):
+    """Track inserts and wake the retention task if the table grew too large"""
+    global _last_insert
+    _last_insert = time.monotonic()
+    _retention_stats["row_estimate"] += count
+    if _retention_stats["row_estimate"] > retention_threshold() and _retention_wakeup is not None:
+        _retention_wakeup.set()
+
+
+async def retention_loop():
+    """Run cleanup periodically, or early when woken by note_inserted()"""
+    while True:
+        try:
+            await asyncio.wait_for(_retention_wakeup.wait(), timeout=METRICS_CLEANUP_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _retention_wakeup.clear()
+        try:
+            await cleanup_old_events()
+        except Exception as e:
+            print(f"Retention cleanup failed: {e}")
+
+
+# Storage maintenance
+# Deleted rows leave free pages behind, which SQLite reuses but never gives
+# back, so after retention or a cleared history the file stays at its
+# largest. Databases use incremental auto-vacuum (see migrate()), and every
+# METRICS_MAINTENANCE_INTERVAL, once no events have arrived for
+# METRICS_MAINTENANCE_IDLE seconds, a background pass returns free pages to
+# the filesystem METRICS_VACUUM_PAGES at a time (each step its own write, so
+# inserts interleave, and stopping as soon as events arrive again), then
+# refreshes the query planner's statistics with a bounded ANALYZE.
+ANALYSIS_LIMIT = 1000  # rows sampled per index by ANALYZE
+_maintenance_stats = {
+    "runs": 0,
+    "last_run": None,
+    "last_duration_ms": None,
+    "last_freed_pages": 0,
+    "total_freed_pages": 0,
+    "last_error": None,
+}
+_maintenance_wakeup: Optional[asyncio.Event] = None
+_last_insert = 0.0  # time.monotonic() of the last stored event
+
+
+def dropped(partition):
+    """Whether retention deleted a partition file since it was listed (writer thread only)"""
+    return partition is not _main and partition.path not in _partitions
+
+
+def vacuum_step(partition, pages):
+    """Return up to pages free pages of a database to the filesystem; return (freed, still free)"""
+    if dropped(partition):
+        return 0, 0
+    with partition.connection() as conn:
+        before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if before:
+            # execute() would only step the pragma once, freeing one page
+            conn.executescript(f"PRAGMA incremental_vacuum({int(pages)})")
+        after = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    return before - after, after
+
+
+def analyze_database(partition):
+    """Refresh a database's query planner statistics, for every pooled connection"""
+    if dropped(partition):
+        return
+    with partition.connection() as conn:
+        conn.execute(f"PRAGMA analysis_limit={ANALYSIS_LIMIT}")
+        conn.execute("ANALYZE")
         conn.commit()
+    partition.pool.reload_statistics()
+
+
+def checkpoint_database(partition):
+    """Copy the WAL into the database file now, so vacuumed pages leave the file"""
+    if dropped(partition):
+        return
+    with partition.connection() as conn:
+        # A busy reader makes this a no-op; the next automatic checkpoint
+        # shrinks the file instead
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+
+
+def idle_for():
+    """Seconds since the last event was stored"""
+    return time.monotonic() - _last_insert
+
+
+async def run_maintenance():
+    """Vacuum free pages and refresh statistics in every database, while idle"""
+    started = time.perf_counter()
+    freed = 0
+    for partition in partitions():
+        partition_freed = 0
+        while idle_for() >= METRICS_MAINTENANCE_IDLE:
+            step, remaining = await run_write(vacuum_step, partition, METRICS_VACUUM_PAGES)
+            partition_freed += step
+            if not remaining or not step:
+                break
+        await run_write(analyze_database, partition)
+        if partition_freed:
+            await run_write(checkpoint_database, partition)
+        freed += partition_freed
+    
+    _maintenance_stats["runs"] += 1
+    _maintenance_stats["last_run"] = datetime.utcnow().isoformat()
+    _maintenance_stats["last_duration_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    _maintenance_stats["last_freed_pages"] = freed
+    _maintenance_stats["total_freed_pages"] += freed
+    _maintenance_stats["last_error"] = None
+
+
+async def maintenance_loop():
+    """Run maintenance periodically (or early once woken), after METRICS_MAINTENANCE_IDLE quiet seconds"""
+    while True:
+        try:
+            await asyncio.wait_for(_maintenance_wakeup.wait(), timeout=METRICS_MAINTENANCE_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _maintenance_wakeup.clear()
+        while idle_for() < METRICS_MAINTENANCE_IDLE:
+            await asyncio.sleep(METRICS_MAINTENANCE_IDLE - idle_for())
+        try:
+            await run_maintenance()
+        except Exception as e:
+            _maintenance_stats["last_error"] = str(e)
+            print(f"Storage maintenance failed: {e}")
+
+
+# Write-behind buffer
+# With METRICS_WRITE_BEHIND, events are acknowledged as soon as they are
+# queued in memory and committed in groups: every METRICS_FLUSH_INTERVAL_MS,
+# or as soon as METRICS_FLUSH_EVENTS are waiting. One transaction per group
+# instead of per event is what makes ingest fast on slow storage. The queue
+# holds at most METRICS_BUFFER_SIZE events; beyond that, requests are refused
+# so clients can retry. Queued events are lost if the process dies before a
+# flush, and are not visible to reads until then.
+class WriteBuffer:
+    """A bounded queue of event rows, group-committed by run()"""
+
+    def __init__(self, max_size, flush_events, flush_interval):
+        self.max_size = max_size
+        self.flush_events = flush_events
+        self.flush_interval = flush_interval
+        self.rows = []
+        self._pending = asyncio.Event()  # rows are waiting
+        self._full = asyncio.Event()     # a whole group is waiting
+        self._stopping = False
+        self.stats = {
+            "depth": 0,
+            "flushes": 0,
+            "flushed": 0,
+            "last_flush_ms": None,
+            "max_flush_ms": None,
+            "last_flush_size": 0,
+            "rejected": 0,
+            "dropped": 0,
+        }
+
+    def add(self, rows):
+        """Queue rows; return False (and queue nothing) if they do not fit"""
+        if len(self.rows) + len(rows) > self.max_size:
+            self.stats["rejected"] += len(rows)
+            return False
+        self.rows.extend(rows)
+        self.stats["depth"] = len(self.rows)
+        self._pending.set()
+        if len(self.rows) >= self.flush_events:
+            self._full.set()
+        return True
+
+    async def flush(self):
+        """Commit everything queued so far in one transaction"""
+        rows, self.rows = self.rows, []
+        self.stats["depth"] = 0
+        self._pending.clear()
+        self._full.clear()
+        if not rows:
+            return
+        started = time.perf_counter()
+        try:
+            inserted = await run_write(insert_events, rows)
+        except Exception as e:
+            self.stats["dropped"] += len(rows)
+            print(f"Dropped {len(rows)} buffered events: {e}")
+            return
+        elapsed = round((time.perf_counter() - started) * 1000, 2)
+        self.stats["flushes"] += 1
+        self.stats["flushed"] += len(rows)
+        self.stats["last_flush_ms"] = elapsed
+        self.stats["max_flush_ms"] = max(self.stats["max_flush_ms"] or 0, elapsed)
+        self.stats["last_flush_size"] = len(rows)
+        events_stored(inserted)
+
+    async def run(self):
+        """Flush a group once it is full or has waited flush_interval, until stopped and empty"""
+        # Rows queued while a flush awaits the writer were acknowledged too,
+        # so a stop only ends the loop once nothing is left
+        while not self._stopping or self.rows:
+            await self._pending.wait()
+            if not self._stopping:
+                try:
+                    await asyncio.wait_for(self._full.wait(), timeout=self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            await self.flush()
+
+    def stop(self):
+        """Make run() flush what is queued and return"""
+        self._stopping = True
+        self._pending.set()
+        self._full.set()
+
+
+_write_buffer: Optional[WriteBuffer] = None
+
+
+# Identifies this run of the service in live feed message ids and HTTP validators
+BOOT_ID = format(time.time_ns(), "x")
+
+# Live feed
+LIVE_QUEUE_SIZE = 64     # messages a subscriber may fall behind before a reset
+LIVE_REPLAY_SIZE = 256   # messages kept for clients reconnecting with Last-Event-ID
+LIVE_PING_SECONDS = 15   # comment sent on an idle stream to keep proxies from closing it
+LIVE_RECONNECT_SECONDS = 60  # how long after the last subscriber leaves to keep logging for replay
+
+# Dashboards subscribe to /api/metrics/live instead of polling the summary
+# and history. Each committed group of events is published once, with the
+# summary totals it adds, and fanned out to a bounded queue per subscriber,
+# so an idle dashboard costs no queries at all. The last few messages are
+# kept so a client that reconnects with Last-Event-ID misses nothing; one
+# that falls further behind, or lets its queue fill up, gets a 'reset' and
+# should reload.
+class LiveFeed:
+    """Fan-out of stored events to live subscribers, with a short replay log"""
+
+    def __init__(self, queue_size, replay_size):
+        self.queue_size = queue_size
+        self.subscribers = set()
+        self.recent = deque(maxlen=replay_size)
+        self.seq = 0
+        self.idle_since = float("-inf")  # when the last subscriber left
+        self.boot = BOOT_ID
+        self.stats = {"subscribers": 0, "published": 0, "lagged": 0}
+
+    def message_id(self, seq):
+        return f"{self.boot}-{seq}"
+
+    def publish(self, kind, data):
+        """Send a message to every subscriber and keep it for replay"""
+        self.seq += 1
+        message = (self.message_id(self.seq), kind, json.dumps(data))
+        self.recent.append((self.seq, message))
+        self.stats["published"] += 1
+        for queue in self.subscribers:
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                self.stats["lagged"] += 1
+                self._reset(queue)
+
+    def publish_events(self, inserted):
+        """Publish stored (id, row) pairs and the summary totals they add"""
+        if not self.subscribers and time.monotonic() - self.idle_since > LIVE_RECONNECT_SECONDS:
+            # Nobody to send to or replay for; skip building the message, but
+            # leave a gap so a late reconnect is reset rather than misled
+            self.seq += 1
+            self.recent.clear()
+            return
+        self.publish("events", {
+            "events": [event_response(event_id, row).model_dump() for event_id, row in inserted],
+            "summary": summary_fields(*summary_stats(event_totals(row for _, row in inserted))),
+            "since": min(row[0] for _, row in inserted),
+        })
+
+    def _reset(self, queue):
+        """Replace whatever a subscriber has queued with a reset"""
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait((self.message_id(self.seq), "reset", "{}"))
+
+    def subscribe(self, last_event_id=None):
+        """Return a new subscriber queue, primed with anything missed since last_event_id"""
+        queue = asyncio.Queue(self.queue_size)
+        if last_event_id:
+            boot, _, seq = last_event_id.partition("-")
+            seq = int(seq) if boot == self.boot and seq.isdigit() else -1
+            missed = [message for message_seq, message in self.recent if message_seq > seq]
+            oldest = self.recent[0][0] if self.recent else self.seq + 1
+            if seq < oldest - 1 or len(missed) > self.queue_size:
+                self._reset(queue)
+            else:
+                for message in missed:
+                    queue.put_nowait(message)
+        self.subscribers.add(queue)
+        self.stats["subscribers"] = len(self.subscribers)
+        return queue
+
+    def unsubscribe(self, queue):
+        self.subscribers.discard(queue)
+        self.stats["subscribers"] = len(self.subscribers)
+        if not self.subscribers:
+            self.idle_since = time.monotonic()
+
+    def close(self):
+        """End every subscriber's stream"""
+        for queue in self.subscribers:
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(None)
+
+
+_live_feed: Optional[LiveFeed] = None
 
 
 # Lifespan context manager for startup/shutdown
@@ -97,32 +1329,81 @@ from contextlib import asynccontextmanager
 
 @asynccontextmanager
 async def lifespan(app):
+    global _retention_wakeup, _maintenance_wakeup, _write_buffer, _live_feed
     # Startup
+    retention_task = None
+    maintenance_task = None
+    flush_task = None
+    snapshot_task = None
     if METRICS_ENABLED:
-        init_db()
-        cleanup_old_events()
+        await run_write(init_db)
+        await cleanup_old_events()
+        _retention_wakeup = asyncio.Event()
+        retention_task = asyncio.create_task(retention_loop())
+        if METRICS_MAINTENANCE_INTERVAL:
+            _maintenance_wakeup = asyncio.Event()
+            maintenance_task = asyncio.create_task(maintenance_loop())
+        _live_feed = LiveFeed(LIVE_QUEUE_SIZE, LIVE_REPLAY_SIZE)
+        if METRICS_WRITE_BEHIND:
+            _write_buffer = WriteBuffer(METRICS_BUFFER_SIZE, METRICS_FLUSH_EVENTS, METRICS_FLUSH_INTERVAL_MS / 1000)
+            flush_task = asyncio.create_task(_write_buffer.run())
+        if METRICS_STORAGE == "memory" and METRICS_SNAPSHOT_INTERVAL:
+            snapshot_task = asyncio.create_task(snapshot_loop())
     yield
-    # Shutdown (nothing to cleanup)
+    # Shutdown: flush buffered events, stop background cleanup, take a last
+    # snapshot, let queued writes finish, then close connections
+    if flush_task:
+        _write_buffer.stop()
+        await flush_task
+        _write_buffer = None
+    if _live_feed:
+        _live_feed.close()
+        _live_feed = None
+    for task in (retention_task, maintenance_task):
+        if task:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+    if snapshot_task:
+        snapshot_task.cancel()
+        try:
+            await snapshot_task
+        except asyncio.CancelledError:
+            pass
+        await take_snapshot()
+    _write_executor.shutdown(wait=True)
+    _read_executor.shutdown(wait=True)
+    close_snapshots()
+    for partition in partitions():
+        partition.pool.close()
 
 # Update app to use lifespan
 app.router.lifespan_context = lifespan
 
 
 # Request/Response models
+MAX_EVENT_SECONDS = 7 * 86400  # longest duration an event may report
+
+
 class MetricEvent(BaseModel):
     """A single metrics event"""
     event_type: str = Field(..., description="Type: 'asr_record', 'asr_transcribe', 'tts_synthesize', 'tts_play'")
-    duration_seconds: float = Field(default=0, description="Duration in seconds")
+    duration_seconds: float = Field(default=0, allow_inf_nan=False, le=MAX_EVENT_SECONDS,
+                                    description="Duration in seconds (at most a week)")
     input_chars: int = Field(default=0, description="Input character count")
     output_chars: int = Field(default=0, description="Output character count")
     status: str = Field(default="success", description="Status: 'success', 'error'")
     text_content: Optional[str] = Field(default=None, description="Text content (only stored if METRICS_STORE_TEXT=true)")
     metadata: Optional[dict] = Field(default=None, description="Additional metadata")
+    timestamp: Optional[datetime] = Field(default=None, description="When the event happened (ISO 8601); defaults to the time it is received")
+    uuid: Optional[UUID] = Field(default=None, description="Client-generated id; an event whose uuid is already stored is ignored, so retries are safe")
 
 
 class EventResponse(BaseModel):
-    """Response for a stored event"""
-    id: int
+    """Response for a stored event (id is None while it waits in the write-behind buffer)"""
+    id: Optional[int] = None
     timestamp: str
     event_type: str
     duration_seconds: float
@@ -131,6 +1412,18 @@ class EventResponse(BaseModel):
     status: str
     text_content: Optional[str] = None
     metadata: Optional[dict] = None
+    uuid: Optional[str] = None
+
+
+class GroupTotals(BaseModel):
+    """Totals for one event type among events with one value of a dimension"""
+    group: str
+    event_type: str
+    count: int
+    errors: int
+    duration_seconds: float
+    input_chars: int
+    output_chars: int
 
 
 class SummaryResponse(BaseModel):
@@ -144,14 +1437,104 @@ class SummaryResponse(BaseModel):
     tts_seconds_generated: float
     total_input_chars: int
     total_output_chars: int
+    group_by: Optional[str] = None
+    groups: Optional[List[GroupTotals]] = None
+
+
+class SeriesPoint(BaseModel):
+    """Totals and duration percentiles for one event type (and group) in one bucket"""
+    bucket: str
+    event_type: str
+    group: Optional[str] = None
+    count: int
+    duration_seconds: float
+    input_chars: int
+    output_chars: int
+    p50: Optional[float] = None
+    p95: Optional[float] = None
+    p99: Optional[float] = None
+
+
+class TimeseriesResponse(BaseModel):
+    """Per-bucket series, plus totals over the whole range"""
+    range: str
+    bucket: str
+    start: str
+    series: List[SeriesPoint]
+    totals: List[SeriesPoint]
 
 
 class HistoryResponse(BaseModel):
     """Paginated history response"""
     events: List[EventResponse]
-    total: int
+    total: Optional[int] = None
     limit: int
     offset: int
+    next_cursor: Optional[str] = None
+
+
+class SearchResult(BaseModel):
+    """One full-text search match"""
+    id: int
+    timestamp: str
+    event_type: str
+    status: str
+    rank: float
+    snippet: str
+
+
+class SearchResponse(BaseModel):
+    """Ranked full-text search results"""
+    query: str
+    results: List[SearchResult]
+    next_cursor: Optional[str] = None
+
+
+class BatchResponse(BaseModel):
+    """Response for a batch of stored events (duplicates is None while they wait in the write-behind buffer)"""
+    success: bool
+    count: int
+    duplicates: Optional[int] = None
+
+
+class ImportResponse(BaseModel):
+    """Response for an import: events read, newly stored, and already stored"""
+    success: bool
+    count: int
+    imported: int
+    duplicates: int
+    seconds: float
+    rows_per_second: float
+
+
+class DatabaseStorage(BaseModel):
+    """Page usage of one database file"""
+    name: str
+    page_size: int
+    page_count: int
+    free_pages: int
+    database_bytes: int
+    wal_bytes: int
+    auto_vacuum: str
+    analyzed: bool
+
+
+class StorageResponse(BaseModel):
+    """Space used by stored text and metadata, and by the database files"""
+    partitions: int
+    payloads: int
+    text_bytes: int
+    metadata_bytes: int
+    stored_bytes: int
+    saved_bytes: int
+    compression_ratio: Optional[float] = None
+    database_bytes: int
+    free_bytes: int
+    page_count: int
+    free_pages: int
+    wal_bytes: int
+    databases: List[DatabaseStorage]
+    maintenance: dict
 
 
 class ConfigResponse(BaseModel):
@@ -171,7 +1554,16 @@ async def health():
         "metrics_enabled": METRICS_ENABLED,
         "store_text": METRICS_STORE_TEXT,
         "retention_days": METRICS_RETENTION_DAYS,
-        "max_events": METRICS_MAX_EVENTS
+        "max_events": METRICS_MAX_EVENTS,
+        "storage": METRICS_STORAGE,
+        "snapshots": _snapshot_stats if METRICS_STORAGE == "memory" else None,
+        "partition": METRICS_PARTITION,
+        "partitions": len(partitions()) - 1,
+        "retention": _retention_stats,
+        "maintenance": _maintenance_stats if METRICS_MAINTENANCE_INTERVAL else None,
+        "write_buffer": _write_buffer.stats if _write_buffer else None,
+        "live": _live_feed.stats if _live_feed else None,
+        "summary_cache": _summary_cache.stats
     }
 
 
@@ -187,173 +1579,940 @@ async def get_config():
     )
 
 
+def naive_utc(value):
+    """Convert an aware datetime to naive UTC, the form timestamps are stored in"""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def event_timestamp(event, now):
+    """Use the client's event time if given (as naive UTC, never in the future)"""
+    if event.timestamp is None:
+        return now.isoformat()
+    return min(naive_utc(event.timestamp), now).isoformat()
+
+
+def event_row(event, timestamp):
+    """Build the events table row for an incoming event"""
+    # Only store text if explicitly enabled
+    text_content = event.text_content if METRICS_STORE_TEXT else None
+    metadata_json = json.dumps(event.metadata) if event.metadata else None
+    return (
+        timestamp,
+        event.event_type,
+        event.duration_seconds,
+        event.input_chars,
+        event.output_chars,
+        event.status,
+        event.uuid.bytes if event.uuid else None,
+        text_content,
+        metadata_json
+    )
+
+
+def format_uuid(value):
+    """The canonical string form of a stored uuid (None stays None)"""
+    return str(UUID(bytes=value)) if value is not None else None
+
+
+# Parameters are the row's event columns and its metadata JSON (?8)
+INSERT_EVENT_SQL = f"""
+    INSERT INTO events (timestamp, event_type, duration_seconds, input_chars, output_chars, status, uuid,
+                        epoch_ms, category, {', '.join(DIMENSIONS)})
+    VALUES (?1, ?2, ?3, ?4, ?5, ?6, ?7, {EPOCH_MS_SQL.format('?1')}, {CATEGORY_SQL.format('?2')},
+            {', '.join(f"json_extract(?8, '$.{dimension}')" for dimension in DIMENSIONS)})
+"""
+
+INSERT_PAYLOAD_SQL = """
+    INSERT INTO event_payloads (event_id, text_content, metadata, text_size, metadata_size)
+    VALUES (?, ?, ?, ?, ?)
+"""
+
+
+def payload_row(event_id, text_content, metadata_json):
+    """Build the event_payloads row for an event's text and metadata JSON"""
+    return (
+        event_id,
+        payload.compress(text_content),
+        payload.compress(metadata_json),
+        len(text_content.encode()) if text_content is not None else None,
+        len(metadata_json.encode()) if metadata_json is not None else None
+    )
+
+
+def insert_row(conn, row):
+    """Insert one event row and its compressed payload, if any; return its id"""
+    event_id = conn.execute(INSERT_EVENT_SQL, row[:7] + row[8:]).lastrowid
+    if row[7] is not None or row[8] is not None:
+        conn.execute(INSERT_PAYLOAD_SQL, payload_row(event_id, row[7], row[8]))
+    return event_id
+
+
+# Well under SQLite's limit on bound parameters per statement
+UUID_LOOKUP_CHUNK = 500
+
+
+def stored_uuids(conn, uuids):
+    """Map each of uuids already in the events table to its event id"""
+    stored = {}
+    for i in range(0, len(uuids), UUID_LOOKUP_CHUNK):
+        chunk = uuids[i:i + UUID_LOOKUP_CHUNK]
+        stored.update(conn.execute(
+            f"SELECT uuid, id FROM events WHERE uuid IN ({', '.join('?' * len(chunk))})", chunk
+        ).fetchall())
+    return stored
+
+
+def new_rows(conn, rows):
+    """
+    Drop rows whose uuid is already stored, or repeats an earlier row's.
+
+    Duplicates are filtered before inserting, rather than left to the
+    unique index, so that rollups count each event once. All writes go
+    through the single writer thread, so nothing can slip in between.
+    """
+    uuids = [row[6] for row in rows if row[6] is not None]
+    if not uuids:
+        return rows
+    seen = set(stored_uuids(conn, uuids))
+    fresh = []
+    for row in rows:
+        if row[6] is not None:
+            if row[6] in seen:
+                continue
+            seen.add(row[6])
+        fresh.append(row)
+    return fresh
+
+
+def insert_event(row):
+    """
+    Insert one event row (and its payload and rollups); return (id, True),
+    or (stored id, False) if its uuid is already stored
+    """
+    with partition_for(row[0]).connection() as conn:
+        if row[6] is not None:
+            stored = stored_uuids(conn, [row[6]])
+            if stored:
+                return stored[row[6]], False
+        event_id = insert_row(conn, row)
+        apply_rollups(conn, [row[:5]])
+        conn.commit()
+        return event_id, True
+
+
+def insert_events(rows):
+    """
+    Insert many event rows (and their payloads and rollups), one transaction
+    per database; return (id, row) for each row that was new (not already
+    stored by uuid)
+    """
+    by_partition = {}
+    for row in rows:
+        by_partition.setdefault(partition_for(row[0]), []).append(row)
+    inserted = []
+    for partition, partition_rows in by_partition.items():
+        with partition.connection() as conn:
+            partition_rows = new_rows(conn, partition_rows)
+            if not partition_rows:
+                continue
+            conn.executemany(INSERT_EVENT_SQL, [row[:7] + row[8:] for row in partition_rows])
+            # AUTOINCREMENT ids are consecutive within the writer's transaction
+            last_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+            ids = range(last_id - len(partition_rows) + 1, last_id + 1)
+            conn.executemany(INSERT_PAYLOAD_SQL, [
+                payload_row(event_id, row[7], row[8])
+                for event_id, row in zip(ids, partition_rows)
+                if row[7] is not None or row[8] is not None
+            ])
+            apply_rollups(conn, [row[:5] for row in partition_rows])
+            conn.commit()
+            inserted += zip(ids, partition_rows)
+    return inserted
+
+
+def event_response(event_id, row):
+    """The EventResponse for an event row"""
+    return EventResponse(
+        id=event_id,
+        timestamp=row[0],
+        event_type=row[1],
+        duration_seconds=row[2],
+        input_chars=row[3],
+        output_chars=row[4],
+        status=row[5],
+        text_content=row[7],
+        metadata=json.loads(row[8]) if row[8] else None,
+        uuid=format_uuid(row[6])
+    )
+
+
+def events_stored(inserted):
+    """Tell the retention task and live subscribers about newly stored (id, row) pairs"""
+    note_inserted(len(inserted))
+    if inserted:
+        _summary_cache.add([row for _, row in inserted])
+    if inserted and _live_feed:
+        _live_feed.publish_events(inserted)
+
+
+def buffer_rows(rows, response):
+    """Queue rows in the write-behind buffer and mark the response 202 Accepted"""
+    if not _write_buffer.add(rows):
+        raise HTTPException(status_code=503, detail="Event buffer is full, retry later",
+                            headers={"Retry-After": "1"})
+    response.status_code = 202
+
+
 # Record event
 @app.post("/api/metrics/event", response_model=EventResponse)
-async def record_event(event: MetricEvent):
+async def record_event(event: MetricEvent, response: Response):
     """Record a metrics event"""
     if not METRICS_ENABLED:
         raise HTTPException(status_code=503, detail="Metrics collection is disabled")
     
-    timestamp = datetime.utcnow().isoformat()
+    row = event_row(event, event_timestamp(event, datetime.utcnow()))
+    if _write_buffer:
+        buffer_rows([row], response)
+        return event_response(None, row)
     
-    # Only store text if explicitly enabled
-    text_content = event.text_content if METRICS_STORE_TEXT else None
-    metadata_json = json.dumps(event.metadata) if event.metadata else None
+    event_id, new = await run_write(insert_event, row)
+    if new:
+        events_stored([(event_id, row)])
+    return event_response(event_id, row)
+
+
+# Record a batch of events
+@app.post("/api/metrics/events", response_model=BatchResponse)
+async def record_events(events: List[MetricEvent], response: Response):
+    """Record many metrics events in one request and one transaction"""
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=503, detail="Metrics collection is disabled")
+    if len(events) > METRICS_MAX_BATCH:
+        raise HTTPException(status_code=413, detail=f"At most {METRICS_MAX_BATCH} events per batch")
     
-    with get_db() as conn:
-        cursor = conn.execute("""
-            INSERT INTO events (timestamp, event_type, duration_seconds, input_chars, output_chars, status, text_content, metadata)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-            timestamp,
-            event.event_type,
-            event.duration_seconds,
-            event.input_chars,
-            event.output_chars,
-            event.status,
-            text_content,
-            metadata_json
-        ))
-        conn.commit()
-        event_id = cursor.lastrowid
+    now = datetime.utcnow()
+    rows = [event_row(event, event_timestamp(event, now)) for event in events]
+    if rows and _write_buffer:
+        buffer_rows(rows, response)
+        return BatchResponse(success=True, count=len(rows))
+    
+    inserted = await run_write(insert_events, rows) if rows else []
+    events_stored(inserted)
+    return BatchResponse(success=True, count=len(rows), duplicates=len(rows) - len(inserted))
+
+
+# Live feed of stored events
+@app.get("/api/metrics/live")
+async def live_events(last_event_id: Optional[str] = Header(None)):
+    """
+    Stream stored events as server-sent events.
+
+    An 'events' message carries the new events, the summary totals they add
+    and the oldest timestamp among them; a 'reset' means history changed in
+    a way that cannot be applied incrementally, so reload.
+    """
+    if not METRICS_ENABLED or not _live_feed:
+        raise HTTPException(status_code=503, detail="Metrics collection is disabled")
     
-    # Periodic cleanup
-    cleanup_old_events()
+    feed = _live_feed
+    queue = feed.subscribe(last_event_id)
     
-    return EventResponse(
-        id=event_id,
-        timestamp=timestamp,
-        event_type=event.event_type,
-        duration_seconds=event.duration_seconds,
-        input_chars=event.input_chars,
-        output_chars=event.output_chars,
-        status=event.status,
-        text_content=text_content,
-        metadata=event.metadata
+    async def stream():
+        try:
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), timeout=LIVE_PING_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                if message is None:
+                    return
+                message_id, kind, data = message
+                yield f"id: {message_id}\nevent: {kind}\ndata: {data}\n\n"
+        finally:
+            feed.unsubscribe(queue)
+    
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
     )
 
 
+def summary_bounds(cutoff):
+    """Split a range starting at cutoff into (cutoff, first hour, first day) boundaries"""
+    start = datetime.fromisoformat(cutoff)
+    hour_start = start.replace(minute=0, second=0, microsecond=0)
+    if hour_start < start:
+        hour_start += timedelta(hours=1)
+    day_start = hour_start.replace(hour=0)
+    if day_start < hour_start:
+        day_start += timedelta(days=1)
+    return cutoff, hour_start.isoformat(), day_start.isoformat()
+
+
+def query_summary(cutoff):
+    """Return (total, asr_stats, tts_stats) for events since cutoff"""
+    start, hour_start, day_start = summary_bounds(cutoff)
+    rows = []
+    for _, conn in connections(partitions(start)):
+        # Raw events up to the first whole hour, then hourly rollups up to
+        # the first whole day, then daily rollups for everything after
+        # (read from the covering index alone, even where ANALYZE's
+        # statistics favour skipping through idx_events_type_epoch)
+        rows += conn.execute(f"""
+            SELECT event_type, SUM(count) AS count, SUM(duration_seconds) AS duration_seconds,
+                   SUM(input_chars) AS input_chars, SUM(output_chars) AS output_chars
+            FROM (
+                SELECT event_type, COUNT(*) AS count, COALESCE(SUM(duration_seconds), 0) AS duration_seconds,
+                       COALESCE(SUM(input_chars), 0) AS input_chars, COALESCE(SUM(output_chars), 0) AS output_chars
+                FROM events INDEXED BY idx_events_summary
+                WHERE epoch_ms >= {EPOCH_MS_SQL.format('?')} AND epoch_ms < {EPOCH_MS_SQL.format('?')}
+                GROUP BY event_type
+                UNION ALL
+                SELECT event_type, count, duration_seconds, input_chars, output_chars
+                FROM rollup_hourly WHERE bucket >= ? AND bucket < ?
+                UNION ALL
+                SELECT event_type, count, duration_seconds, input_chars, output_chars
+                FROM rollup_daily WHERE bucket >= ?
+            )
+            GROUP BY event_type
+        """, (start, hour_start, hour_start, day_start, day_start)).fetchall()
+    return summary_stats(rows)
+
+
+GROUP_COLUMNS = ("count", "errors", "duration_seconds", "input_chars", "output_chars")
+
+
+def query_groups(cutoff, dimension):
+    """Return GroupTotals by dimension value and event type for events since cutoff"""
+    # Answered from the dimension's partial covering index; events without
+    # the metadata key are not in it, and not in any group
+    query = f"""
+        SELECT {dimension} AS "group", event_type, COUNT(*) AS count, SUM(status != 'success') AS errors,
+               COALESCE(SUM(duration_seconds), 0) AS duration_seconds,
+               COALESCE(SUM(input_chars), 0) AS input_chars, COALESCE(SUM(output_chars), 0) AS output_chars
+        FROM events
+        WHERE {dimension} IS NOT NULL AND epoch_ms >= {EPOCH_MS_SQL.format('?')}
+        GROUP BY 1, 2
+    """
+    groups = {}
+    for _, conn in connections(partitions(cutoff)):
+        for row in conn.execute(query, (cutoff,)):
+            totals = groups.setdefault((row["group"], row["event_type"]), dict.fromkeys(GROUP_COLUMNS, 0))
+            for column in GROUP_COLUMNS:
+                totals[column] += row[column]
+    return [
+        GroupTotals(group=group, event_type=event_type, **totals)
+        for (group, event_type), totals in sorted(groups.items())
+    ]
+
+
+def event_totals(rows):
+    """Per-event totals for event rows, in the form summary_stats() folds"""
+    return [
+        {"event_type": row[1], "count": 1, "duration_seconds": row[2],
+         "input_chars": row[3], "output_chars": row[4]}
+        for row in rows
+    ]
+
+
+def summary_stats(rows):
+    """Fold per-event-type count, duration and char totals into (total, asr_stats, tts_stats)"""
+    total = 0
+    asr_stats = {"count": 0, "recorded": 0.0, "transcribed": 0.0, "input_chars": 0, "output_chars": 0}
+    tts_stats = {"count": 0, "generated": 0.0, "input_chars": 0, "output_chars": 0}
+    for row in rows:
+        total += row["count"]
+        if row["event_type"].startswith("asr_"):
+            stats = asr_stats
+            if row["event_type"] == "asr_record":
+                stats["recorded"] += row["duration_seconds"]
+            elif row["event_type"] == "asr_transcribe":
+                stats["transcribed"] += row["duration_seconds"]
+        elif row["event_type"].startswith("tts_"):
+            stats = tts_stats
+            stats["generated"] += row["duration_seconds"]
+        else:
+            continue
+        stats["count"] += row["count"]
+        stats["input_chars"] += row["input_chars"]
+        stats["output_chars"] += row["output_chars"]
+    
+    return total, asr_stats, tts_stats
+
+
+# How far back each sliding range reaches
+RANGE_SPANS = {"7d": timedelta(days=7), "30d": timedelta(days=30)}
+
+
+def range_cutoff(range, now):
+    """
+    Return the ISO start time of a 'today', '7d', '30d' or 'all' range.
+
+    Sliding ranges start on a whole minute, so one cached summary serves
+    every request within that minute.
+    """
+    if range == "today":
+        return now.replace(hour=0, minute=0, second=0, microsecond=0).isoformat()
+    elif range in RANGE_SPANS:
+        return (now.replace(second=0, microsecond=0) - RANGE_SPANS[range]).isoformat()
+    else:  # 'all'
+        return "1970-01-01T00:00:00"
+
+
+# Summary cache
+# Open dashboards ask for the same few summaries again and again. Results
+# are cached per range and kept current as events are stored, by adding
+# each new batch's totals (as the live feed does); deletes clear the cache.
+# `version` counts every change to stored events, so it also validates
+# conditional GETs of history.
+class SummaryCache:
+    """Summary stats per range, for the cutoff they were computed from"""
+
+    def __init__(self):
+        self.entries = {}  # range -> (cutoff, (total, asr_stats, tts_stats))
+        self.version = 0
+        self.changed_at = datetime.utcnow()
+        self.stats = {"hits": 0, "misses": 0}
+
+    def get(self, range, cutoff):
+        entry = self.entries.get(range)
+        if entry and entry[0] == cutoff:
+            self.stats["hits"] += 1
+            return entry[1]
+        self.stats["misses"] += 1
+        return None
+
+    def put(self, range, cutoff, version, summary):
+        """Cache a summary read when the data was at version (unless it has changed since)"""
+        if version == self.version:
+            self.entries[range] = (cutoff, summary)
+
+    def add(self, rows):
+        """Fold newly stored event rows into every cached summary they fall within"""
+        for range, (cutoff, (total, asr_stats, tts_stats)) in list(self.entries.items()):
+            new_total, new_asr, new_tts = summary_stats(event_totals(row for row in rows if row[0] >= cutoff))
+            self.entries[range] = (cutoff, (
+                total + new_total,
+                {key: value + new_asr[key] for key, value in asr_stats.items()},
+                {key: value + new_tts[key] for key, value in tts_stats.items()}
+            ))
+        self.changed()
+
+    def invalidate(self):
+        """Forget every cached summary (after deletes)"""
+        self.entries = {}
+        self.changed()
+
+    def changed(self):
+        self.version += 1
+        self.changed_at = datetime.utcnow()
+
+
+_summary_cache = SummaryCache()
+
+
+def http_date(value):
+    """Format a naive UTC datetime as an HTTP date"""
+    return email.utils.format_datetime(value.replace(tzinfo=timezone.utc), usegmt=True)
+
+
+def not_modified(request, etag, last_modified):
+    """
+    Check a request's validators: If-None-Match against etag, or (if absent)
+    If-Modified-Since against last_modified
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag.removeprefix("W/") in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            since = email.utils.parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            return False
+        return last_modified.replace(microsecond=0) <= naive_utc(since)
+    return False
+
+
+def conditional_response(request, response, etag, last_modified):
+    """
+    Set validators on response; return a 304 response instead if the
+    client's copy is current. Cache-Control: no-cache makes browsers
+    revalidate every time rather than guess a freshness lifetime.
+    """
+    headers = {"ETag": etag, "Last-Modified": http_date(last_modified), "Cache-Control": "no-cache"}
+    if not_modified(request, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
+
 # Get summary
 @app.get("/api/metrics/summary", response_model=SummaryResponse)
 async def get_summary(
-    range: str = Query("7d", description="Time range: 'today', '7d', '30d', 'all'")
+    request: Request,
+    response: Response,
+    range: str = Query("7d", pattern="^(today|7d|30d|all)$", description="Time range: 'today', '7d', '30d', 'all'"),
+    group_by: Optional[str] = Query(None, pattern=DIMENSIONS_PATTERN, description="Also total by a metadata dimension")
 ):
     """Get summary statistics for the specified time range"""
     if not METRICS_ENABLED:
         raise HTTPException(status_code=503, detail="Metrics collection is disabled")
     
-    # Calculate cutoff time
-    now = datetime.utcnow()
-    if range == "today":
-        cutoff = now.replace(hour=0, minute=0, second=0, microsecond=0).isoformat()
-    elif range == "7d":
-        cutoff = (now - timedelta(days=7)).isoformat()
-    elif range == "30d":
-        cutoff = (now - timedelta(days=30)).isoformat()
-    else:  # 'all'
-        cutoff = "1970-01-01T00:00:00"
+    cutoff = range_cutoff(range, datetime.utcnow())
+    version = _summary_cache.version
+    # The body changes when events do, or when the range moves on
+    window_moved = datetime.fromisoformat(cutoff) + RANGE_SPANS.get(range, timedelta(0))
+    not_modified_response = conditional_response(
+        request, response, f'W/"{BOOT_ID}-{version}-{range}-{cutoff}"',
+        max(_summary_cache.changed_at, window_moved)
+    )
+    if not_modified_response:
+        return not_modified_response
     
-    with get_db() as conn:
-        # Total events
-        total = conn.execute(
-            "SELECT COUNT(*) as count FROM events WHERE timestamp >= ?",
-            (cutoff,)
-        ).fetchone()["count"]
-        
-        # ASR events
-        asr_stats = conn.execute("""
-            SELECT 
-                COUNT(*) as count,
-                COALESCE(SUM(CASE WHEN event_type = 'asr_record' THEN duration_seconds ELSE 0 END), 0) as recorded,
-                COALESCE(SUM(CASE WHEN event_type = 'asr_transcribe' THEN duration_seconds ELSE 0 END), 0) as transcribed,
-                COALESCE(SUM(input_chars), 0) as input_chars,
-                COALESCE(SUM(output_chars), 0) as output_chars
-            FROM events 
-            WHERE event_type LIKE 'asr_%' AND timestamp >= ?
-        """, (cutoff,)).fetchone()
-        
-        # TTS events
-        tts_stats = conn.execute("""
-            SELECT 
-                COUNT(*) as count,
-                COALESCE(SUM(duration_seconds), 0) as generated,
-                COALESCE(SUM(input_chars), 0) as input_chars,
-                COALESCE(SUM(output_chars), 0) as output_chars
-            FROM events 
-            WHERE event_type LIKE 'tts_%' AND timestamp >= ?
-        """, (cutoff,)).fetchone()
-    
-    return SummaryResponse(
-        range=range,
-        total_events=total,
-        asr_events=asr_stats["count"],
-        tts_events=tts_stats["count"],
-        asr_seconds_recorded=asr_stats["recorded"],
-        asr_seconds_transcribed=asr_stats["transcribed"],
-        tts_seconds_generated=tts_stats["generated"],
-        total_input_chars=asr_stats["input_chars"] + tts_stats["input_chars"],
-        total_output_chars=asr_stats["output_chars"] + tts_stats["output_chars"]
+    summary = _summary_cache.get(range, cutoff)
+    if summary is None:
+        summary = await run_read(query_summary, cutoff)
+        _summary_cache.put(range, cutoff, version, summary)
+    if not group_by:
+        return SummaryResponse(range=range, **summary_fields(*summary))
+    # Groups are not cached: the index answers them without touching events
+    groups = await run_read(query_groups, cutoff, group_by)
+    return SummaryResponse(range=range, group_by=group_by, groups=groups, **summary_fields(*summary))
+
+
+def summary_fields(total, asr_stats, tts_stats):
+    """The SummaryResponse fields (other than range) for summary stats"""
+    return {
+        "total_events": total,
+        "asr_events": asr_stats["count"],
+        "tts_events": tts_stats["count"],
+        "asr_seconds_recorded": asr_stats["recorded"],
+        "asr_seconds_transcribed": asr_stats["transcribed"],
+        "tts_seconds_generated": tts_stats["generated"],
+        "total_input_chars": asr_stats["input_chars"] + tts_stats["input_chars"],
+        "total_output_chars": asr_stats["output_chars"] + tts_stats["output_chars"],
+    }
+
+
+SERIES_QUANTILES = {"p50": 0.5, "p95": 0.95, "p99": 0.99}
+
+
+def series_point(bucket, event_type, totals, sketch, group=None):
+    """Build a SeriesPoint, reading percentiles from a duration sketch"""
+    percentiles = {}
+    for name, q in SERIES_QUANTILES.items():
+        value = sketch.quantile(q)
+        percentiles[name] = round(value, 3) if value is not None else None
+    return SeriesPoint(
+        bucket=bucket,
+        event_type=event_type,
+        group=group,
+        count=totals["count"],
+        duration_seconds=totals["duration_seconds"],
+        input_chars=totals["input_chars"],
+        output_chars=totals["output_chars"],
+        **percentiles
     )
 
 
+def add_to_totals(totals, key, row, sketch):
+    """Add a rollup row and its duration sketch to the running totals for key"""
+    total = totals.setdefault(key, {
+        "count": 0, "duration_seconds": 0.0, "input_chars": 0, "output_chars": 0, "sketch": DDSketch()
+    })
+    for column in ("count", "duration_seconds", "input_chars", "output_chars"):
+        total[column] += row[column]
+    total["sketch"].merge(sketch)
+
+
+def query_timeseries(table, start, event_type):
+    """Return (series, totals) from one rollup table for buckets from start on"""
+    query = f"""
+        SELECT bucket, event_type, count, duration_seconds, input_chars, output_chars, duration_sketch
+        FROM {table} WHERE bucket >= ?
+    """
+    params = [start]
+    if event_type:
+        query += " AND event_type = ?"
+        params.append(event_type)
+    rows = []
+    for _, conn in connections(partitions(start)):
+        rows += conn.execute(query, params).fetchall()
+    return merge_series(rows, start)
+
+
+# Bucket of an event from its epoch_ms, matching the rollup tables' buckets
+EPOCH_BUCKET_SQL = {
+    "rollup_hourly": "strftime('%Y-%m-%dT%H:00:00', epoch_ms / 1000, 'unixepoch')",
+    "rollup_daily": "strftime('%Y-%m-%dT00:00:00', epoch_ms / 1000, 'unixepoch')",
+}
+
+
+def query_grouped_timeseries(table, start, event_type, dimension):
+    """
+    Return (series, totals) by dimension value for buckets from start on.
+    Rollups are not kept per dimension, so this aggregates events, from
+    the dimension's covering index.
+    """
+    query = f"""
+        SELECT {EPOCH_BUCKET_SQL[table]} AS bucket, {dimension} AS "group", event_type, COUNT(*) AS count,
+               COALESCE(SUM(duration_seconds), 0) AS duration_seconds,
+               COALESCE(SUM(input_chars), 0) AS input_chars, COALESCE(SUM(output_chars), 0) AS output_chars,
+               sketch_agg(duration_seconds) AS duration_sketch
+        FROM events
+        WHERE {dimension} IS NOT NULL AND epoch_ms >= {EPOCH_MS_SQL.format('?')}
+    """
+    params = [start]
+    if event_type:
+        query += " AND event_type = ?"
+        params.append(event_type)
+    query += " GROUP BY 1, 2, 3"
+    rows = []
+    for _, conn in connections(partitions(start)):
+        rows += conn.execute(query, params).fetchall()
+    return merge_series(rows, start, grouped=True)
+
+
+def merge_series(rows, start, grouped=False):
+    """Merge per-database bucket rows into (series, totals)"""
+    # A bucket only appears in more than one database where the main
+    # database overlaps a partition; merging handles both cases
+    buckets = {}
+    totals = {}
+    for row in rows:
+        sketch = DDSketch.from_bytes(row["duration_sketch"])
+        group = row["group"] if grouped else None
+        add_to_totals(buckets, (row["bucket"], group or "", row["event_type"]), row, sketch)
+        # Sketches merge exactly, so range-wide percentiles need no raw events
+        add_to_totals(totals, (group or "", row["event_type"]), row, sketch)
+    
+    series = [
+        series_point(bucket, event_type, total, total["sketch"], group or None)
+        for (bucket, group, event_type), total in sorted(buckets.items())
+    ]
+    return series, [
+        series_point(start, event_type, total, total["sketch"], group or None)
+        for (group, event_type), total in sorted(totals.items())
+    ]
+
+
+# Get time series
+@app.get("/api/metrics/timeseries", response_model=TimeseriesResponse)
+async def get_timeseries(
+    range: str = Query("7d", pattern="^(today|7d|30d|all)$", description="Time range: 'today', '7d', '30d', 'all'"),
+    bucket: Optional[str] = Query(None, pattern="^(hour|day)$", description="'hour' or 'day' (default: hour for today, else day)"),
+    event_type: Optional[str] = Query(None, description="Filter by event type"),
+    group_by: Optional[str] = Query(None, pattern=DIMENSIONS_PATTERN, description="Split by a metadata dimension")
+):
+    """Get per-bucket counts, sums and duration percentiles by event type"""
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=503, detail="Metrics collection is disabled")
+    
+    bucket = bucket or ("hour" if range == "today" else "day")
+    table, bucket_start = (("rollup_hourly", hour_bucket) if bucket == "hour"
+                           else ("rollup_daily", day_bucket))
+    # Whole buckets only: the first one may start before the range does
+    start = bucket_start(range_cutoff(range, datetime.utcnow()))
+    if group_by:
+        series, totals = await run_read(query_grouped_timeseries, table, start, event_type, group_by)
+    else:
+        series, totals = await run_read(query_timeseries, table, start, event_type)
+    
+    return TimeseriesResponse(range=range, bucket=bucket, start=start, series=series, totals=totals)
+
+
+def encode_cursor(key, event_id):
+    """Build an opaque cursor pointing just past (key, id), e.g. (epoch_ms, id)"""
+    return base64.urlsafe_b64encode(f"{key!r}|{event_id}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor, key_type=int):
+    """Return (key, id) from a cursor, or raise ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        key, event_id = raw.split("|")
+        return key_type(key), int(event_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def count_history(conn, event_type, category=None):
+    """Count events (of one type or category) from the daily rollups instead of scanning"""
+    query = "SELECT COALESCE(SUM(count), 0) AS count FROM rollup_daily"
+    conditions = []
+    params = []
+    if event_type:
+        conditions.append("event_type = ?")
+        params.append(event_type)
+    if category:
+        conditions.append("substr(event_type, 1, 4) = ?")
+        params.append(f"{category}_")
+    if conditions:
+        query += f" WHERE {' AND '.join(conditions)}"
+    return conn.execute(query, params).fetchone()["count"]
+
+
+def epoch_ms_to_iso(epoch_ms):
+    """Convert integer milliseconds since 1970 UTC to a naive ISO timestamp"""
+    return (datetime(1970, 1, 1) + timedelta(milliseconds=epoch_ms)).isoformat()
+
+
+def merge_newest(fetch, databases, limit):
+    """
+    Return up to limit rows, newest first by (epoch_ms, id), merged from
+    fetch(conn) run on each database (each result already in that order).
+
+    Databases come newest first, so once a full page is newer than where a
+    partition ends, that partition cannot contribute and is not read.
+    """
+    rows = []
+    for partition in databases:
+        if len(rows) >= limit and partition.end is not None and partition.end <= rows[limit - 1]["timestamp"]:
+            continue
+        try:
+            with partition.connection() as conn:
+                page = fetch(conn)
+        except PoolClosed:
+            continue  # Dropped by retention since it was listed
+        rows = list(heapq.merge(rows, page, key=lambda row: (row["epoch_ms"], row["id"]), reverse=True))[:limit]
+    return rows
+
+
+def query_history(limit, offset, event_type, before=None, include_total=True, category=None):
+    """
+    Return (total, events, next_cursor) for one page of history.
+
+    Pages are ordered newest first by (epoch_ms, id). With a before cursor
+    the page starts just past it through the index, so every page costs
+    the same regardless of depth; offset paging is kept for compatibility.
+    """
+    # Build query
+    conditions = []
+    params = []
+    
+    if event_type:
+        conditions.append("event_type = ?")
+        params.append(event_type)
+    if category:
+        conditions.append("category = ?")
+        params.append(category)
+    databases = partitions()
+    if before:
+        cursor = decode_cursor(before)
+        conditions.append("(epoch_ms, id) < (?, ?)")
+        params.extend(cursor)
+        databases = partitions(end=epoch_ms_to_iso(cursor[0] + 1))
+    
+    where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    
+    # Get events, plus one extra row to tell whether another page follows;
+    # across several databases the offset is applied after merging
+    query = f"""
+        SELECT id, epoch_ms, timestamp, event_type, duration_seconds, input_chars, output_chars, status, uuid,
+               event_payloads.text_content, event_payloads.metadata
+        FROM events LEFT JOIN event_payloads ON event_payloads.event_id = events.id
+        {where_clause}
+        ORDER BY epoch_ms DESC, id DESC
+        LIMIT ? OFFSET ?
+    """
+    skip = offset if len(databases) > 1 else 0
+    params.extend([limit + 1 + skip, offset - skip])
+    
+    rows = merge_newest(lambda conn: conn.execute(query, params).fetchall(), databases, limit + 1 + skip)[skip:]
+    total = None
+    if include_total:
+        total = 0
+        for _, conn in connections(partitions()):
+            total += count_history(conn, event_type, category)
+    
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]["epoch_ms"], rows[-1]["id"])
+    
+    events = []
+    for row in rows:
+        metadata = payload.decompress(row["metadata"])
+        events.append(EventResponse(
+            id=row["id"],
+            timestamp=row["timestamp"],
+            event_type=row["event_type"],
+            duration_seconds=row["duration_seconds"],
+            input_chars=row["input_chars"],
+            output_chars=row["output_chars"],
+            status=row["status"],
+            text_content=payload.decompress(row["text_content"]),
+            metadata=json.loads(metadata) if metadata else None,
+            uuid=format_uuid(row["uuid"])
+        ))
+    
+    return total, events, next_cursor
+
+
 # Get history
 @app.get("/api/metrics/history", response_model=HistoryResponse)
 async def get_history(
+    request: Request,
+    response: Response,
     limit: int = Query(50, ge=1, le=500, description="Number of events to return"),
-    offset: int = Query(0, ge=0, description="Offset for pagination"),
-    event_type: Optional[str] = Query(None, description="Filter by event type")
+    offset: int = Query(0, ge=0, description="Offset for pagination (prefer 'before')"),
+    event_type: Optional[str] = Query(None, description="Filter by event type"),
+    category: Optional[str] = Query(None, pattern="^(asr|tts)$", description="Filter by category: 'asr' or 'tts'"),
+    before: Optional[str] = Query(None, description="Cursor from a previous page's next_cursor"),
+    include_total: bool = Query(True, description="Include the total event count")
 ):
     """Get paginated event history"""
     if not METRICS_ENABLED:
         raise HTTPException(status_code=503, detail="Metrics collection is disabled")
+    if before and offset:
+        raise HTTPException(status_code=400, detail="Use either 'before' or 'offset', not both")
     
-    with get_db() as conn:
-        # Build query
-        where_clause = ""
-        params = []
-        
-        if event_type:
-            where_clause = "WHERE event_type = ?"
-            params.append(event_type)
-        
-        # Get total count
-        count_query = f"SELECT COUNT(*) as count FROM events {where_clause}"
-        total = conn.execute(count_query, params).fetchone()["count"]
-        
-        # Get events
-        query = f"""
-            SELECT id, timestamp, event_type, duration_seconds, input_chars, output_chars, status, text_content, metadata
-            FROM events {where_clause}
-            ORDER BY timestamp DESC
-            LIMIT ? OFFSET ?
-        """
-        params.extend([limit, offset])
-        
-        rows = conn.execute(query, params).fetchall()
-        
-        events = []
-        for row in rows:
-            metadata = json.loads(row["metadata"]) if row["metadata"] else None
-            events.append(EventResponse(
-                id=row["id"],
-                timestamp=row["timestamp"],
-                event_type=row["event_type"],
-                duration_seconds=row["duration_seconds"],
-                input_chars=row["input_chars"],
-                output_chars=row["output_chars"],
-                status=row["status"],
-                text_content=row["text_content"],
-                metadata=metadata
-            ))
+    # Pages depend only on stored events (and the query string)
+    version = _summary_cache.version
+    not_modified_response = conditional_response(
+        request, response, f'W/"{BOOT_ID}-{version}"', _summary_cache.changed_at
+    )
+    if not_modified_response:
+        return not_modified_response
+    
+    try:
+        total, events, next_cursor = await run_read(
+            query_history, limit, offset, event_type, before, include_total, category
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
     return HistoryResponse(
         events=events,
         total=total,
         limit=limit,
-        offset=offset
+        offset=offset,
+        next_cursor=next_cursor
     )
 
 
+# Snippet highlight markers; control characters cannot occur in escaped
+# output, so the snippet can be HTML-escaped before they become <mark> tags
+SNIPPET_START = "\x02"
+SNIPPET_END = "\x03"
+
+
+def fts_query(text):
+    """Turn free text into an FTS5 query matching all of its words"""
+    # Quoting each word means punctuation in the input is never FTS5 syntax
+    return " ".join('"' + word.replace('"', '""') + '"' for word in text.split())
+
+
+def format_snippet(snippet):
+    """HTML-escape a snippet and mark its matches with <mark>"""
+    escaped = html.escape(snippet or "")
+    return escaped.replace(SNIPPET_START, "<mark>").replace(SNIPPET_END, "</mark>")
+
+
+def query_search(text, limit, before, event_type):
+    """
+    Return (results, next_cursor) for a ranked full-text search.
+
+    Results are ordered by bm25 rank (best first), then id, and paged with a
+    (rank, id) cursor like history pages.
+    """
+    conditions = ["events_fts MATCH ?"]
+    params = [SNIPPET_START, SNIPPET_END, fts_query(text)]
+    if event_type:
+        conditions.append("events.event_type = ?")
+        params.append(event_type)
+    if before:
+        conditions.append("(events_fts.rank, events.id) > (?, ?)")
+        params.extend(decode_cursor(before, float))
+    
+    # Each database ranks against its own index statistics, so ranks from
+    # different partitions are comparable but not identical to one index
+    rows = []
+    for _, conn in connections(partitions()):
+        page = conn.execute(f"""
+            SELECT events.id, events.timestamp, events.event_type, events.status,
+                   events_fts.rank AS rank,
+                   snippet(events_fts, 0, ?, ?, '…', 16) AS snippet
+            FROM events_fts JOIN events ON events.id = events_fts.rowid
+            WHERE {' AND '.join(conditions)}
+            ORDER BY events_fts.rank, events.id
+            LIMIT ?
+        """, params + [limit + 1]).fetchall()
+        rows = list(heapq.merge(rows, page, key=lambda row: (row["rank"], row["id"])))[:limit + 1]
+    
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]["rank"], rows[-1]["id"])
+    
+    results = [
+        SearchResult(
+            id=row["id"],
+            timestamp=row["timestamp"],
+            event_type=row["event_type"],
+            status=row["status"],
+            rank=row["rank"],
+            snippet=format_snippet(row["snippet"])
+        )
+        for row in rows
+    ]
+    return results, next_cursor
+
+
+# Search stored text
+@app.get("/api/metrics/search", response_model=SearchResponse)
+async def search_history(
+    q: str = Query(..., min_length=1, description="Words to search for in stored text"),
+    limit: int = Query(20, ge=1, le=100, description="Number of results to return"),
+    before: Optional[str] = Query(None, description="Cursor from a previous page's next_cursor"),
+    event_type: Optional[str] = Query(None, description="Filter by event type")
+):
+    """Search stored transcripts and TTS text, best matches first"""
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=503, detail="Metrics collection is disabled")
+    if not q.split():
+        raise HTTPException(status_code=400, detail="Search query is empty")
+    
+    try:
+        results, next_cursor = await run_read(query_search, q, limit, before, event_type)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return SearchResponse(query=q, results=results, next_cursor=next_cursor)
+
+
+def delete_history(clear_text_only):
+    """Delete all events, or only their stored text"""
+    for partition in partitions():
+        if not clear_text_only and partition is not _main:
+            drop_partition(partition)
+            continue
+        with partition.connection() as conn:
+            if clear_text_only:
+                # The update trigger removes the text from the search index too
+                conn.execute("""
+                    UPDATE event_payloads SET text_content = NULL, text_size = NULL
+                    WHERE text_content IS NOT NULL
+                """)
+                conn.execute("DELETE FROM event_payloads WHERE metadata IS NULL")
+            else:
+                conn.execute("DELETE FROM event_payloads")
+                conn.execute("DELETE FROM events")
+                for table, _ in ROLLUPS:
+                    conn.execute(f"DELETE FROM {table}")
+            conn.commit()
+    
+    return "Stored text cleared" if clear_text_only else "All history cleared"
+
+
 # Clear history
 @app.delete("/api/metrics/history")
 async def clear_history(clear_text_only: bool = Query(False, description="Only clear stored text, keep events")):
@@ -361,53 +2520,555 @@ async def clear_history(clear_text_only: bool = Query(False, description="Only c
     if not METRICS_ENABLED:
         raise HTTPException(status_code=503, detail="Metrics collection is disabled")
     
-    with get_db() as conn:
-        if clear_text_only:
-            conn.execute("UPDATE events SET text_content = NULL")
-            message = "Stored text cleared"
-        else:
-            conn.execute("DELETE FROM events")
-            message = "All history cleared"
-        conn.commit()
+    message = await run_write(delete_history, clear_text_only)
+    _summary_cache.invalidate()
+    if not clear_text_only:
+        _retention_stats["row_estimate"] = 0
+    if _maintenance_wakeup is not None:
+        # Give the freed pages back once recording has been quiet for a while
+        _maintenance_wakeup.set()
+    if _live_feed:
+        _live_feed.publish("reset", {})
     
     return {"success": True, "message": message}
 
 
-# Export history as JSON
+EXPORT_COLUMNS = [
+    "id", "timestamp", "event_type", "duration_seconds", "input_chars",
+    "output_chars", "status", "uuid", "text_content", "metadata"
+]
+
+EXPORT_MEDIA_TYPES = {
+    "json": "application/json",
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+def query_export_chunk(after, start, end, event_type, limit):
+    """Return up to limit events (newest first) older than the (epoch_ms, id) key after"""
+    conditions = []
+    params = []
+    if event_type:
+        conditions.append("event_type = ?")
+        params.append(event_type)
+    if start:
+        conditions.append(f"epoch_ms >= {EPOCH_MS_SQL.format('?')}")
+        params.append(start)
+    if end:
+        conditions.append(f"epoch_ms < {EPOCH_MS_SQL.format('?')}")
+        params.append(end)
+    if after:
+        conditions.append("(epoch_ms, id) < (?, ?)")
+        params.extend(after)
+    where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    query = f"""
+        SELECT epoch_ms, {', '.join('events.' + column for column in EXPORT_COLUMNS[:-2])},
+               event_payloads.text_content, event_payloads.metadata
+        FROM events LEFT JOIN event_payloads ON event_payloads.event_id = events.id
+        {where_clause}
+        ORDER BY epoch_ms DESC, id DESC
+        LIMIT ?
+    """
+    
+    databases = partitions(start, epoch_ms_to_iso(after[0] + 1) if after else end)
+    rows = merge_newest(lambda conn: conn.execute(query, params + [limit]).fetchall(), databases, limit)
+    
+    events = []
+    for row in rows:
+        event = dict(row)
+        event["uuid"] = format_uuid(row["uuid"])
+        event["text_content"] = payload.decompress(row["text_content"])
+        metadata = payload.decompress(row["metadata"])
+        event["metadata"] = json.loads(metadata) if metadata else None
+        events.append(event)
+    return events
+
+
+def export_record(event):
+    """The exported fields of an event (without internal columns)"""
+    return {column: event[column] for column in EXPORT_COLUMNS}
+
+
+async def iter_export_chunks(start, end, event_type):
+    """
+    Yield lists of events, newest first, one bounded read at a time.
+
+    Each chunk is a separate keyset query on the reader pool rather than one
+    long-lived cursor, so a slow download never pins a pooled connection.
+    """
+    after = None
+    while True:
+        events = await run_read(query_export_chunk, after, start, end, event_type, METRICS_EXPORT_CHUNK)
+        if events:
+            yield events
+        if len(events) < METRICS_EXPORT_CHUNK:
+            return
+        after = (events[-1]["epoch_ms"], events[-1]["id"])
+
+
+async def render_export(format, chunks):
+    """Render event chunks as JSON, NDJSON or CSV text, incrementally"""
+    if format == "json":
+        yield f'{{"exported_at": {json.dumps(datetime.utcnow().isoformat())}, "events": ['
+        total = 0
+        async for events in chunks:
+            separator = ", " if total else ""
+            yield separator + ", ".join(json.dumps(export_record(event)) for event in events)
+            total += len(events)
+        yield f'], "total_events": {total}}}'
+    elif format == "ndjson":
+        async for events in chunks:
+            yield "".join(json.dumps(export_record(event)) + "\n" for event in events)
+    else:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_COLUMNS)
+        yield buffer.getvalue()
+        async for events in chunks:
+            buffer.seek(0)
+            buffer.truncate()
+            for event in events:
+                metadata = json.dumps(event["metadata"]) if event["metadata"] else ""
+                writer.writerow([event[column] for column in EXPORT_COLUMNS[:-1]] + [metadata])
+            yield buffer.getvalue()
+
+
+async def gzip_stream(chunks):
+    """Gzip a stream of text chunks as they are produced"""
+    compressor = zlib.compressobj(wbits=31)  # 31 = gzip container
+    async for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+# Export history
 @app.get("/api/metrics/export")
-async def export_history():
-    """Export all history as JSON"""
+async def export_history(
+    format: str = Query("json", pattern="^(json|ndjson|csv)$", description="'json', 'ndjson' or 'csv'"),
+    gzip: bool = Query(False, description="Gzip the download"),
+    start: Optional[datetime] = Query(None, description="Only events at or after this time (ISO 8601)"),
+    end: Optional[datetime] = Query(None, description="Only events before this time (ISO 8601)"),
+    event_type: Optional[str] = Query(None, description="Filter by event type")
+):
+    """Stream history as JSON, NDJSON or CSV without loading it all into memory"""
     if not METRICS_ENABLED:
         raise HTTPException(status_code=503, detail="Metrics collection is disabled")
     
-    with get_db() as conn:
-        rows = conn.execute("""
-            SELECT id, timestamp, event_type, duration_seconds, input_chars, output_chars, status, text_content, metadata
-            FROM events ORDER BY timestamp DESC
-        """).fetchall()
-        
+    start = naive_utc(start).isoformat() if start else None
+    end = naive_utc(end).isoformat() if end else None
+    body = render_export(format, iter_export_chunks(start, end, event_type))
+    
+    media_type = EXPORT_MEDIA_TYPES[format]
+    filename = f"yap-metrics-{datetime.utcnow().date().isoformat()}.{format}"
+    if gzip:
+        body = gzip_stream(body)
+        media_type = "application/gzip"
+        filename += ".gz"
+    
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+
+# Import
+# Loads an export back in (or NDJSON, one event per line, or a bare JSON
+# array of events) as the body streams in, METRICS_IMPORT_CHUNK events per
+# transaction through insert_events(), so rollups and the search index stay
+# in step as it goes. Events are matched by uuid, not id (ids are only
+# unique within one database): exports carry each event's uuid, and events
+# without one are given a uuid derived from their values, so importing the
+# same file twice, or merging overlapping histories, stores each event once.
+# Events stored before clients sent uuids are recognised by their values.
+IMPORT_UUID_NAMESPACE = UUID("d3553670-defa-4eab-9dbf-edf43765b37e")
+
+# An event larger than this is taken to be a malformed body, not buffered
+IMPORT_MAX_EVENT_BYTES = 1 << 20
+
+# The start of an export document up to its events array, or a bare array
+IMPORT_JSON_HEADER = re.compile(r'\s*(?:\[|\{[^\[]*?"events"\s*:\s*\[)')
+IMPORT_JSON_SEPARATOR = re.compile(r"[\s,]*")
+_json_decoder = json.JSONDecoder()
+
+
+class ImportReader:
+    """
+    Split an import body, fed in pieces of any size, into event dicts.
+    format is 'json' (an export document or a bare array) or 'ndjson'.
+    Gzipped bodies are recognised by their magic bytes.
+    """
+    
+    def __init__(self, format):
+        self.format = format
+        self.head = b""
+        self.inflater = None
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.text = ""
+        self.position = 0
+        self.in_events = format == "ndjson"
+        self.finished = False
+        self.count = 0
+    
+    def feed(self, data, final=False):
+        """Return the events completed by the next piece of the body"""
+        if self.head is not None:
+            # Two bytes tell a gzip stream apart
+            self.head += data
+            if len(self.head) < 2 and not final:
+                return []
+            data, self.head = self.head, None
+            if data[:2] == b"\x1f\x8b":
+                self.inflater = zlib.decompressobj(wbits=31)
+        if self.inflater:
+            data = self.inflater.decompress(data)
+            if final:
+                if not self.inflater.eof:
+                    raise ValueError("Truncated gzip body")
+                data += self.inflater.flush()
+        self.text = self.text[self.position:] + self.decoder.decode(data, final)
+        self.position = 0
+        events = self.parse_lines(final) if self.format == "ndjson" else self.parse_json()
+        if len(self.text) - self.position > IMPORT_MAX_EVENT_BYTES:
+            raise ValueError(f"Event {self.count + 1} is not valid JSON")
+        return events
+    
+    def close(self):
+        """Return the last events; raise ValueError if the body was cut short"""
+        events = self.feed(b"", final=True)
+        if self.format == "json" and not self.finished:
+            raise ValueError(f"Event {self.count + 1} is not valid JSON, or the body is incomplete")
+        return events
+    
+    def event(self, value):
+        self.count += 1
+        if not isinstance(value, dict):
+            raise ValueError(f"Event {self.count} is not a JSON object")
+        return value
+    
+    def parse_lines(self, final):
         events = []
-        for row in rows:
-            metadata = json.loads(row["metadata"]) if row["metadata"] else None
-            events.append({
-                "id": row["id"],
-                "timestamp": row["timestamp"],
-                "event_type": row["event_type"],
-                "duration_seconds": row["duration_seconds"],
-                "input_chars": row["input_chars"],
-                "output_chars": row["output_chars"],
-                "status": row["status"],
-                "text_content": row["text_content"],
-                "metadata": metadata
-            })
+        while True:
+            end = self.text.find("\n", self.position)
+            if end < 0:
+                if not final:
+                    break
+                end = len(self.text)
+            line = self.text[self.position:end].strip()
+            self.position = end + 1
+            if line:
+                try:
+                    events.append(self.event(json.loads(line)))
+                except json.JSONDecodeError:
+                    raise ValueError(f"Event {self.count + 1} is not valid JSON") from None
+            if end == len(self.text):
+                break
+        return events
     
-    return {
-        "exported_at": datetime.utcnow().isoformat(),
-        "total_events": len(events),
-        "events": events
-    }
+    def parse_json(self):
+        events = []
+        if not self.in_events:
+            match = IMPORT_JSON_HEADER.match(self.text, self.position)
+            if not match:
+                return events
+            self.in_events = True
+            self.position = match.end()
+        while not self.finished:
+            self.position = IMPORT_JSON_SEPARATOR.match(self.text, self.position).end()
+            if self.position == len(self.text):
+                break
+            if self.text[self.position] == "]":
+                # Whatever follows the array (total_events) is not needed
+                self.finished = True
+                self.position = len(self.text)
+                break
+            try:
+                value, self.position = _json_decoder.raw_decode(self.text, self.position)
+            except json.JSONDecodeError:
+                break  # Incomplete so far; close() reports it if it stays that way
+            events.append(self.event(value))
+        return events
+
+
+# An event stored without a uuid, with the same values as an imported one
+STORED_TWIN_SQL = f"""
+    SELECT 1 FROM events
+    WHERE event_type = ?2 AND epoch_ms = {EPOCH_MS_SQL.format('?1')} AND uuid IS NULL
+      AND timestamp = ?1 AND duration_seconds IS ?3 AND input_chars IS ?4 AND output_chars IS ?5 AND status IS ?6
+"""
+
+
+def import_row(event, now):
+    """
+    The events row for an imported event, or None if it has no uuid and an
+    event with the same values is stored without one (exported before
+    clients sent uuids, and imported back)
+    """
+    row = event_row(event, event_timestamp(event, now))
+    if row[6] is not None:
+        return row
+    with partition_for(row[0]).connection() as conn:
+        if conn.execute(STORED_TWIN_SQL, row[:6]).fetchone():
+            return None
+    return row[:6] + (uuid5(IMPORT_UUID_NAMESPACE, repr(row[:6])).bytes,) + row[7:]
+
+
+def import_events(records, first):
+    """
+    Validate and insert a chunk of imported event dicts (numbered from
+    first, for errors); return (id, row) for each event that was new
+    """
+    now = datetime.utcnow()
+    rows = []
+    for number, record in enumerate(records, first):
+        try:
+            event = MetricEvent.model_validate(record)
+        except ValidationError as e:
+            error = e.errors()[0]
+            raise ValueError(f"Event {number}: {'.'.join(map(str, error['loc']))}: {error['msg']}") from None
+        row = import_row(event, now)
+        if row is not None:
+            rows.append(row)
+    return insert_events(rows) if rows else []
+
+
+class Importer:
+    """Gather events from an ImportReader into chunks, and count what was stored"""
+    
+    def __init__(self, format):
+        self.reader = ImportReader(format)
+        self.pending = []
+        self.count = 0
+        self.imported = 0
+        self.started = time.perf_counter()
+    
+    def chunks(self, events, final=False):
+        """Return (first event number, events) chunks that are ready to insert"""
+        self.pending += events
+        chunks = []
+        while len(self.pending) >= METRICS_IMPORT_CHUNK or (final and self.pending):
+            chunk, self.pending = self.pending[:METRICS_IMPORT_CHUNK], self.pending[METRICS_IMPORT_CHUNK:]
+            chunks.append((self.count + 1, chunk))
+            self.count += len(chunk)
+        return chunks
+    
+    def feed(self, data):
+        return self.chunks(self.reader.feed(data))
+    
+    def close(self):
+        return self.chunks(self.reader.close(), final=True)
+    
+    def stored(self, inserted):
+        """Note one chunk's newly stored events"""
+        self.imported += len(inserted)
+        note_inserted(len(inserted))
+        # Cheaper than folding thousands of (mostly old) events into the cache
+        _summary_cache.invalidate()
+    
+    def response(self):
+        seconds = time.perf_counter() - self.started
+        return ImportResponse(
+            success=True,
+            count=self.count,
+            imported=self.imported,
+            duplicates=self.count - self.imported,
+            seconds=round(seconds, 3),
+            rows_per_second=round(self.count / seconds if seconds else 0.0, 1)
+        )
+
+
+def import_file(path, format):
+    """Import an export file ('-' for stdin) directly into the database"""
+    importer = Importer(format)
+    file = sys.stdin.buffer if path == "-" else open(path, "rb")
+    with file:
+        for data in iter(lambda: file.read(1 << 20), b""):
+            for first, chunk in importer.feed(data):
+                importer.stored(import_events(chunk, first))
+    for first, chunk in importer.close():
+        importer.stored(import_events(chunk, first))
+    return importer.response()
+
+
+# Import history
+@app.post("/api/metrics/import", response_model=ImportResponse)
+async def import_history(
+    request: Request,
+    format: str = Query("json", pattern="^(json|ndjson)$", description="'json' (an export, or an array of events) or 'ndjson'")
+):
+    """Stream events from an export (optionally gzipped) into the database, skipping ones already stored"""
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=503, detail="Metrics collection is disabled")
+    
+    importer = Importer(format)
+    try:
+        async for data in request.stream():
+            for first, chunk in importer.feed(data):
+                importer.stored(await run_write(import_events, chunk, first))
+        for first, chunk in importer.close():
+            importer.stored(await run_write(import_events, chunk, first))
+    except ValueError as e:
+        # Earlier chunks stay imported; fixing the file and importing it
+        # again skips them by uuid
+        raise HTTPException(status_code=422, detail=f"{e} ({importer.imported} events imported before it)")
+    finally:
+        # Open dashboards reload rather than receive the imported events
+        if importer.imported and _live_feed:
+            _live_feed.publish("reset", {})
+    
+    return importer.response()
+
+
+AUTO_VACUUM_MODES = ("none", "full", "incremental")
+
+
+def storage_report():
+    """Compare uncompressed and stored payload sizes, and report file usage"""
+    report = dict.fromkeys(
+        ("payloads", "text_bytes", "metadata_bytes", "stored_bytes", "database_bytes", "free_bytes",
+         "page_count", "free_pages", "wal_bytes"), 0
+    )
+    databases = []
+    for partition, conn in connections(partitions()):
+        row = conn.execute("""
+            SELECT COUNT(*) AS payloads,
+                   COALESCE(SUM(text_size), 0) AS text_bytes,
+                   COALESCE(SUM(metadata_size), 0) AS metadata_bytes,
+                   COALESCE(SUM(length(text_content)), 0) + COALESCE(SUM(length(metadata)), 0) AS stored_bytes
+            FROM event_payloads
+        """).fetchone()
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+        free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        auto_vacuum = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+        analyzed = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone()
+        try:
+            wal_bytes = os.path.getsize(partition.path + "-wal")
+        except OSError:
+            wal_bytes = 0  # Checkpointed and truncated, or a memory database
+        databases.append(DatabaseStorage(
+            name=os.path.basename(partition.path if partition is not _main else METRICS_DB_PATH),
+            page_size=page_size, page_count=page_count, free_pages=free_pages,
+            database_bytes=page_size * page_count, wal_bytes=wal_bytes,
+            auto_vacuum=AUTO_VACUUM_MODES[auto_vacuum], analyzed=analyzed is not None
+        ))
+        for column in ("payloads", "text_bytes", "metadata_bytes", "stored_bytes"):
+            report[column] += row[column]
+        report["database_bytes"] += page_size * page_count
+        report["free_bytes"] += page_size * free_pages
+        report["page_count"] += page_count
+        report["free_pages"] += free_pages
+        report["wal_bytes"] += wal_bytes
+    
+    raw_bytes = report["text_bytes"] + report["metadata_bytes"]
+    return StorageResponse(
+        partitions=len(databases) - 1,
+        databases=databases,
+        maintenance=_maintenance_stats,
+        saved_bytes=raw_bytes - report["stored_bytes"],
+        compression_ratio=round(raw_bytes / report["stored_bytes"], 2) if report["stored_bytes"] else None,
+        **report
+    )
+
+
+# Storage report
+@app.get("/api/metrics/storage", response_model=StorageResponse)
+async def get_storage():
+    """Report space saved by compressing stored text and metadata, and page usage per database"""
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=503, detail="Metrics collection is disabled")
+    
+    return await run_read(storage_report)
+
+
+# Debug profiler
+_profiler = Profiler()
+
+
+def require_profiler(authorization: Optional[str] = Header(None)):
+    """Hide the profiler unless PROFILER_TOKEN is set, and require that token"""
+    if not PROFILER_TOKEN:
+        raise HTTPException(status_code=404, detail="Profiler is disabled")
+    supplied = (authorization or "").removeprefix("Bearer ").strip()
+    # Bytes, since compare_digest() refuses non-ASCII strings
+    if not hmac.compare_digest(supplied.encode(), PROFILER_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+
+@app.post("/debug/profile", status_code=202, dependencies=[Depends(require_profiler)])
+async def start_profile(
+    seconds: float = Query(10, gt=0, le=120, description="Capture duration in seconds"),
+    mode: str = Query("cpu", pattern="^(cpu|memory)$", description="'cpu' (stack sampling) or 'memory' (tracemalloc)"),
+    interval: float = Query(0.01, gt=0, le=1, description="CPU sampling interval in seconds")
+):
+    """Start a background profile capture"""
+    if not _profiler.start(seconds, mode=mode, interval=interval):
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    _, info = _profiler.status()
+    return {"status": "running", **info}
+
+
+@app.get("/debug/profile", dependencies=[Depends(require_profiler)])
+async def get_profile():
+    """Return the last capture as collapsed stacks (flamegraph input)"""
+    state, info = _profiler.status()
+    if state == "idle":
+        raise HTTPException(status_code=404, detail="No profile captured yet")
+    if state == "running":
+        return JSONResponse(status_code=202, content={"status": "running", **info})
+    if info["error"]:
+        raise HTTPException(status_code=500, detail=f"Profile failed: {info['error']}")
+    return PlainTextResponse(
+        info["body"],
+        headers={
+            "Content-Disposition": f"attachment; filename=yap-metrics-{info['mode']}.folded",
+            "X-Profile-Samples": str(info["samples"])
+        }
+    )
 
 
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8091)
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="YAP Metrics service")
+    parser.add_argument("command", nargs="?", default="serve",
+                        choices=["serve", "backfill-rollups", "storage-report", "import"],
+                        help="'serve' (default) runs the API; 'backfill-rollups' rebuilds the summary rollups from events; "
+                             "'storage-report' prints space saved by payload compression; "
+                             "'import' loads exported events from FILE")
+    parser.add_argument("file", nargs="?", help="For import: an export file, optionally gzipped ('-' for stdin)")
+    parser.add_argument("--format", choices=["json", "ndjson"],
+                        help="For import: the file's format (default: ndjson for .ndjson/.jsonl names, else json)")
+    args = parser.parse_args()
+    
+    if METRICS_STORAGE == "memory" and args.command in ("backfill-rollups", "import"):
+        # This process would only change its own copy in memory, and a
+        # running service's next snapshot would overwrite anything it saved
+        parser.error(f"'{args.command}' cannot write to METRICS_STORAGE=memory. "
+                     + ("Use POST /api/metrics/import on the running service, or stop" if args.command == "import"
+                        else "Stop")
+                     + f" the service and run it with METRICS_STORAGE=sqlite on the snapshot {METRICS_DB_PATH}")
+    
+    if args.command == "backfill-rollups":
+        init_db()
+        print(f"Rebuilt rollups from {rebuild_rollups()} events")
+    elif args.command == "storage-report":
+        init_db()
+        print(storage_report().model_dump_json(indent=2))
+    elif args.command == "import":
+        if not args.file:
+            parser.error("import needs a FILE")
+        format = args.format or ("ndjson" if re.search(r"\.(ndjson|jsonl)(\.gz)?$", args.file) else "json")
+        init_db()
+        try:
+            result = import_file(args.file, format)
+        except ValueError as e:
+            sys.exit(f"Import failed: {e}")
+        print(f"Imported {result.imported} of {result.count} events ({result.duplicates} already stored) "
+              f"in {result.seconds:.1f}s, {result.rows_per_second:,.0f} events/s")
+    else:
+        import uvicorn
+        uvicorn.run(app, host="0.0.0.0", port=8091)
@@ -0,0 +1,68 @@
+"""
+YAP Metrics - Compressed event payloads
+
+Stored text and metadata live in the event_payloads side table, compressed
+with zlib (raw deflate) primed with a preset dictionary of common English
+words and JSON fragments. Transcripts are short, so without a dictionary
+there is little history for deflate to refer back to; with one, even a
+single sentence compresses.
+
+Every blob starts with a format byte. Values that do not shrink are stored
+as-is under FORMAT_RAW, and a better dictionary can be introduced later as
+a new format while existing rows keep decoding. Never edit DICTIONARY_V1.
+"""
+
+import zlib
+
+FORMAT_RAW = 0
+FORMAT_DEFLATE_V1 = 1
+
+# Most useful strings last: deflate reaches the end of the dictionary with
+# the shortest distances
+DICTIONARY_V1 = (
+    '{"source": "", "language": "en", "voice": "", "model": "", "engine": "", '
+    '"error": "", "speed": 1.0, "format": "", "sample_rate": , "true", "false", null}'
+    " January February March April May June July August September October November December"
+    " Monday Tuesday Wednesday Thursday Friday Saturday Sunday morning afternoon evening tonight"
+    " tomorrow yesterday today next week last week month year hour minute minutes second"
+    " one two three four five six seven eight nine ten hundred thousand first"
+    " please thank you thanks hello hi okay OK yes no sorry maybe really actually"
+    " something anything everything nothing someone people person thing things time"
+    " because about after before again also always any around back being between"
+    " could would should might must can will shall did does done doing make made"
+    " going get got give take took come came know think thought want need like"
+    " just only still even much many more most very well good great right now"
+    " here there where when what which while who why how than then them they"
+    " their these those this that with from into over under some other such"
+    " call send email message text meeting remind reminder note notes list"
+    " open close start stop play pause read write search find check set turn"
+    " I'm I've I'll I'd don't can't won't it's that's there's let's you're we're"
+    " the of and to a in is it you that he was for on are as with his they I at"
+    " be this have from or one had by word but not what all were we when your"
+    ". The , and . I , but . It . This . We . You ? "
+).encode()
+
+
+def compress(text):
+    """Encode a string as a payload blob (None stays None)"""
+    if text is None:
+        return None
+    data = text.encode()
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -15, zdict=DICTIONARY_V1)
+    packed = compressor.compress(data) + compressor.flush()
+    if len(packed) < len(data):
+        return bytes((FORMAT_DEFLATE_V1,)) + packed
+    return bytes((FORMAT_RAW,)) + data
+
+
+def decompress(blob):
+    """Decode a payload blob back to its string (None stays None)"""
+    if blob is None:
+        return None
+    format, data = blob[0], blob[1:]
+    if format == FORMAT_RAW:
+        return data.decode()
+    if format == FORMAT_DEFLATE_V1:
+        decompressor = zlib.decompressobj(-15, zdict=DICTIONARY_V1)
+        return (decompressor.decompress(data) + decompressor.flush()).decode()
+    raise ValueError(f"Unknown payload format {format}")
@@ -0,0 +1,154 @@
+"""
+YAP Metrics - Mergeable quantile sketches
+
+A small DDSketch: values are counted in logarithmic bins sized so that any
+quantile read back is within RELATIVE_ACCURACY of the true value. A bin is
+chosen by the value alone, so two sketches merge exactly by adding their
+bin counts, and a value can be removed again by subtracting it. That lets
+the rollup tables keep one sketch per bucket, updated incrementally on
+insert and retention delete, and answer percentiles for any range of
+buckets without reading raw events.
+
+Bins are stored densely from the lowest occupied index (values are
+clamped to [MIN_VALUE, MAX_VALUE], which bounds a sketch to about 1,200
+bins), so a sketch serializes to a compact little-endian blob (zero count and first index as
+int64, then one int32 count per bin) that loads and saves without a
+per-bin Python loop. Merging a single event into a large sketch is cheap.
+"""
+
+import math
+import sys
+from array import array
+
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+LOG_GAMMA = math.log(GAMMA)
+
+# Values below MIN_VALUE (including zero durations) share a single bin, and
+# values above MAX_VALUE (about 116 days) count in the top one, so a single
+# absurd duration cannot stretch the dense bin array
+MIN_VALUE = 1e-3
+MAX_VALUE = 1e7
+
+_HEADER_BYTES = 16
+_SWAP = sys.byteorder != "little"
+
+
+class DDSketch:
+    """Counts of values in logarithmic bins, plus a bin for values near zero"""
+
+    def __init__(self, counts=None, offset=0, zero=0):
+        self.counts = counts if counts is not None else array("i")
+        self.offset = offset  # bin index of counts[0]
+        self.zero = zero
+
+    @property
+    def count(self):
+        return self.zero + sum(self.counts)
+
+    def _cover(self, low, high):
+        """Grow the dense bin array to include indexes low..high"""
+        if not self.counts:
+            self.counts = array("i", bytes(4 * (high - low + 1)))
+            self.offset = low
+            return
+        if low < self.offset:
+            self.counts = array("i", bytes(4 * (self.offset - low))) + self.counts
+            self.offset = low
+        end = self.offset + len(self.counts) - 1
+        if high > end:
+            self.counts.extend(array("i", bytes(4 * (high - end))))
+
+    def _trim(self):
+        """Drop empty bins at either end"""
+        start, end = 0, len(self.counts)
+        while start < end and self.counts[start] == 0:
+            start += 1
+        while end > start and self.counts[end - 1] == 0:
+            end -= 1
+        if start or end < len(self.counts):
+            self.counts = self.counts[start:end]
+            self.offset += start
+
+    def add(self, value, count=1):
+        """Count a value (count=-1 builds a sketch that removes it on merge); NaN and infinities are skipped"""
+        if value is not None and not math.isfinite(value):
+            return self
+        if value is None or value < MIN_VALUE:
+            self.zero += count
+        else:
+            index = math.ceil(math.log(min(value, MAX_VALUE)) / LOG_GAMMA)
+            self._cover(index, index)
+            self.counts[index - self.offset] += count
+        return self
+
+    def merge(self, other):
+        """Add another sketch's counts into this one; negative results are dropped"""
+        self.zero = max(self.zero + other.zero, 0)
+        if other.counts:
+            self._cover(other.offset, other.offset + len(other.counts) - 1)
+            shift = other.offset - self.offset
+            for i, count in enumerate(other.counts):
+                if count:
+                    self.counts[shift + i] = max(self.counts[shift + i] + count, 0)
+            self._trim()
+        return self
+
+    def quantile(self, q):
+        """Estimate the q-quantile (0 <= q <= 1), or None if empty"""
+        total = self.count
+        if total <= 0:
+            return None
+        rank = q * (total - 1)
+        seen = self.zero
+        if rank < seen:
+            return 0.0
+        index = self.offset
+        for index, count in enumerate(self.counts, start=self.offset):
+            seen += count
+            if seen > rank:
+                break
+        # Bin index covers (GAMMA^(index-1), GAMMA^index]
+        return 2 * GAMMA ** index / (GAMMA + 1)
+
+    def to_bytes(self):
+        header = array("q", (self.zero, self.offset))
+        counts = self.counts
+        if _SWAP:
+            header.byteswap()
+            counts = array("i", counts)
+            counts.byteswap()
+        return header.tobytes() + counts.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data):
+        if not data:
+            return cls()
+        header = array("q")
+        header.frombytes(data[:_HEADER_BYTES])
+        counts = array("i")
+        counts.frombytes(data[_HEADER_BYTES:])
+        if _SWAP:
+            header.byteswap()
+            counts.byteswap()
+        return cls(counts, header[1], header[0])
+
+
+def merge_sketches(left, right):
+    """SQL function: merge two serialized sketches (either may be NULL)"""
+    if right is None:
+        return left
+    return DDSketch.from_bytes(left).merge(DDSketch.from_bytes(right)).to_bytes()
+
+
+class SketchAggregate:
+    """SQL aggregate: build a serialized sketch from a column of values"""
+
+    def __init__(self):
+        self.sketch = DDSketch()
+
+    def step(self, value):
+        self.sketch.add(value)
+
+    def finalize(self):
+        return self.sketch.to_bytes()
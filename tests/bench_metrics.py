@@ -0,0 +1,353 @@
+"""
+Load test and query benchmark for the YAP Metrics Service
+
+Seeds a metrics database with synthetic events, then drives the app
+in-process (httpx over ASGI: no server, no network) with concurrent async
+clients, and reports ingest events/s and p50/p99 latency per read endpoint:
+
+    python tests/bench_metrics.py --events 1000000 --clients 16
+    python tests/bench_metrics.py --events 1000000 --db /tmp/bench.sqlite  # seed once, rerun fast
+
+Seeding goes straight through insert_events(), so it is timed separately
+from ingest, which posts through the API. Summaries are measured both as
+served (from the in-memory cache) and with the cache dropped before every
+request.
+
+The query plans of the read endpoints are compared with
+tests/metrics_query_plans.json, and a changed plan (for example a query that
+no longer uses its covering index) fails the run. Seeding ends with
+ANALYZE, as the service's background maintenance would, so the plans are
+those of a long-running service; they do not depend on table size, so
+test_metrics_service.py checks the same snapshot on a small database. After
+reviewing an intended change, record it with --update-plans.
+"""
+
+import argparse
+import asyncio
+import difflib
+import importlib.util
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import httpx
+
+METRICS_DIR = Path(__file__).resolve().parent.parent / 'services' / 'yap-metrics'
+PLANS_PATH = Path(__file__).resolve().parent / 'metrics_query_plans.json'
+
+# Keep every seeded event: no age or count retention, and text stored for search
+APP_ENV = {
+    'METRICS_ENABLED': 'true',
+    'METRICS_STORE_TEXT': 'true',
+    'METRICS_RETENTION_DAYS': '36500',
+    'METRICS_MAX_EVENTS': '1000000000',
+}
+
+EVENT_TYPES = ('asr_record', 'asr_transcribe', 'tts_synthesize', 'tts_play')
+EVENT_WEIGHTS = (3, 3, 3, 1)
+VOICES = ('amy', 'lessac', 'ryan', 'cori')
+MODELS = ('whisper-tiny', 'whisper-base', 'parakeet')
+WORDS = ('remind me to call the dentist about the meeting next week and send '
+         'a message to the team before lunch on tuesday morning').split()
+
+SEED_CHUNK = 10_000
+
+# (name, path, drop the summary cache before each request)
+READ_SCENARIOS = (
+    ('summary today', '/api/metrics/summary?range=today', False),
+    ('summary 30d', '/api/metrics/summary?range=30d', False),
+    ('summary 30d uncached', '/api/metrics/summary?range=30d', True),
+    ('summary all uncached', '/api/metrics/summary?range=all', True),
+    ('summary 30d by voice', '/api/metrics/summary?range=30d&group_by=voice', True),
+    ('timeseries today', '/api/metrics/timeseries?range=today&bucket=hour', False),
+    ('timeseries 30d', '/api/metrics/timeseries?range=30d', False),
+    ('timeseries 30d by model', '/api/metrics/timeseries?range=30d&group_by=model', False),
+    ('history', '/api/metrics/history?limit=50', False),
+    ('history by type', '/api/metrics/history?limit=50&event_type=tts_synthesize', False),
+    ('history by category', '/api/metrics/history?limit=50&category=asr', False),
+    ('history next page', '/api/metrics/history?limit=50&include_total=false&before={cursor}', False),
+    ('search', '/api/metrics/search?q=dentist+meeting', False),
+)
+
+
+def load_app(db_path):
+    """Import a fresh copy of the service against db_path, configured by APP_ENV"""
+    os.environ.update(APP_ENV, METRICS_DB_PATH=str(db_path))
+    sys.path.insert(0, str(METRICS_DIR))
+    spec = importlib.util.spec_from_file_location('yap_metrics_bench', METRICS_DIR / 'app.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def synthetic_events(count, days=30, seed=0, now=None):
+    """Yield count event dicts spread evenly over the last days, oldest first"""
+    rng = random.Random(seed)
+    now = now or datetime.utcnow()
+    start = now - timedelta(days=days)
+    step = (now - start) / max(count, 1)
+    for i in range(count):
+        event_type = rng.choices(EVENT_TYPES, EVENT_WEIGHTS)[0]
+        duration = round(rng.lognormvariate(0.5, 0.8), 3)
+        event = {
+            'timestamp': (start + step * i).isoformat(),
+            'event_type': event_type,
+            'duration_seconds': duration,
+            'status': 'error' if rng.random() < 0.02 else 'success',
+            'uuid': str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+        }
+        if event_type.startswith('asr_'):
+            event['output_chars'] = int(duration * 15)
+            event['metadata'] = {'model': rng.choice(MODELS), 'language': 'en'}
+            if event_type == 'asr_transcribe' and rng.random() < 0.1:
+                event['text_content'] = ' '.join(rng.choices(WORDS, k=12))
+        else:
+            event['input_chars'] = int(duration * 15)
+            event['metadata'] = {'voice': rng.choice(VOICES)}
+        yield event
+
+
+def stored_events(module):
+    with module.get_db() as conn:
+        return conn.execute("SELECT COUNT(*) FROM events").fetchone()[0]
+
+
+def seed(module, count, days=30, seed=0):
+    """Insert synthetic events directly (not through the API); return events/s"""
+    module.init_db()
+    now = datetime.utcnow()
+    started = time.perf_counter()
+    rows = []
+    for event in synthetic_events(count, days, seed, now):
+        event = module.MetricEvent.model_validate(event)
+        rows.append(module.event_row(event, module.event_timestamp(event, now)))
+        if len(rows) == SEED_CHUNK:
+            module.insert_events(rows)
+            rows = []
+    if rows:
+        module.insert_events(rows)
+    rate = count / (time.perf_counter() - started)
+    # Plan as a long-running service would, with the statistics its
+    # background maintenance keeps up to date
+    for partition in module.partitions():
+        module.analyze_database(partition)
+    return rate
+
+
+def percentiles(latencies):
+    """p50 and p99 of latencies in seconds, as milliseconds"""
+    if len(latencies) < 2:
+        latencies = latencies * 2
+    cuts = statistics.quantiles(latencies, n=100, method='inclusive')
+    return {'p50_ms': round(cuts[49] * 1000, 3), 'p99_ms': round(cuts[98] * 1000, 3)}
+
+
+async def run_clients(clients, requests, send):
+    """Run requests calls of send() across concurrent clients; return (latencies, seconds)"""
+    latencies = []
+    counter = iter(range(requests))
+
+    async def client_loop():
+        for i in counter:
+            started = time.perf_counter()
+            await send(i)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client_loop() for _ in range(clients)))
+    return latencies, time.perf_counter() - started
+
+
+async def bench_ingest(client, clients, count, batch_size):
+    """Post count new events singly, then in batches; return events/s and latency per mode"""
+    results = {}
+    # Unseeded, so rerunning against the same --db still posts new events
+    events = list(synthetic_events(count, days=1, seed=None))
+
+    async def post_one(i):
+        response = await client.post('/api/metrics/event', json=events[i])
+        response.raise_for_status()
+
+    latencies, seconds = await run_clients(clients, count, post_one)
+    results['single'] = {'events': count, 'events_per_second': round(count / seconds, 1), **percentiles(latencies)}
+
+    events = list(synthetic_events(count, days=1, seed=None))
+    batches = [events[i:i + batch_size] for i in range(0, count, batch_size)]
+
+    async def post_batch(i):
+        response = await client.post('/api/metrics/events', json=batches[i])
+        response.raise_for_status()
+
+    latencies, seconds = await run_clients(clients, len(batches), post_batch)
+    results[f'batch of {batch_size}'] = {
+        'events': count, 'events_per_second': round(count / seconds, 1), **percentiles(latencies)
+    }
+    return results
+
+
+async def scenario_paths(client):
+    """Each read scenario with its path filled in (a real history cursor)"""
+    page = (await client.get('/api/metrics/history?limit=50&include_total=false')).json()
+    cursor = page.get('next_cursor') or ''
+    return [(name, path.format(cursor=cursor), uncached) for name, path, uncached in READ_SCENARIOS]
+
+
+async def bench_reads(module, client, clients, requests):
+    """Time each read scenario; return req/s and latency per scenario"""
+    results = {}
+    for name, path, uncached in await scenario_paths(client):
+        async def get(_):
+            if uncached:
+                module._summary_cache.invalidate()
+            response = await client.get(path)
+            response.raise_for_status()
+
+        await get(0)  # warm up
+        latencies, seconds = await run_clients(clients, requests, get)
+        results[name] = {'requests': requests, 'requests_per_second': round(requests / seconds, 1),
+                         **percentiles(latencies)}
+    return results
+
+
+class StatementLog:
+    """Collects the SELECT statements run on traced connections while recording"""
+
+    def __init__(self):
+        self.recording = False
+        self.statements = []
+        self._lock = threading.Lock()
+
+    def __call__(self, sql):
+        # Trigger bodies are traced as comments; only top-level reads matter
+        if self.recording and sql.lstrip().upper().startswith(('SELECT', 'WITH')):
+            with self._lock:
+                self.statements.append(sql)
+
+
+def trace_statements(module):
+    """Trace every pooled connection the module opens from now on"""
+    log = StatementLog()
+    connect = module.ConnectionPool._connect
+
+    def traced_connect(pool):
+        conn = connect(pool)
+        conn.set_trace_callback(log)
+        return conn
+
+    module.ConnectionPool._connect = traced_connect
+    return log
+
+
+def explain(module, sql):
+    """The query plan of a statement, as lines indented by depth"""
+    with module.get_db() as conn:
+        rows = conn.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+    depth = {0: -1}
+    lines = []
+    for node, parent, _, detail in rows:
+        depth[node] = depth.get(parent, -1) + 1
+        lines.append('  ' * depth[node] + detail)
+    return lines
+
+
+async def capture_plans(module, client, log):
+    """Run each read scenario once (uncached) and return its statements' plans"""
+    plans = {}
+    for name, path, _ in await scenario_paths(client):
+        module._summary_cache.invalidate()
+        log.statements.clear()
+        log.recording = True
+        try:
+            response = await client.get(path)
+        finally:
+            log.recording = False
+        response.raise_for_status()
+        plans[name] = [explain(module, sql) for sql in log.statements]
+    return plans
+
+
+def plan_diff(expected, actual):
+    """Unified diff between two plan snapshots ('' if they match)"""
+    def render(plans):
+        return json.dumps(plans, indent=2, sort_keys=True).splitlines(keepends=True)
+    return ''.join(difflib.unified_diff(render(expected), render(actual), 'expected plans', 'actual plans'))
+
+
+def load_plans():
+    return json.loads(PLANS_PATH.read_text())
+
+
+def save_plans(plans):
+    PLANS_PATH.write_text(json.dumps(plans, indent=2, sort_keys=True) + '\n')
+
+
+async def run(module, log, clients, ingest, batch_size, requests):
+    """Drive the app in-process; return plans, ingest and read results"""
+    transport = httpx.ASGITransport(app=module.app)
+    async with module.app.router.lifespan_context(module.app):
+        async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+            plans = await capture_plans(module, client, log)
+            reads = await bench_reads(module, client, clients, requests)
+            ingested = await bench_ingest(client, clients, ingest, batch_size) if ingest else {}
+    return {'plans': plans, 'ingest': ingested, 'reads': reads}
+
+
+def print_report(results):
+    print(f"\nSeeded {results['events']:,} events at {results['seed_events_per_second']:,.0f} events/s")
+    if results['ingest']:
+        print(f"\n{'Ingest (' + str(results['clients']) + ' clients)':<28}{'events/s':>12}{'p50 ms':>10}{'p99 ms':>10}")
+        for name, result in results['ingest'].items():
+            print(f"{name:<28}{result['events_per_second']:>12,.0f}{result['p50_ms']:>10.2f}{result['p99_ms']:>10.2f}")
+    print(f"\n{'Read (' + str(results['clients']) + ' clients)':<28}{'req/s':>12}{'p50 ms':>10}{'p99 ms':>10}")
+    for name, result in results['reads'].items():
+        print(f"{name:<28}{result['requests_per_second']:>12,.0f}{result['p50_ms']:>10.2f}{result['p99_ms']:>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--events', type=int, default=100_000, help='events to seed (default: 100000)')
+    parser.add_argument('--days', type=int, default=30, help='days the seeded events span (default: 30)')
+    parser.add_argument('--db', help='database to use; seeded only up to --events, so reruns skip seeding '
+                                     '(default: a temporary file)')
+    parser.add_argument('--clients', type=int, default=8, help='concurrent clients (default: 8)')
+    parser.add_argument('--ingest', type=int, default=2000, help='events to post through the API (default: 2000)')
+    parser.add_argument('--batch-size', type=int, default=100, help='events per batch post (default: 100)')
+    parser.add_argument('--requests', type=int, default=200, help='requests per read endpoint (default: 200)')
+    parser.add_argument('--update-plans', action='store_true', help=f'record the query plans in {PLANS_PATH.name}')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        module = load_app(args.db or Path(tmp) / 'metrics.sqlite')
+        log = trace_statements(module)
+        module.init_db()
+        stored = stored_events(module)
+        missing = args.events - stored
+        seed_rate = seed(module, missing, args.days, seed=stored) if missing > 0 else 0.0
+        results = asyncio.run(run(module, log, args.clients, args.ingest, args.batch_size, args.requests))
+        results.update(events=args.events, clients=args.clients, seed_events_per_second=round(seed_rate, 1))
+
+    if args.update_plans:
+        save_plans(results['plans'])
+    diff = '' if args.update_plans else plan_diff(load_plans(), results['plans'])
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_report(results)
+        if not diff:
+            print(f"\nQuery plans {'recorded in' if args.update_plans else 'match'} {PLANS_PATH.name}")
+    if diff:
+        sys.stderr.write(f"\nQuery plans changed (run with --update-plans if intended):\n{diff}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
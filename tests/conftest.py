@@ -0,0 +1,47 @@
+"""
+Shared fixtures for in-process service tests
+
+The live-service tests (test_metrics.py, test_tts.py, ...) talk to running
+containers over HTTP. The fixtures here load a service module directly
+against a temporary database instead, for tests that need to inspect
+internals such as query plans or timing.
+"""
+
+import importlib.util
+from pathlib import Path
+
+import pytest
+
+METRICS_DIR = Path(__file__).resolve().parent.parent / 'services' / 'yap-metrics'
+
+
+@pytest.fixture
+def load_metrics_app(tmp_path, monkeypatch):
+    """
+    Return a loader for a fresh copy of services/yap-metrics/app.py.
+
+    Keyword arguments are set as environment variables before import;
+    METRICS_DB_PATH defaults to a file in the test's tmp_path.
+    """
+    def load(**env):
+        env.setdefault('METRICS_DB_PATH', str(tmp_path / 'metrics.sqlite'))
+        for key, value in env.items():
+            monkeypatch.setenv(key, str(value))
+        monkeypatch.syspath_prepend(str(METRICS_DIR))
+        spec = importlib.util.spec_from_file_location('yap_metrics_app', METRICS_DIR / 'app.py')
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+
+    return load
+
+
+@pytest.fixture
+def metrics_client(load_metrics_app):
+    """A TestClient for the metrics service with lifespan (startup) run."""
+    from fastapi.testclient import TestClient
+
+    module = load_metrics_app()
+    with TestClient(module.app) as client:
+        client.module = module
+        yield client
@@ -9,6 +9,7 @@ import pytest
 import requests
 import os
 import json
+import uuid
 from datetime import datetime
 
 # Determine base URL from environment or use default for local testing
@@ -31,6 +32,24 @@ class TestMetricsHealth:
         assert data['status'] == 'ok'
         assert 'metrics_enabled' in data
 
+    def test_health_reports_retention_cleanup(self):
+        """Health endpoint should report background retention cleanup timing"""
+        response = requests.get(f'{METRICS_BASE_URL}/health')
+        data = response.json()
+        if not data.get('metrics_enabled'):
+            pytest.skip("Metrics collection is disabled")
+        assert 'retention' in data
+        assert 'last_duration_ms' in data['retention']
+        assert 'last_deleted' in data['retention']
+
+    def test_health_reports_write_buffer(self):
+        """Health endpoint should report the write-behind buffer (null when disabled)"""
+        response = requests.get(f'{METRICS_BASE_URL}/health')
+        data = response.json()
+        assert 'write_buffer' in data
+        if data['write_buffer'] is not None:
+            assert {'depth', 'last_flush_ms', 'dropped'} <= set(data['write_buffer'])
+
 
 class TestMetricsConfig:
     """Test metrics configuration endpoint"""
@@ -142,6 +161,53 @@ class TestMetricsEventRecording:
             assert response.status_code == 422
 
 
+class TestMetricsBatchRecording:
+    """Test batched event recording endpoint"""
+
+    def test_record_event_batch(self):
+        """Should record several events in one request"""
+        events = [
+            {"event_type": "asr_record", "duration_seconds": 3.0},
+            {"event_type": "asr_transcribe", "duration_seconds": 1.2, "output_chars": 40},
+            {"event_type": "tts_synthesize", "duration_seconds": 2.5, "input_chars": 40,
+             "timestamp": datetime.utcnow().isoformat() + "Z"}
+        ]
+        
+        response = requests.post(f'{METRICS_BASE_URL}/api/metrics/events', json=events)
+        
+        if response.status_code == 503:
+            pytest.skip("Metrics collection is disabled")
+        
+        assert response.status_code == 200
+        data = response.json()
+        assert data['success'] == True
+        assert data['count'] == 3
+
+    def test_resent_events_are_ignored(self):
+        """Events whose uuid is already stored should be skipped"""
+        event = {"event_type": "asr_record", "duration_seconds": 1.0, "uuid": str(uuid.uuid4())}
+        
+        response = requests.post(f'{METRICS_BASE_URL}/api/metrics/events', json=[event, event])
+        
+        if response.status_code == 503:
+            pytest.skip("Metrics collection is disabled")
+        
+        if response.status_code == 200:
+            assert response.json()['duplicates'] == 1
+        retry = requests.post(f'{METRICS_BASE_URL}/api/metrics/event', json=event)
+        assert retry.json()['uuid'] == event['uuid']
+    
+    def test_record_event_batch_validates_events(self):
+        """Should reject a batch containing an invalid event"""
+        response = requests.post(
+            f'{METRICS_BASE_URL}/api/metrics/events',
+            json=[{"duration_seconds": 1.0}]
+        )
+        
+        if response.status_code != 503:
+            assert response.status_code == 422
+
+
 class TestMetricsSummary:
     """Test metrics summary endpoint"""
 
@@ -189,6 +255,50 @@ class TestMetricsSummary:
         assert 'tts_events' in data
         assert 'asr_seconds_recorded' in data
         assert 'tts_seconds_generated' in data
+    
+    def test_summary_revalidates_with_etag(self):
+        """Should answer 304 to a request carrying the current ETag"""
+        response = requests.get(f'{METRICS_BASE_URL}/api/metrics/summary?range=all')
+        
+        if response.status_code == 503:
+            pytest.skip("Metrics collection is disabled")
+        
+        etag = response.headers['ETag']
+        again = requests.get(f'{METRICS_BASE_URL}/api/metrics/summary?range=all',
+                             headers={'If-None-Match': etag})
+        assert again.status_code == 304
+    
+    def test_summary_groups_by_voice(self):
+        """Should total events by their metadata voice"""
+        voice = f"test-{uuid.uuid4()}"
+        response = requests.post(f'{METRICS_BASE_URL}/api/metrics/event', json={
+            "event_type": "tts_synthesize", "input_chars": 5, "metadata": {"voice": voice}})
+        
+        if response.status_code == 503:
+            pytest.skip("Metrics collection is disabled")
+        
+        data = requests.get(f'{METRICS_BASE_URL}/api/metrics/summary?range=today&group_by=voice').json()
+        groups = [g for g in data['groups'] if g['group'] == voice]
+        assert [(g['event_type'], g['count'], g['input_chars']) for g in groups] == [("tts_synthesize", 1, 5)]
+
+
+class TestMetricsTimeseries:
+    """Test metrics time series endpoint"""
+
+    def test_timeseries_returns_buckets_and_percentiles(self):
+        """Time series should return per-bucket series and range totals"""
+        response = requests.get(f'{METRICS_BASE_URL}/api/metrics/timeseries?range=7d&bucket=hour')
+        
+        if response.status_code == 503:
+            pytest.skip("Metrics collection is disabled")
+        
+        assert response.status_code == 200
+        data = response.json()
+        assert data['bucket'] == 'hour'
+        assert 'series' in data
+        assert 'totals' in data
+        for point in data['series']:
+            assert 'p95' in point
 
 
 class TestMetricsHistory:
@@ -217,6 +327,25 @@ class TestMetricsHistory:
         assert 'limit' in data
         assert 'offset' in data
 
+    def test_history_cursor_pagination(self):
+        """History should page with the next_cursor from the previous page"""
+        first = requests.get(f'{METRICS_BASE_URL}/api/metrics/history?limit=1')
+        
+        if first.status_code == 503:
+            pytest.skip("Metrics collection is disabled")
+        
+        assert first.status_code == 200
+        data = first.json()
+        assert 'next_cursor' in data
+        if not data['next_cursor']:
+            pytest.skip("Not enough events to page")
+        
+        second = requests.get(
+            f'{METRICS_BASE_URL}/api/metrics/history?limit=1&before={data["next_cursor"]}'
+        )
+        assert second.status_code == 200
+        assert second.json()['events'][0]['id'] != data['events'][0]['id']
+
     def test_history_filter_by_event_type(self):
         """History should support filtering by event type"""
         response = requests.get(f'{METRICS_BASE_URL}/api/metrics/history?event_type=asr_transcribe')
@@ -231,6 +360,69 @@ class TestMetricsHistory:
             assert event['event_type'] == 'asr_transcribe'
 
 
+class TestMetricsLive:
+    """Test the live event feed"""
+    
+    def test_live_feed_pushes_new_events(self):
+        """Should push a stored event to an open stream"""
+        with requests.get(f'{METRICS_BASE_URL}/api/metrics/live', stream=True, timeout=10) as stream:
+            if stream.status_code == 503:
+                pytest.skip("Metrics collection is disabled")
+            assert stream.status_code == 200
+            assert stream.headers['content-type'].startswith('text/event-stream')
+            
+            requests.post(f'{METRICS_BASE_URL}/api/metrics/event',
+                          json={"event_type": "tts_play", "duration_seconds": 4.0})
+            for line in stream.iter_lines(decode_unicode=True):
+                if line.startswith('data: '):
+                    data = json.loads(line[len('data: '):])
+                    break
+        
+        assert data['events'][0]['event_type'] == 'tts_play'
+        assert data['summary']['tts_seconds_generated'] == 4.0
+
+
+class TestMetricsSearch:
+    """Test metrics full-text search endpoint"""
+
+    def test_search_returns_ranked_results(self):
+        """Search should return results with snippets and a cursor"""
+        response = requests.get(f'{METRICS_BASE_URL}/api/metrics/search', params={'q': 'test transcript'})
+        
+        if response.status_code == 503:
+            pytest.skip("Metrics collection is disabled")
+        
+        assert response.status_code == 200
+        data = response.json()
+        assert data['query'] == 'test transcript'
+        assert 'next_cursor' in data
+        for result in data['results']:
+            assert '<mark>' in result['snippet']
+
+    def test_search_requires_query(self):
+        """Search without a query should be rejected"""
+        response = requests.get(f'{METRICS_BASE_URL}/api/metrics/search')
+        
+        if response.status_code != 503:
+            assert response.status_code == 422
+
+
+class TestMetricsStorage:
+    """Test metrics storage report endpoint"""
+
+    def test_storage_report(self):
+        """Storage report should compare raw and stored payload sizes"""
+        response = requests.get(f'{METRICS_BASE_URL}/api/metrics/storage')
+        
+        if response.status_code == 503:
+            pytest.skip("Metrics collection is disabled")
+        
+        assert response.status_code == 200
+        data = response.json()
+        assert data['saved_bytes'] == data['text_bytes'] + data['metadata_bytes'] - data['stored_bytes']
+        assert data['database_bytes'] >= data['free_bytes']
+
+
 class TestMetricsExport:
     """Test metrics export endpoint"""
 
@@ -255,6 +447,18 @@ class TestMetricsExport:
         assert 'total_events' in data
         assert 'events' in data
         assert isinstance(data['events'], list)
+    
+    def test_import_skips_stored_events(self):
+        """Importing the same events twice should store them once"""
+        body = "\n".join(json.dumps({"event_type": "asr_record", "uuid": str(uuid.uuid4())}) for _ in range(3))
+        response = requests.post(f'{METRICS_BASE_URL}/api/metrics/import?format=ndjson', data=body)
+        
+        if response.status_code == 503:
+            pytest.skip("Metrics collection is disabled")
+        
+        assert response.json()['imported'] == 3
+        again = requests.post(f'{METRICS_BASE_URL}/api/metrics/import?format=ndjson', data=body).json()
+        assert (again['imported'], again['duplicates']) == (0, 3)
 
 
 class TestMetricsClear:
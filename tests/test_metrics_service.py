@@ -0,0 +1,1871 @@
+"""
+In-process tests for the YAP Metrics Service
+
+Unlike test_metrics.py, these load services/yap-metrics/app.py directly
+against a temporary SQLite database (see conftest.py), so they need no
+running service and can check timing and storage behaviour.
+"""
+
+import asyncio
+import csv
+import gzip
+import io
+import json
+import random
+import statistics
+import time
+import tracemalloc
+import uuid
+from datetime import datetime, timedelta
+
+import httpx
+import pytest
+
+from tests import bench_metrics
+
+
+def make_event(**overrides):
+    event = {
+        "event_type": "asr_transcribe",
+        "duration_seconds": 1.5,
+        "input_chars": 0,
+        "output_chars": 20,
+        "status": "success",
+    }
+    event.update(overrides)
+    return event
+
+
+async def timed_get(client, url):
+    started = time.perf_counter()
+    response = await client.get(url)
+    assert response.status_code == 200
+    return time.perf_counter() - started
+
+
+class TestEventLoopIsolation:
+    """SQLite work should not block the event loop"""
+
+    SLOW_WRITE_SECONDS = 0.05
+    WRITES = 20
+
+    def test_reads_stay_fast_during_write_burst(self, load_metrics_app, monkeypatch):
+        """/health and /summary latency should stay flat while writes queue up"""
+        module = load_metrics_app()
+
+        # Simulate slow storage: every insert holds the writer for a while
+        original_insert = module.insert_event
+
+        def slow_insert(*args):
+            time.sleep(self.SLOW_WRITE_SECONDS)
+            return original_insert(*args)
+
+        monkeypatch.setattr(module, "insert_event", slow_insert)
+
+        async def scenario():
+            transport = httpx.ASGITransport(app=module.app)
+            async with module.app.router.lifespan_context(module.app):
+                async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                    baseline = [await timed_get(client, "/api/metrics/summary") for _ in range(5)]
+
+                    writes = [
+                        asyncio.create_task(client.post("/api/metrics/event", json=make_event()))
+                        for _ in range(self.WRITES)
+                    ]
+                    await asyncio.sleep(0)
+
+                    during = []
+                    for _ in range(10):
+                        during.append(await timed_get(client, "/health"))
+                        during.append(await timed_get(client, "/api/metrics/summary"))
+                    writes_pending = sum(not task.done() for task in writes)
+
+                    responses = await asyncio.gather(*writes)
+                    return baseline, during, writes_pending, responses
+
+        baseline, during, writes_pending, responses = asyncio.run(scenario())
+
+        assert all(response.status_code == 200 for response in responses)
+        # The reads really did overlap the burst...
+        assert writes_pending > 0
+        # ...and none of them waited behind the queued writes
+        burst_seconds = self.SLOW_WRITE_SECONDS * self.WRITES
+        assert max(during) < burst_seconds / 4
+        assert statistics.median(during) < max(statistics.median(baseline) * 10, 0.05)
+
+
+class TestConnectionPool:
+    """Connections should be pooled, long-lived and in WAL mode"""
+
+    def test_connections_use_wal_and_busy_timeout(self, metrics_client):
+        """Pooled connections should be configured for concurrent access"""
+        with metrics_client.module.get_db() as conn:
+            assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+            assert conn.execute("PRAGMA busy_timeout").fetchone()[0] == 5000
+            assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
+
+    def test_connections_are_reused(self, metrics_client):
+        """Requests should reuse pooled connections instead of reconnecting"""
+        pool = metrics_client.module._pool
+        for _ in range(20):
+            assert metrics_client.post("/api/metrics/event", json=make_event()).status_code == 200
+            assert metrics_client.get("/api/metrics/summary").status_code == 200
+        assert pool._opened <= pool.size
+
+    def test_failed_transaction_is_rolled_back(self, metrics_client):
+        """A connection returned mid-transaction should be rolled back"""
+        module = metrics_client.module
+        with pytest.raises(RuntimeError):
+            with module.get_db() as conn:
+                conn.execute("DELETE FROM events")
+                raise RuntimeError("boom")
+        with module.get_db() as conn:
+            assert not conn.in_transaction
+
+
+def query_plan(conn, sql, params=()):
+    return " ".join(row["detail"] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params))
+
+
+def wait_until(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+class TestRetention:
+    """Retention should run in the background, not on the insert path"""
+
+    def test_insert_does_not_run_cleanup(self, load_metrics_app, monkeypatch):
+        """Recording an event should not call cleanup_old_events()"""
+        from fastapi.testclient import TestClient
+
+        module = load_metrics_app(METRICS_CLEANUP_INTERVAL=3600)
+        with TestClient(module.app) as client:
+            runs = client.get("/health").json()["retention"]["runs"]
+            for _ in range(5):
+                client.post("/api/metrics/event", json=make_event())
+            assert client.get("/health").json()["retention"]["runs"] == runs
+
+    def test_size_threshold_triggers_cleanup(self, load_metrics_app):
+        """Growing past max events should trigger a background cleanup"""
+        from fastapi.testclient import TestClient
+
+        module = load_metrics_app(METRICS_MAX_EVENTS=10, METRICS_CLEANUP_INTERVAL=3600,
+                                  METRICS_CLEANUP_BATCH=7)
+        with TestClient(module.app) as client:
+            for _ in range(module.retention_threshold() + 1):
+                client.post("/api/metrics/event", json=make_event())
+
+            assert wait_until(lambda: client.get("/health").json()["retention"]["runs"] >= 2)
+            retention = client.get("/health").json()["retention"]
+            assert retention["last_deleted"] > 0
+            assert retention["last_duration_ms"] is not None
+            assert module.count_events() == 10
+            assert retention["row_estimate"] == 10
+
+    def test_old_events_deleted_in_batches(self, metrics_client):
+        """Expired events should be removed in bounded batches, oldest first"""
+        module = metrics_client.module
+        with module.get_db() as conn:
+            conn.executemany(
+                "INSERT INTO events (timestamp, event_type) VALUES (?, 'asr_record')",
+                [(f"2000-01-01T00:00:{i:02d}",) for i in range(30)]
+            )
+            conn.commit()
+
+        assert module.delete_events_before("2000-01-01T00:00:20", 8) == 8
+        assert module.delete_events_before("2000-01-01T00:00:20", 8) == 8
+        assert module.delete_events_before("2000-01-01T00:00:20", 8) == 4
+        assert module.count_events() == 10
+
+    def test_batch_delete_uses_epoch_index(self, metrics_client):
+        """The batch delete should seek through the integer timestamp index"""
+        module = metrics_client.module
+        with module.get_db() as conn:
+            plan = query_plan(conn, f"""
+                SELECT id, timestamp FROM events
+                WHERE epoch_ms < {module.EPOCH_MS_SQL.format('?')} ORDER BY epoch_ms LIMIT ?
+            """, ("2000-01-01", 10))
+        assert "USING INDEX idx_events_epoch" in plan
+        assert "TEMP B-TREE" not in plan
+
+
+class TestBatchIngestion:
+    """POST /api/metrics/events should store many events in one transaction"""
+
+    def test_batch_is_stored_in_one_write(self, metrics_client, monkeypatch):
+        """A batch should be inserted with a single write call"""
+        module = metrics_client.module
+        calls = []
+        original = module.insert_events
+        monkeypatch.setattr(module, "insert_events", lambda rows: calls.append(len(rows)) or original(rows))
+
+        events = [make_event(output_chars=i) for i in range(25)]
+        response = metrics_client.post("/api/metrics/events", json=events)
+
+        assert response.status_code == 200
+        assert response.json() == {"success": True, "count": 25, "duplicates": 0}
+        assert calls == [25]
+        assert module.count_events() == 25
+
+    def test_client_timestamps_are_kept(self, metrics_client):
+        """Buffered events should keep the time they happened, not the flush time"""
+        events = [
+            make_event(timestamp="2024-05-01T10:00:00Z"),
+            make_event(timestamp="2024-05-01T12:30:00+02:00"),
+            make_event(timestamp="2999-01-01T00:00:00Z"),
+        ]
+        assert metrics_client.post("/api/metrics/events", json=events).status_code == 200
+
+        stored = sorted(e["timestamp"] for e in metrics_client.get("/api/metrics/history").json()["events"])
+        assert stored[0] == "2024-05-01T10:00:00"
+        assert stored[1] == "2024-05-01T10:30:00"
+        # Future timestamps are clamped to the time of receipt
+        assert stored[2] < "2999"
+
+    def test_empty_batch_is_accepted(self, metrics_client):
+        """An empty batch should succeed without writing"""
+        response = metrics_client.post("/api/metrics/events", json=[])
+        assert response.status_code == 200
+        assert response.json()["count"] == 0
+
+    def test_oversized_batch_is_rejected(self, load_metrics_app):
+        """Batches above METRICS_MAX_BATCH should be rejected"""
+        from fastapi.testclient import TestClient
+
+        module = load_metrics_app(METRICS_MAX_BATCH=3)
+        with TestClient(module.app) as client:
+            response = client.post("/api/metrics/events", json=[make_event()] * 4)
+            assert response.status_code == 413
+
+    def test_invalid_event_rejects_whole_batch(self, metrics_client):
+        """A malformed event should fail validation without storing the batch"""
+        response = metrics_client.post("/api/metrics/events", json=[make_event(), {"duration_seconds": 1}])
+        assert response.status_code == 422
+        assert metrics_client.module.count_events() == 0
+
+
+def raw_summary(conn, cutoff):
+    """The summary computed straight from the events table, for comparison"""
+    row = conn.execute("""
+        SELECT COUNT(*) AS total,
+               SUM(event_type LIKE 'asr\\_%' ESCAPE '\\') AS asr_events,
+               SUM(event_type LIKE 'tts\\_%' ESCAPE '\\') AS tts_events,
+               COALESCE(SUM(CASE WHEN event_type = 'asr_record' THEN duration_seconds END), 0) AS recorded,
+               COALESCE(SUM(CASE WHEN event_type LIKE 'tts\\_%' ESCAPE '\\' THEN duration_seconds END), 0) AS generated,
+               COALESCE(SUM(input_chars), 0) AS input_chars
+        FROM events WHERE timestamp >= ?
+    """, (cutoff,)).fetchone()
+    return dict(row)
+
+
+class TestRollups:
+    """Summaries should be served from hourly/daily rollups"""
+
+    def insert_spread(self, client, count=300, days=40):
+        """Insert events spread over the last few weeks at odd times"""
+        now = datetime.utcnow()
+        types = ["asr_record", "asr_transcribe", "tts_synthesize", "tts_play"]
+        events = [
+            make_event(
+                event_type=types[i % len(types)],
+                duration_seconds=round(0.25 + i % 7, 2),
+                input_chars=i % 11,
+                timestamp=(now - timedelta(minutes=i * days * 24 * 60 // count + i % 13)).isoformat()
+            )
+            for i in range(count)
+        ]
+        for start in range(0, count, 100):
+            assert client.post("/api/metrics/events", json=events[start:start + 100]).status_code == 200
+
+    def assert_summaries_match_events(self, client):
+        module = client.module
+        now = datetime.utcnow()
+        cutoffs = {
+            "today": now.replace(hour=0, minute=0, second=0, microsecond=0),
+            "7d": now - timedelta(days=7),
+            "30d": now - timedelta(days=30),
+            "all": datetime(1970, 1, 1),
+        }
+        for name, cutoff in cutoffs.items():
+            summary = client.get(f"/api/metrics/summary?range={name}").json()
+            with module.get_db() as conn:
+                expected = raw_summary(conn, cutoff.isoformat())
+            # The range's cutoff moves with the clock, so allow one event at the edge
+            assert abs(summary["total_events"] - expected["total"]) <= 1, name
+            if summary["total_events"] == expected["total"]:
+                assert summary["asr_events"] == expected["asr_events"], name
+                assert summary["tts_events"] == expected["tts_events"], name
+                assert summary["asr_seconds_recorded"] == pytest.approx(expected["recorded"]), name
+                assert summary["tts_seconds_generated"] == pytest.approx(expected["generated"]), name
+                assert summary["total_input_chars"] == expected["input_chars"], name
+
+    def test_inserts_update_rollups(self, metrics_client):
+        """Single and batch inserts should update both rollup tables"""
+        metrics_client.post("/api/metrics/event", json=make_event(
+            event_type="asr_record", duration_seconds=2.0, timestamp="2024-05-01T10:15:00Z"))
+        metrics_client.post("/api/metrics/events", json=[
+            make_event(event_type="asr_record", duration_seconds=3.0, timestamp="2024-05-01T10:45:00Z"),
+            make_event(event_type="asr_record", duration_seconds=4.0, timestamp="2024-05-01T11:05:00Z"),
+        ])
+        with metrics_client.module.get_db() as conn:
+            hourly = [tuple(row) for row in conn.execute(
+                "SELECT bucket, count, duration_seconds FROM rollup_hourly ORDER BY bucket")]
+            daily = [tuple(row) for row in conn.execute(
+                "SELECT bucket, count, duration_seconds FROM rollup_daily")]
+        assert hourly == [("2024-05-01T10:00:00", 2, 5.0), ("2024-05-01T11:00:00", 1, 4.0)]
+        assert daily == [("2024-05-01T00:00:00", 3, 9.0)]
+
+    def test_summary_matches_raw_events(self, metrics_client):
+        """Every range should add up to the same totals as a full scan"""
+        self.insert_spread(metrics_client)
+        self.assert_summaries_match_events(metrics_client)
+
+    def test_summary_bounds_split_partial_edge(self, metrics_client):
+        """Only the partial hour at the start of a range should come from raw events"""
+        bounds = metrics_client.module.summary_bounds
+        assert bounds("2024-05-01T10:15:30") == (
+            "2024-05-01T10:15:30", "2024-05-01T11:00:00", "2024-05-02T00:00:00")
+        assert bounds("2024-05-01T00:00:00") == (
+            "2024-05-01T00:00:00", "2024-05-01T00:00:00", "2024-05-01T00:00:00")
+
+    def test_retention_keeps_rollups_in_step(self, metrics_client):
+        """Deleting old events should subtract them from the rollups"""
+        module = metrics_client.module
+        self.insert_spread(metrics_client)
+        cutoff = (datetime.utcnow() - timedelta(days=10)).isoformat()
+        while module.delete_events_before(cutoff, 25):
+            pass
+        self.assert_summaries_match_events(metrics_client)
+        with module.get_db() as conn:
+            assert conn.execute("SELECT COUNT(*) FROM rollup_daily WHERE count <= 0").fetchone()[0] == 0
+
+    def test_clearing_history_clears_rollups(self, metrics_client):
+        """Clearing all history should also empty the rollups"""
+        self.insert_spread(metrics_client, count=20)
+        metrics_client.delete("/api/metrics/history")
+        assert metrics_client.get("/api/metrics/summary?range=all").json()["total_events"] == 0
+
+    def test_backfill_rebuilds_from_events(self, metrics_client):
+        """rebuild_rollups() should restore rollups for events inserted directly"""
+        module = metrics_client.module
+        self.insert_spread(metrics_client, count=50)
+        with module.get_db() as conn:
+            conn.execute("DELETE FROM rollup_hourly")
+            conn.execute("DELETE FROM rollup_daily")
+            conn.commit()
+        assert metrics_client.get("/api/metrics/summary?range=all").json()["total_events"] == 0
+
+        assert module.rebuild_rollups() == 50
+        self.assert_summaries_match_events(metrics_client)
+
+    def test_existing_database_is_backfilled_on_startup(self, load_metrics_app, tmp_path):
+        """A database from before rollups existed should be backfilled at startup"""
+        import sqlite3
+        from fastapi.testclient import TestClient
+
+        path = tmp_path / "old.sqlite"
+        conn = sqlite3.connect(path)
+        conn.execute("""
+            CREATE TABLE events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp TEXT NOT NULL, event_type TEXT NOT NULL,
+                duration_seconds REAL DEFAULT 0, input_chars INTEGER DEFAULT 0, output_chars INTEGER DEFAULT 0,
+                status TEXT DEFAULT 'success', text_content TEXT, metadata TEXT
+            )
+        """)
+        conn.executemany("INSERT INTO events (timestamp, event_type) VALUES (?, 'tts_play')",
+                         [(datetime.utcnow().isoformat(),)] * 3)
+        conn.commit()
+        conn.close()
+
+        module = load_metrics_app(METRICS_DB_PATH=path)
+        with TestClient(module.app) as client:
+            assert client.get("/api/metrics/summary?range=all").json()["tts_events"] == 3
+
+
+class TestHistoryPagination:
+    """History should page by cursor through the (timestamp, id) index"""
+
+    def insert_events(self, client, count=23):
+        # Several events share a timestamp, so the id tie-break matters
+        events = [
+            make_event(event_type="asr_record" if i % 3 else "tts_play",
+                       timestamp=f"2024-05-01T10:00:{i // 4:02d}Z")
+            for i in range(count)
+        ]
+        assert client.post("/api/metrics/events", json=events).status_code == 200
+
+    def walk(self, client, query=""):
+        pages, cursor = [], None
+        while True:
+            url = f"/api/metrics/history?limit=5{query}" + (f"&before={cursor}" if cursor else "")
+            data = client.get(url).json()
+            pages.append(data)
+            cursor = data["next_cursor"]
+            if not cursor:
+                return pages
+
+    def test_cursor_pages_cover_every_event_once(self, metrics_client):
+        """Walking by cursor should return every event once, newest first"""
+        self.insert_events(metrics_client)
+        pages = self.walk(metrics_client)
+
+        keys = [(e["timestamp"], e["id"]) for page in pages for e in page["events"]]
+        assert len(keys) == 23
+        assert keys == sorted(set(keys), reverse=True)
+        assert len(pages) == 5
+        assert all(page["total"] == 23 for page in pages)
+
+    def test_cursor_matches_offset_paging(self, metrics_client):
+        """Cursor and offset pages should agree, including with a type filter"""
+        self.insert_events(metrics_client)
+        pages = self.walk(metrics_client, "&event_type=asr_record")
+        by_cursor = [e["id"] for page in pages for e in page["events"]]
+
+        by_offset = []
+        for offset in range(0, 23, 5):
+            data = metrics_client.get(
+                f"/api/metrics/history?limit=5&offset={offset}&event_type=asr_record").json()
+            by_offset.extend(e["id"] for e in data["events"])
+        assert by_cursor == by_offset
+        assert pages[0]["total"] == len(by_offset)
+
+    def test_total_is_optional(self, metrics_client):
+        """include_total=false should skip counting"""
+        self.insert_events(metrics_client, count=3)
+        data = metrics_client.get("/api/metrics/history?include_total=false").json()
+        assert data["total"] is None
+        assert len(data["events"]) == 3
+        assert data["next_cursor"] is None
+
+    def test_invalid_cursor_is_rejected(self, metrics_client):
+        """A malformed cursor or a cursor combined with offset should be a 400"""
+        assert metrics_client.get("/api/metrics/history?before=not-a-cursor").status_code == 400
+        cursor = metrics_client.module.encode_cursor(1714557600000, 1)
+        assert metrics_client.get(f"/api/metrics/history?before={cursor}&offset=5").status_code == 400
+
+    @pytest.mark.parametrize("column, value, index", [
+        (None, None, "idx_events_epoch"),
+        ("event_type", "asr_record", "idx_events_type_epoch"),
+        ("category", "asr", "idx_events_category_epoch"),
+    ])
+    def test_cursor_query_seeks_through_index(self, metrics_client, column, value, index):
+        """Cursor pages should be an index range search with no sort step"""
+        where = f"WHERE {column} = ? AND" if column else "WHERE"
+        params = ([value] if column else []) + [1714557600000, 5]
+        with metrics_client.module.get_db() as conn:
+            plan = query_plan(conn, f"""
+                SELECT * FROM events {where} (epoch_ms, id) < (?, ?)
+                ORDER BY epoch_ms DESC, id DESC LIMIT 51
+            """, params)
+        assert plan.startswith(f"SEARCH events USING INDEX {index} ")
+        assert "TEMP B-TREE" not in plan
+
+    def test_category_filter(self, metrics_client):
+        """History should filter by category"""
+        self.insert_events(metrics_client)
+        data = metrics_client.get("/api/metrics/history?category=tts&limit=100").json()
+        assert {e["event_type"] for e in data["events"]} == {"tts_play"}
+        assert data["total"] == len(data["events"]) == 8
+        assert metrics_client.get("/api/metrics/history?category=other").status_code == 422
+
+
+class TestStreamingExport:
+    """Export should stream in bounded chunks, in several formats"""
+
+    def insert_events(self, client, count=12):
+        events = [
+            make_event(event_type="asr_record" if i % 2 else "tts_play",
+                       metadata={"n": i} if i % 3 == 0 else None,
+                       timestamp=f"2024-05-{1 + i:02d}T10:00:00Z")
+            for i in range(count)
+        ]
+        assert client.post("/api/metrics/events", json=events).status_code == 200
+
+    def test_json_export_is_compatible(self, metrics_client, monkeypatch):
+        """The default export should be the same JSON document as before"""
+        monkeypatch.setattr(metrics_client.module, "METRICS_EXPORT_CHUNK", 5)
+        self.insert_events(metrics_client)
+        response = metrics_client.get("/api/metrics/export")
+
+        assert response.status_code == 200
+        data = response.json()
+        assert data["total_events"] == 12
+        timestamps = [e["timestamp"] for e in data["events"]]
+        assert timestamps == sorted(timestamps, reverse=True)
+        assert data["events"][-1]["metadata"] == {"n": 0}
+        assert "attachment" in response.headers["content-disposition"]
+
+    def test_ndjson_export_with_filters(self, metrics_client, monkeypatch):
+        """NDJSON should emit one event per line, honouring filters"""
+        monkeypatch.setattr(metrics_client.module, "METRICS_EXPORT_CHUNK", 2)
+        self.insert_events(metrics_client)
+        response = metrics_client.get(
+            "/api/metrics/export?format=ndjson&event_type=asr_record"
+            "&start=2024-05-03T00:00:00Z&end=2024-05-10T00:00:00Z"
+        )
+
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        events = [json.loads(line) for line in response.text.splitlines()]
+        assert [e["timestamp"][:10] for e in events] == ["2024-05-08", "2024-05-06", "2024-05-04"]
+        assert all(e["event_type"] == "asr_record" for e in events)
+
+    def test_gzipped_csv_export(self, metrics_client):
+        """CSV export should gzip cleanly and keep metadata as JSON"""
+        self.insert_events(metrics_client, count=4)
+        response = metrics_client.get("/api/metrics/export?format=csv&gzip=true")
+
+        assert response.headers["content-type"] == "application/gzip"
+        assert response.headers["content-disposition"].endswith('.csv.gz"')
+        rows = list(csv.DictReader(io.StringIO(gzip.decompress(response.content).decode())))
+        assert len(rows) == 4
+        assert json.loads(rows[-1]["metadata"]) == {"n": 0}
+        assert rows[1]["metadata"] == ""
+
+    def test_memory_stays_flat(self, metrics_client, monkeypatch):
+        """Streaming a large export should only hold one chunk at a time"""
+        module = metrics_client.module
+        monkeypatch.setattr(module, "METRICS_STORE_TEXT", True)
+        monkeypatch.setattr(module, "METRICS_EXPORT_CHUNK", 50)
+        text = "x" * 2000
+        rows = [module.event_row(module.MetricEvent(event_type="asr_transcribe", text_content=text),
+                                 f"2024-05-01T10:{i // 60:02d}:{i % 60:02d}") for i in range(2000)]
+        module.insert_events(rows)
+
+        async def consume():
+            size = 0
+            async for chunk in module.render_export("ndjson", module.iter_export_chunks(None, None, None)):
+                size += len(chunk)
+            return size
+
+        tracemalloc.start()
+        try:
+            size = asyncio.run(consume())
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        # Loading everything at once would peak above the export's own size
+        assert size > 4_000_000
+        assert peak < size / 4
+
+
+LEGACY_EVENTS_SCHEMA = """
+    CREATE TABLE events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp TEXT NOT NULL, event_type TEXT NOT NULL,
+        duration_seconds REAL DEFAULT 0, input_chars INTEGER DEFAULT 0, output_chars INTEGER DEFAULT 0,
+        status TEXT DEFAULT 'success', text_content TEXT, metadata TEXT
+    )
+"""
+
+
+class TestSchemaMigrations:
+    """Schema changes should be applied by ordered, versioned migrations"""
+
+    def test_fresh_database_is_at_latest_version(self, metrics_client):
+        """A new database should have every migration applied"""
+        module = metrics_client.module
+        with module.get_db() as conn:
+            assert module.schema_version(conn) == len(module.MIGRATIONS)
+            assert module.migrate(conn) == []
+
+    def test_legacy_database_is_migrated(self, load_metrics_app, tmp_path):
+        """An unversioned database should gain the new columns, backfilled"""
+        import sqlite3
+
+        path = tmp_path / "legacy.sqlite"
+        conn = sqlite3.connect(path)
+        conn.execute(LEGACY_EVENTS_SCHEMA)
+        conn.execute("CREATE INDEX idx_events_timestamp ON events(timestamp)")
+        conn.execute("INSERT INTO events (timestamp, event_type) VALUES ('2024-05-01T10:00:00.123456', 'asr_record')")
+        conn.execute("INSERT INTO events (timestamp, event_type) VALUES ('2024-05-01T11:00:00', 'tts_play')")
+        conn.commit()
+        conn.close()
+
+        module = load_metrics_app(METRICS_DB_PATH=path)
+        module.init_db()
+        with module.get_db() as conn:
+            rows = [tuple(row) for row in conn.execute("SELECT epoch_ms, category FROM events ORDER BY id")]
+            indexes = {row["name"] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+            assert module.schema_version(conn) == len(module.MIGRATIONS)
+        assert rows == [(1714557600123, "asr"), (1714561200000, "tts")]
+        assert "idx_events_timestamp" not in indexes
+        assert {"idx_events_epoch", "idx_events_summary"} <= indexes
+
+    def test_new_columns_filled_on_every_insert(self, metrics_client):
+        """Inserts through the API and raw SQL should both fill epoch_ms and category"""
+        module = metrics_client.module
+        metrics_client.post("/api/metrics/event", json=make_event(
+            event_type="tts_synthesize", timestamp="2024-05-01T10:00:00Z"))
+        with module.get_db() as conn:
+            conn.execute("INSERT INTO events (timestamp, event_type) VALUES ('2024-05-01T10:00:01', 'asr_record')")
+            conn.commit()
+            rows = [tuple(row) for row in conn.execute("SELECT epoch_ms, category FROM events ORDER BY id")]
+        assert rows == [(1714557600000, "tts"), (1714557601000, "asr")]
+
+    def test_newer_schema_is_refused(self, metrics_client):
+        """A database migrated by a newer version of the service should not be touched"""
+        module = metrics_client.module
+        with module.get_db() as conn:
+            conn.execute("INSERT INTO schema_version (version) VALUES (?)", (len(module.MIGRATIONS) + 1,))
+            conn.commit()
+            with pytest.raises(RuntimeError):
+                module.migrate(conn)
+
+    def test_failed_migration_is_rolled_back(self, metrics_client, monkeypatch):
+        """A failing migration should leave the schema and version unchanged"""
+        module = metrics_client.module
+
+        def broken(conn):
+            conn.execute("CREATE TABLE half_done (id INTEGER)")
+            raise RuntimeError("boom")
+
+        monkeypatch.setattr(module, "MIGRATIONS", module.MIGRATIONS + [broken])
+        with module.get_db() as conn:
+            with pytest.raises(RuntimeError):
+                module.migrate(conn)
+            assert module.schema_version(conn) == len(module.MIGRATIONS) - 1
+            assert not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'half_done'").fetchone()
+
+    def test_summary_edge_uses_covering_index(self, metrics_client):
+        """The raw-event part of a summary should be answered from the index alone"""
+        module = metrics_client.module
+        epoch = module.EPOCH_MS_SQL.format("?")
+        with module.get_db() as conn:
+            plan = query_plan(conn, f"""
+                SELECT event_type, COUNT(*), SUM(duration_seconds), SUM(input_chars), SUM(output_chars)
+                FROM events WHERE epoch_ms >= {epoch} AND epoch_ms < {epoch} GROUP BY event_type
+            """, ("2024-05-01T10:15:00", "2024-05-01T11:00:00"))
+        assert "USING COVERING INDEX idx_events_summary" in plan
+
+    def test_retention_cutoff_scans_index_only(self, metrics_client):
+        """Finding the Nth newest event should walk the epoch index, not sort"""
+        with metrics_client.module.get_db() as conn:
+            plan = query_plan(conn, "SELECT timestamp FROM events ORDER BY epoch_ms DESC LIMIT 1 OFFSET 5")
+        assert "idx_events_epoch" in plan
+        assert "TEMP B-TREE" not in plan
+
+
+class TestQuantileSketch:
+    """DDSketch percentiles should be accurate and merge exactly"""
+
+    @pytest.fixture
+    def sketch_module(self, metrics_client):
+        import sketch
+        return sketch
+
+    def test_quantiles_within_relative_accuracy(self, sketch_module):
+        """Estimated percentiles should be within 1% of the exact values"""
+        rng = random.Random(7)
+        values = sorted(rng.lognormvariate(0, 1.5) for _ in range(20000))
+        sketch = sketch_module.DDSketch()
+        for value in values:
+            sketch.add(value)
+
+        for q in (0.5, 0.95, 0.99):
+            exact = values[int(q * (len(values) - 1))]
+            assert sketch.quantile(q) == pytest.approx(exact, rel=0.0101)
+
+    def test_merge_and_remove_are_exact(self, sketch_module):
+        """Merging two halves equals one sketch; subtracting a half restores the other"""
+        DDSketch = sketch_module.DDSketch
+        rng = random.Random(3)
+        first = [rng.uniform(0, 30) for _ in range(500)] + [0, 0]
+        second = [rng.uniform(0.5, 120) for _ in range(500)]
+
+        whole = DDSketch()
+        for value in first + second:
+            whole.add(value)
+        a, b, removal = DDSketch(), DDSketch(), DDSketch()
+        for value in first:
+            a.add(value)
+        for value in second:
+            b.add(value)
+            removal.add(value, -1)
+
+        merged = DDSketch.from_bytes(sketch_module.merge_sketches(a.to_bytes(), b.to_bytes()))
+        assert merged.to_bytes() == whole.to_bytes()
+        assert whole.merge(removal).to_bytes() == a.to_bytes()
+
+    def test_non_finite_values_are_skipped(self, sketch_module):
+        """Infinity and NaN should neither raise nor count"""
+        sketch = sketch_module.DDSketch().add(1.5)
+        for value in (float("inf"), float("-inf"), float("nan")):
+            sketch.add(value)
+        assert sketch.count == 1
+
+    def test_huge_values_stay_small(self, sketch_module):
+        """An absurd value should share the top bin, not stretch the sketch"""
+        sketch = sketch_module.DDSketch().add(1e300).add(0.5)
+        assert len(sketch.to_bytes()) < 8192
+        assert sketch.quantile(1) == pytest.approx(sketch_module.MAX_VALUE, rel=0.0101)
+
+    def test_non_finite_duration_is_rejected(self, metrics_client):
+        """An event with an infinite, NaN or absurd duration should get 422, not a server error"""
+        for duration in ("Infinity", "NaN", "1e999", "1e300"):
+            response = metrics_client.post(
+                "/api/metrics/event", headers={"Content-Type": "application/json"},
+                content=f'{{"event_type": "asr_record", "duration_seconds": {duration}}}'
+            )
+            assert response.status_code == 422
+        assert metrics_client.module.count_events() == 0
+
+    def test_empty_sketch(self, sketch_module):
+        """An empty sketch has no quantiles and round-trips"""
+        sketch = sketch_module.DDSketch.from_bytes(sketch_module.DDSketch().to_bytes())
+        assert sketch.count == 0
+        assert sketch.quantile(0.5) is None
+
+
+class TestTimeseries:
+    """/api/metrics/timeseries should serve per-bucket series from rollups"""
+
+    def insert_hours(self, client):
+        """Three hours of transcriptions; durations are 1..N seconds per hour"""
+        start = datetime.utcnow().replace(minute=0, second=0, microsecond=0) - timedelta(hours=3)
+        events = []
+        for hour, count in enumerate([10, 100, 40]):
+            for i in range(count):
+                events.append(make_event(
+                    duration_seconds=float(i + 1),
+                    timestamp=(start + timedelta(hours=hour, seconds=i)).isoformat()
+                ))
+        events.append(make_event(event_type="tts_synthesize", duration_seconds=2.0,
+                                 timestamp=start.isoformat()))
+        assert client.post("/api/metrics/events", json=events).status_code == 200
+        return start
+
+    def test_hourly_series_with_percentiles(self, metrics_client):
+        """Each hour should report its count, sum and duration percentiles"""
+        start = self.insert_hours(metrics_client)
+        data = metrics_client.get("/api/metrics/timeseries?range=7d&bucket=hour&event_type=asr_transcribe").json()
+
+        assert data["bucket"] == "hour"
+        points = {p["bucket"]: p for p in data["series"]}
+        second = points[(start + timedelta(hours=1)).isoformat()]
+        assert second["count"] == 100
+        assert second["duration_seconds"] == pytest.approx(5050)
+        assert second["p50"] == pytest.approx(50, rel=0.03)
+        assert second["p95"] == pytest.approx(95, rel=0.02)
+        assert second["p99"] == pytest.approx(99, rel=0.02)
+        assert all(p["event_type"] == "asr_transcribe" for p in data["series"])
+
+    def test_range_totals_merge_buckets(self, metrics_client):
+        """Range totals should combine every bucket's sketch"""
+        self.insert_hours(metrics_client)
+        data = metrics_client.get("/api/metrics/timeseries?range=30d").json()
+
+        assert data["bucket"] == "day"
+        totals = {t["event_type"]: t for t in data["totals"]}
+        assert totals["asr_transcribe"]["count"] == 150
+        assert totals["tts_synthesize"]["p50"] == pytest.approx(2.0, rel=0.01)
+        values = sorted(list(range(1, 11)) + list(range(1, 101)) + list(range(1, 41)))
+        assert totals["asr_transcribe"]["p95"] == pytest.approx(values[int(0.95 * 149)], rel=0.02)
+
+    def test_retention_and_rebuild_keep_sketches_exact(self, metrics_client):
+        """Deleting events should update sketches exactly as a rebuild would"""
+        module = metrics_client.module
+        start = self.insert_hours(metrics_client)
+        while module.delete_events_before((start + timedelta(hours=1, seconds=30)).isoformat(), 7):
+            pass
+
+        def sketches():
+            with module.get_db() as conn:
+                return [tuple(row) for row in conn.execute(
+                    "SELECT bucket, event_type, count, duration_sketch FROM rollup_hourly ORDER BY 1, 2")]
+
+        incremental = sketches()
+        module.rebuild_rollups()
+        assert sketches() == incremental
+        assert incremental[0][2] == 70  # second hour lost its first 30 events
+
+    def test_rejects_unknown_bucket(self, metrics_client):
+        """Only hour and day buckets exist"""
+        assert metrics_client.get("/api/metrics/timeseries?bucket=week").status_code == 422
+
+
+class TestTextSearch:
+    """Stored text should be searchable through an FTS5 index"""
+
+    TEXTS = [
+        "Remind me to call the dentist on Tuesday",
+        "The quarterly report is due on Friday",
+        "Call mom about the birthday dinner",
+        "Notes: <script>alert(1)</script> call back later",
+        "Dentist appointment moved, call them to confirm the dentist time",
+    ]
+
+    @pytest.fixture
+    def client(self, load_metrics_app):
+        from fastapi.testclient import TestClient
+
+        module = load_metrics_app(METRICS_STORE_TEXT="true")
+        with TestClient(module.app) as client:
+            client.module = module
+            events = [make_event(text_content=text, timestamp=f"2024-05-0{i + 1}T10:00:00Z")
+                      for i, text in enumerate(self.TEXTS)]
+            events.append(make_event(event_type="tts_synthesize", text_content="Call the dentist"))
+            assert client.post("/api/metrics/events", json=events).status_code == 200
+            yield client
+
+    def search(self, client, query, **params):
+        response = client.get("/api/metrics/search", params={"q": query, **params})
+        assert response.status_code == 200
+        return response.json()
+
+    def test_ranked_highlighted_results(self, client):
+        """Best matches should come first, with matches marked in the snippet"""
+        results = self.search(client, "dentist")["results"]
+        assert len(results) == 3
+        assert [r["rank"] for r in results] == sorted(r["rank"] for r in results)
+        # bm25 favours the short text over the one mentioning it twice
+        assert results[0]["snippet"] == "Call the <mark>dentist</mark>"
+        assert "<mark>Dentist</mark> appointment" in results[1]["snippet"]
+        assert results[1]["snippet"].count("<mark>") == 2
+
+    def test_all_words_must_match_with_stemming(self, client):
+        """Every word should match; stemming should match word forms"""
+        results = self.search(client, "calling dentist", event_type="asr_transcribe")["results"]
+        assert {r["timestamp"][:10] for r in results} == {"2024-05-01", "2024-05-05"}
+
+    def test_snippets_are_escaped(self, client):
+        """Stored text should be HTML-escaped around the highlight markers"""
+        snippet = self.search(client, "alert")["results"][0]["snippet"]
+        assert "&lt;script&gt;<mark>alert</mark>(1)&lt;/script&gt;" in snippet
+
+    def test_punctuation_is_not_query_syntax(self, client):
+        """Quotes, operators and punctuation in the input should not cause errors"""
+        for query in ['"call', "call AND OR", "dentist's", "NEAR(", "*", "Notes:"]:
+            client.get("/api/metrics/search", params={"q": query}).raise_for_status()
+
+    def test_cursor_pagination(self, client):
+        """Pages should follow next_cursor without repeating results"""
+        seen, cursor = [], None
+        while True:
+            params = {"limit": 2}
+            if cursor:
+                params["before"] = cursor
+            page = self.search(client, "call", **params)
+            seen.extend(r["id"] for r in page["results"])
+            cursor = page["next_cursor"]
+            if not cursor:
+                break
+        assert len(seen) == len(set(seen)) == 5
+        assert seen == [r["id"] for r in self.search(client, "call", limit=10)["results"]]
+
+    def test_index_follows_deletes_and_text_clearing(self, client):
+        """Retention deletes and clear_text_only should remove text from the index"""
+        module = client.module
+        while module.delete_events_before("2024-05-02T00:00:00", 10):
+            pass
+        assert len(self.search(client, "dentist")["results"]) == 2
+
+        client.delete("/api/metrics/history?clear_text_only=true")
+        assert self.search(client, "dentist")["results"] == []
+        with module.get_db() as conn:
+            conn.execute("INSERT INTO events_fts (events_fts) VALUES ('integrity-check')")
+
+
+class TestPayloadCompression:
+    """Stored text and metadata should live compressed in a side table"""
+
+    TEXT = "Remind me to call the dentist on Tuesday morning about the appointment next week"
+
+    @pytest.fixture
+    def client(self, load_metrics_app):
+        from fastapi.testclient import TestClient
+
+        module = load_metrics_app(METRICS_STORE_TEXT="true")
+        with TestClient(module.app) as client:
+            client.module = module
+            events = [make_event(text_content=f"{self.TEXT} ({i})", metadata={"language": "en", "n": i},
+                                 timestamp=f"2024-05-01T10:00:{i:02d}Z") for i in range(20)]
+            events.append(make_event(event_type="tts_play"))
+            assert client.post("/api/metrics/events", json=events).status_code == 200
+            yield client
+
+    def test_payload_round_trip(self, load_metrics_app):
+        """Short, long, incompressible and non-ASCII values should decode unchanged"""
+        module = load_metrics_app()
+        for text in ["", "ok", "x" * 5000, self.TEXT, "héllo wörld ✓ 你好", bytes(range(256)).hex()]:
+            assert module.payload.decompress(module.payload.compress(text)) == text
+        assert module.payload.compress(None) is None
+
+    def test_events_rows_hold_no_text(self, client):
+        """Text and metadata should be stored compressed, outside the events table"""
+        with client.module.get_db() as conn:
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(events)")}
+            row = conn.execute("SELECT * FROM event_payloads ORDER BY event_id LIMIT 1").fetchone()
+            payloads = conn.execute("SELECT COUNT(*) FROM event_payloads").fetchone()[0]
+        assert not {"text_content", "metadata"} & columns
+        assert payloads == 20
+        assert row["text_size"] == len(f"{self.TEXT} (0)")
+        assert len(row["text_content"]) < row["text_size"]
+
+    def test_history_and_export_decompress(self, client):
+        """History and export should return the original text and metadata"""
+        events = client.get("/api/metrics/history?limit=100").json()["events"]
+        assert events[0]["event_type"] == "tts_play"
+        assert events[0]["text_content"] is None and events[0]["metadata"] is None
+        assert events[1]["text_content"] == f"{self.TEXT} (19)"
+        assert events[1]["metadata"] == {"language": "en", "n": 19}
+
+        exported = client.get("/api/metrics/export?format=ndjson").text.splitlines()
+        assert json.loads(exported[-1])["text_content"] == f"{self.TEXT} (0)"
+        assert json.loads(exported[-1])["metadata"] == {"language": "en", "n": 0}
+
+    def test_search_reads_compressed_text(self, client):
+        """Search and its snippets should work over the compressed text"""
+        results = client.get("/api/metrics/search", params={"q": "dentist tuesday"}).json()["results"]
+        assert len(results) == 20
+        assert "<mark>dentist</mark> on <mark>Tuesday</mark>" in results[0]["snippet"]
+
+    def test_storage_report(self, client):
+        """The storage report should show the space saved, and follow deletes"""
+        report = client.get("/api/metrics/storage").json()
+        assert report["payloads"] == 20
+        assert report["text_bytes"] == sum(len(f"{self.TEXT} ({i})") for i in range(20))
+        assert report["saved_bytes"] == report["text_bytes"] + report["metadata_bytes"] - report["stored_bytes"]
+        assert report["compression_ratio"] > 1.5
+        assert report["database_bytes"] > 0
+
+        client.delete("/api/metrics/history?clear_text_only=true")
+        report = client.get("/api/metrics/storage").json()
+        assert report["payloads"] == 20 and report["text_bytes"] == 0
+
+        while client.module.delete_events_before("2024-05-01T10:00:10", 3):
+            pass
+        assert client.get("/api/metrics/storage").json()["payloads"] == 10
+
+    def test_legacy_text_is_moved(self, load_metrics_app, tmp_path):
+        """Text stored in events before the side table should be moved and stay searchable"""
+        import sqlite3
+
+        path = tmp_path / "legacy.sqlite"
+        conn = sqlite3.connect(path)
+        conn.execute(LEGACY_EVENTS_SCHEMA)
+        conn.execute("""
+            INSERT INTO events (timestamp, event_type, text_content, metadata)
+            VALUES ('2024-05-01T10:00:00', 'asr_transcribe', 'call the dentist', '{"n": 1}')
+        """)
+        conn.execute("INSERT INTO events (timestamp, event_type) VALUES ('2024-05-01T11:00:00', 'tts_play')")
+        conn.commit()
+        conn.close()
+
+        module = load_metrics_app(METRICS_DB_PATH=path)
+        module.init_db()
+        _, events, _ = module.query_history(10, 0, None)
+        assert (events[1].text_content, events[1].metadata) == ("call the dentist", {"n": 1})
+        results, _ = module.query_search("dentist", 10, None, None)
+        assert [r.snippet for r in results] == ["call the <mark>dentist</mark>"]
+
+
+class TestPartitions:
+    """With METRICS_PARTITION set, events should live in one file per period"""
+
+    @pytest.fixture
+    def client(self, load_metrics_app, tmp_path):
+        from fastapi.testclient import TestClient
+
+        module = load_metrics_app(METRICS_PARTITION="week", METRICS_STORE_TEXT="true",
+                                  METRICS_RETENTION_DAYS=30, METRICS_MAX_EVENTS=1000)
+        with TestClient(module.app) as client:
+            client.module = module
+            client.partition_dir = tmp_path / "partitions"
+            yield client
+
+    def insert_weeks(self, client, days_ago=(40, 20, 3, 0), per_day=10):
+        now = datetime.utcnow()
+        events = [make_event(event_type=random.choice(["asr_transcribe", "tts_play"]),
+                             duration_seconds=random.uniform(0.1, 5), text_content=f"call number {i}",
+                             timestamp=(now - timedelta(days=days, minutes=i)).isoformat() + "Z")
+                  for days in days_ago for i in range(per_day)]
+        random.shuffle(events)
+        assert client.post("/api/metrics/events", json=events).status_code == 200
+        return len(events)
+
+    def files(self, client):
+        return sorted(path.name for path in client.partition_dir.glob("metrics-week-*.sqlite"))
+
+    def test_events_are_split_by_week(self, client):
+        """Each week should get its own file, and the main database none of the events"""
+        self.insert_weeks(client, days_ago=(20, 13, 6))
+        assert len(self.files(client)) == 3
+        with client.module.get_db() as conn:
+            assert conn.execute("SELECT COUNT(*) FROM events").fetchone()[0] == 0
+        assert client.module.count_events() == 30
+
+    def test_reads_merge_across_partitions(self, client):
+        """History, summary, time series, search and export should see every partition"""
+        total = self.insert_weeks(client)
+        seen, cursor = [], None
+        while True:
+            url = "/api/metrics/history?limit=7" + (f"&before={cursor}" if cursor else "")
+            page = client.get(url).json()
+            seen.extend(page["events"])
+            cursor = page["next_cursor"]
+            if not cursor:
+                break
+        assert page["total"] == total
+        assert len({e["id"] for e in seen}) == total
+        assert [e["timestamp"] for e in seen] == sorted((e["timestamp"] for e in seen), reverse=True)
+
+        offset_page = client.get("/api/metrics/history?limit=7&offset=14").json()["events"]
+        assert [e["id"] for e in offset_page] == [e["id"] for e in seen[14:21]]
+
+        assert client.get("/api/metrics/summary?range=all").json()["total_events"] == total
+        series = client.get("/api/metrics/timeseries?range=all").json()
+        assert sum(t["count"] for t in series["totals"]) == total
+        assert len(client.get("/api/metrics/search?q=call&limit=100").json()["results"]) == total
+        assert len(client.get("/api/metrics/export?format=ndjson").text.splitlines()) == total
+
+    def test_age_retention_drops_whole_files(self, client):
+        """Expired weeks should be deleted as files, newer weeks left untouched"""
+        self.insert_weeks(client)
+        assert len(self.files(client)) >= 3
+        asyncio.run(client.module.cleanup_old_events())
+        files = self.files(client)
+        assert len(files) >= 2
+        assert all(name[13:23] >= (datetime.utcnow() - timedelta(days=37)).date().isoformat() for name in files)
+        assert client.module.count_events() == 30
+        assert client.get("/api/metrics/summary?range=all").json()["total_events"] == 30
+
+    def test_event_limit_deletes_oldest_rows(self, client, monkeypatch):
+        """METRICS_MAX_EVENTS should still be enforced across partitions"""
+        self.insert_weeks(client, days_ago=(20, 3, 0))
+        monkeypatch.setattr(client.module, "METRICS_MAX_EVENTS", 15)
+        asyncio.run(client.module.cleanup_old_events())
+        events = client.get("/api/metrics/history?limit=100").json()["events"]
+        assert len(events) == 15
+        assert min(e["timestamp"] for e in events) > (datetime.utcnow() - timedelta(days=4)).isoformat()
+
+    def test_reads_skip_partitions_dropped_meanwhile(self, client, monkeypatch):
+        """A read that listed a partition before retention dropped it should skip it, not recreate it"""
+        module = client.module
+        self.insert_weeks(client)
+        files = self.files(client)
+        listed = module.partitions()
+        oldest = listed[-2]
+        module.drop_partition(oldest)
+        monkeypatch.setattr(module, "partitions", lambda start=None, end=None: listed)
+
+        assert module.count_events() == 30
+        for url in ("/api/metrics/summary?range=all", "/api/metrics/history", "/api/metrics/timeseries?range=all",
+                    "/api/metrics/search?q=call", "/api/metrics/storage"):
+            assert client.get(url).status_code == 200, url
+        assert client.get("/api/metrics/history?limit=100").json()["total"] == 30
+        assert self.files(client) == files[1:]
+        with pytest.raises(module.PoolClosed):
+            with oldest.connection():
+                pass
+
+    def test_clear_history_deletes_files(self, client):
+        """Clearing history should remove partition files"""
+        self.insert_weeks(client)
+        client.delete("/api/metrics/history")
+        assert self.files(client) == []
+        assert client.get("/api/metrics/history").json()["total"] == 0
+        assert client.get("/api/metrics/storage").json()["partitions"] == 0
+
+    def test_partitions_are_reopened(self, client, load_metrics_app):
+        """Existing partition files should be found again on startup, even with partitioning off"""
+        total = self.insert_weeks(client, days_ago=(13, 6))
+        module = load_metrics_app(METRICS_PARTITION="none")
+        module.init_db()
+        assert module.count_events() == total
+        ids = {event.id for event in module.query_history(100, 0, None)[1]}
+        assert len(ids) == total
+
+
+class TestWriteBehind:
+    """With METRICS_WRITE_BEHIND, events should be queued and group-committed"""
+
+    def load(self, load_metrics_app, **env):
+        env = {"METRICS_WRITE_BEHIND": "true", "METRICS_FLUSH_INTERVAL_MS": 50, **env}
+        return load_metrics_app(**env)
+
+    def test_events_are_group_committed(self, load_metrics_app, monkeypatch):
+        """Single events should be acknowledged at once and committed together"""
+        from fastapi.testclient import TestClient
+
+        module = self.load(load_metrics_app)
+        groups = []
+        original = module.insert_events
+        monkeypatch.setattr(module, "insert_events", lambda rows: groups.append(len(rows)) or original(rows))
+        with TestClient(module.app) as client:
+            for _ in range(20):
+                response = client.post("/api/metrics/event", json=make_event())
+                assert response.status_code == 202
+                assert response.json()["id"] is None
+            assert wait_until(lambda: client.get("/api/metrics/history").json()["total"] == 20)
+            stats = client.get("/health").json()["write_buffer"]
+        assert sum(groups) == 20 and len(groups) < 20
+        assert stats["flushed"] == 20 and stats["depth"] == 0
+        assert stats["last_flush_ms"] is not None
+
+    def test_flush_when_group_is_full(self, load_metrics_app):
+        """A full group should be committed without waiting for the interval"""
+        from fastapi.testclient import TestClient
+
+        module = self.load(load_metrics_app, METRICS_FLUSH_INTERVAL_MS=60000, METRICS_FLUSH_EVENTS=10)
+        with TestClient(module.app) as client:
+            client.post("/api/metrics/events", json=[make_event()] * 10)
+            assert wait_until(lambda: client.get("/api/metrics/history").json()["total"] == 10)
+
+    def test_queue_is_flushed_on_shutdown(self, load_metrics_app):
+        """Events still queued at shutdown should be committed by the lifespan"""
+        from fastapi.testclient import TestClient
+
+        module = self.load(load_metrics_app, METRICS_FLUSH_INTERVAL_MS=60000)
+        with TestClient(module.app) as client:
+            assert client.post("/api/metrics/events", json=[make_event()] * 5).status_code == 202
+            assert client.get("/api/metrics/history").json()["total"] == 0
+        # The lifespan closed this module's pools; read back as after a restart
+        assert load_metrics_app().count_events() == 5
+
+    def test_events_queued_during_last_flush_are_kept(self, load_metrics_app, monkeypatch):
+        """A shutdown arriving mid-flush should still commit events queued meanwhile"""
+        import threading
+
+        from fastapi.testclient import TestClient
+
+        module = self.load(load_metrics_app)
+        flushing = threading.Event()
+        original = module.insert_events
+
+        def slow(rows):
+            if not flushing.is_set():
+                flushing.set()
+                time.sleep(0.5)
+            return original(rows)
+
+        monkeypatch.setattr(module, "insert_events", slow)
+        with TestClient(module.app) as client:
+            assert client.post("/api/metrics/event", json=make_event()).status_code == 202
+            assert flushing.wait(5)
+            assert client.post("/api/metrics/event", json=make_event()).status_code == 202
+        assert load_metrics_app().count_events() == 2
+
+    def test_full_buffer_is_refused(self, load_metrics_app):
+        """Events that do not fit should be refused with 503 and counted"""
+        from fastapi.testclient import TestClient
+
+        module = self.load(load_metrics_app, METRICS_FLUSH_INTERVAL_MS=60000, METRICS_BUFFER_SIZE=8)
+        with TestClient(module.app) as client:
+            assert client.post("/api/metrics/events", json=[make_event()] * 6).status_code == 202
+            response = client.post("/api/metrics/events", json=[make_event()] * 3)
+            assert response.status_code == 503
+            assert response.headers["retry-after"] == "1"
+            stats = client.get("/health").json()["write_buffer"]
+            assert (stats["depth"], stats["rejected"]) == (6, 3)
+
+    def test_failed_flush_is_reported(self, load_metrics_app, monkeypatch):
+        """Events lost to a failed commit should be counted as dropped"""
+        from fastapi.testclient import TestClient
+
+        import sqlite3
+
+        module = self.load(load_metrics_app)
+
+        def broken(rows):
+            raise sqlite3.OperationalError("disk I/O error")
+
+        monkeypatch.setattr(module, "insert_events", broken)
+        with TestClient(module.app) as client:
+            client.post("/api/metrics/events", json=[make_event()] * 4)
+            assert wait_until(lambda: client.get("/health").json()["write_buffer"]["dropped"] == 4)
+
+
+class TestIdempotentIngestion:
+    """Events carrying a client uuid should be stored once, however often they are sent"""
+
+    UUID = "7d444840-9dc0-11d1-b245-5ffdce74fad2"
+
+    def test_retried_event_is_stored_once(self, metrics_client):
+        """Resending an event should return the stored id and not count it again"""
+        event = make_event(uuid=self.UUID, duration_seconds=2.0)
+        first = metrics_client.post("/api/metrics/event", json=event).json()
+        second = metrics_client.post("/api/metrics/event", json=event).json()
+
+        assert second["id"] == first["id"]
+        assert first["uuid"] == self.UUID
+        assert metrics_client.module.count_events() == 1
+        summary = metrics_client.get("/api/metrics/summary?range=all").json()
+        assert summary["total_events"] == 1
+        assert summary["asr_seconds_transcribed"] == 2.0
+        history = metrics_client.get("/api/metrics/history").json()
+        assert [event["uuid"] for event in history["events"]] == [self.UUID]
+
+    def test_batch_duplicates_are_skipped(self, metrics_client):
+        """Repeats within a batch, and of stored events, should be reported and not counted"""
+        module = metrics_client.module
+        metrics_client.post("/api/metrics/event", json=make_event(uuid=self.UUID))
+        events = [
+            make_event(uuid=self.UUID),
+            make_event(uuid="00000000-0000-4000-8000-000000000001", metadata={"source": "mic"}),
+            make_event(uuid="00000000-0000-4000-8000-000000000001", metadata={"source": "mic"}),
+            make_event(),
+            make_event(),
+        ]
+        response = metrics_client.post("/api/metrics/events", json=events)
+
+        assert response.json() == {"success": True, "count": 5, "duplicates": 2}
+        assert module.count_events() == 4
+        with module.get_db() as conn:
+            assert conn.execute("SELECT COUNT(*) FROM event_payloads").fetchone()[0] == 1
+            rollup = conn.execute("SELECT SUM(count) FROM rollup_hourly").fetchone()[0]
+        assert rollup == 4
+
+    def test_uuid_must_be_valid(self, metrics_client):
+        """A malformed uuid should be rejected rather than stored"""
+        response = metrics_client.post("/api/metrics/event", json=make_event(uuid="not-a-uuid"))
+        assert response.status_code == 422
+
+    def test_replay_through_write_behind_is_stored_once(self, load_metrics_app):
+        """A duplicate queued in a later flush should be dropped at commit"""
+        from fastapi.testclient import TestClient
+
+        module = load_metrics_app(METRICS_WRITE_BEHIND="true", METRICS_FLUSH_INTERVAL_MS=50)
+        with TestClient(module.app) as client:
+            client.post("/api/metrics/events", json=[make_event(uuid=self.UUID)] * 2)
+            assert wait_until(lambda: client.get("/health").json()["write_buffer"]["flushed"] == 2)
+            client.post("/api/metrics/event", json=make_event(uuid=self.UUID))
+            assert wait_until(lambda: client.get("/health").json()["write_buffer"]["flushed"] == 3)
+        assert load_metrics_app().count_events() == 1
+
+    def test_uuid_lookup_uses_unique_index(self, metrics_client):
+        """Checking a batch for stored uuids should seek the partial unique index"""
+        with metrics_client.module.get_db() as conn:
+            plan = query_plan(conn, "SELECT uuid, id FROM events WHERE uuid IN (?, ?)", (b"a" * 16, b"b" * 16))
+        assert "idx_events_uuid" in plan
+
+
+def parse_sse(chunk):
+    """Split one server-sent event into its fields"""
+    fields = {}
+    for line in chunk.strip().splitlines():
+        name, _, value = line.partition(": ")
+        fields[name] = value
+    return fields
+
+
+class TestLiveFeed:
+    """GET /api/metrics/live should push stored events without re-running queries"""
+
+    def run_live(self, module, scenario):
+        """Run scenario(client, next_message) with the app started and one live subscriber"""
+        async def run():
+            transport = httpx.ASGITransport(app=module.app)
+            async with module.app.router.lifespan_context(module.app):
+                async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                    response = await module.live_events(None)
+                    body = response.body_iterator
+
+                    async def next_message():
+                        return parse_sse(await asyncio.wait_for(anext(body), 5))
+
+                    try:
+                        return await scenario(client, next_message)
+                    finally:
+                        await body.aclose()
+
+        return asyncio.run(run())
+
+    def test_stored_events_are_pushed_with_summary_delta(self, load_metrics_app, monkeypatch):
+        """Each stored batch should arrive once, with ids and the totals it adds"""
+        module = load_metrics_app()
+        monkeypatch.setattr(module, "query_summary", lambda cutoff: pytest.fail("summary was queried"))
+
+        async def scenario(client, next_message):
+            uuid = "7d444840-9dc0-11d1-b245-5ffdce74fad2"
+            await client.post("/api/metrics/events", json=[
+                make_event(uuid=uuid), make_event(event_type="tts_synthesize", duration_seconds=2.0)])
+            first = await next_message()
+            await client.post("/api/metrics/event", json=make_event(uuid=uuid))
+            await client.post("/api/metrics/event", json=make_event(event_type="asr_record"))
+            return first, await next_message()
+
+        first, second = self.run_live(module, scenario)
+
+        assert first["event"] == "events"
+        data = json.loads(first["data"])
+        assert [event["event_type"] for event in data["events"]] == ["asr_transcribe", "tts_synthesize"]
+        assert all(event["id"] for event in data["events"])
+        assert data["summary"]["total_events"] == 2
+        assert data["summary"]["asr_seconds_transcribed"] == 1.5
+        assert data["summary"]["tts_seconds_generated"] == 2.0
+        # The resent event was not stored again, so it was not pushed either
+        assert [event["event_type"] for event in json.loads(second["data"])["events"]] == ["asr_record"]
+
+    def test_clear_history_sends_reset(self, load_metrics_app):
+        """Clearing history cannot be applied incrementally, so clients should reload"""
+        module = load_metrics_app()
+
+        async def scenario(client, next_message):
+            await client.delete("/api/metrics/history")
+            return await next_message()
+
+        assert self.run_live(module, scenario)["event"] == "reset"
+
+    def test_idle_stream_is_kept_alive(self, load_metrics_app, monkeypatch):
+        """An idle stream should send comments so proxies do not close it"""
+        module = load_metrics_app()
+        monkeypatch.setattr(module, "LIVE_PING_SECONDS", 0.05)
+
+        async def scenario(client, next_message):
+            return await next_message()
+
+        # A comment line: no field name
+        assert self.run_live(module, scenario) == {"": "ping"}
+
+    def test_reconnect_replays_missed_messages(self, load_metrics_app):
+        """A client reconnecting with Last-Event-ID should get what it missed, or a reset"""
+        module = load_metrics_app()
+        feed = module.LiveFeed(queue_size=4, replay_size=3)
+        for n in range(5):
+            feed.publish("events", {"n": n})
+
+        def drain(queue):
+            messages = []
+            while not queue.empty():
+                messages.append(queue.get_nowait())
+            return [(kind, json.loads(data)) for _, kind, data in messages]
+
+        assert drain(feed.subscribe(feed.message_id(3))) == [("events", {"n": 3}), ("events", {"n": 4})]
+        assert drain(feed.subscribe(feed.message_id(5))) == []
+        # Older than the replay log, or from a previous process
+        assert drain(feed.subscribe(feed.message_id(1))) == [("reset", {})]
+        assert drain(feed.subscribe("0-4")) == [("reset", {})]
+
+    def test_unwatched_events_are_not_serialized(self, load_metrics_app):
+        """With no subscribers, publishing should only leave a gap that resets late reconnects"""
+        module = load_metrics_app()
+        module.init_db()
+        feed = module.LiveFeed(queue_size=4, replay_size=8)
+        row = module.event_row(module.MetricEvent(event_type="tts_play"), "2024-05-01T10:00:00")
+        last_seen = feed.message_id(feed.seq)
+        feed.publish_events(module.insert_events([row]))
+
+        assert feed.stats["published"] == 0
+        assert feed.subscribe(last_seen).get_nowait()[1] == "reset"
+
+    def test_slow_subscriber_is_reset(self, load_metrics_app):
+        """A subscriber whose queue fills up should get a reset instead of unbounded memory"""
+        module = load_metrics_app()
+        feed = module.LiveFeed(queue_size=2, replay_size=8)
+        queue = feed.subscribe()
+        for n in range(3):
+            feed.publish("events", {"n": n})
+
+        assert queue.qsize() == 1
+        assert queue.get_nowait()[1] == "reset"
+        assert feed.stats["lagged"] == 1
+
+
+class TestSummaryCache:
+    """Summaries should be served from memory and history revalidated with 304s"""
+
+    def count_queries(self, module, monkeypatch):
+        calls = []
+        original = module.query_summary
+        monkeypatch.setattr(module, "query_summary", lambda cutoff: calls.append(cutoff) or original(cutoff))
+        return calls
+
+    def test_cached_summary_follows_inserts(self, metrics_client, monkeypatch):
+        """New events should be added to cached summaries without re-querying"""
+        module = metrics_client.module
+        calls = self.count_queries(module, monkeypatch)
+        yesterday = (datetime.utcnow() - timedelta(days=1)).isoformat()
+        for range in ("today", "7d", "all"):
+            metrics_client.get(f"/api/metrics/summary?range={range}")
+
+        metrics_client.post("/api/metrics/events", json=[
+            make_event(duration_seconds=2.0), make_event(event_type="tts_synthesize", timestamp=yesterday)])
+        metrics_client.post("/api/metrics/event", json=make_event(event_type="asr_record", duration_seconds=3.0))
+        cached = {range: metrics_client.get(f"/api/metrics/summary?range={range}").json()
+                  for range in ("today", "7d", "all")}
+
+        assert len(calls) == 3
+        assert cached["today"]["total_events"] == 2
+        assert cached["7d"]["total_events"] == 3
+        for range, summary in cached.items():
+            total, asr_stats, tts_stats = module.query_summary(module.range_cutoff(range, datetime.utcnow()))
+            assert summary == {"range": range, "group_by": None, "groups": None, **module.summary_fields(total, asr_stats, tts_stats)}
+
+    def test_unknown_ranges_are_not_cached(self, metrics_client):
+        """The range is the cache key, so only the four known ranges should be accepted"""
+        for i in range(20):
+            assert metrics_client.get(f"/api/metrics/summary?range=junk{i}").status_code == 422
+        metrics_client.get("/api/metrics/summary?range=30d")
+        assert list(metrics_client.module._summary_cache.entries) == ["30d"]
+
+    def test_clear_history_invalidates(self, metrics_client):
+        """Clearing history should drop cached summaries"""
+        metrics_client.post("/api/metrics/event", json=make_event())
+        assert metrics_client.get("/api/metrics/summary?range=all").json()["total_events"] == 1
+        metrics_client.delete("/api/metrics/history")
+        assert metrics_client.get("/api/metrics/summary?range=all").json()["total_events"] == 0
+
+    def test_read_racing_a_write_is_not_cached(self, load_metrics_app):
+        """A summary read before a write landed should not be cached after it"""
+        cache = load_metrics_app().SummaryCache()
+        version = cache.version
+        cache.add([])
+        cache.put("all", "1970-01-01T00:00:00", version, (0, {}, {}))
+        assert cache.get("all", "1970-01-01T00:00:00") is None
+
+    def test_sliding_ranges_start_on_a_minute(self, load_metrics_app):
+        """7d and 30d cutoffs should not move within a minute"""
+        module = load_metrics_app()
+        now = datetime(2024, 5, 8, 10, 30, 45, 123456)
+        assert module.range_cutoff("7d", now) == "2024-05-01T10:30:00"
+        assert module.range_cutoff("today", now) == "2024-05-08T00:00:00"
+
+    @pytest.mark.parametrize("url", ["/api/metrics/summary?range=7d", "/api/metrics/history?limit=10"])
+    def test_unchanged_responses_are_not_modified(self, metrics_client, url):
+        """Responses should carry validators, and answer 304 until events change"""
+        metrics_client.post("/api/metrics/event", json=make_event())
+        first = metrics_client.get(url)
+        etag, last_modified = first.headers["etag"], first.headers["last-modified"]
+        assert first.headers["cache-control"] == "no-cache"
+
+        again = metrics_client.get(url, headers={"If-None-Match": etag})
+        assert again.status_code == 304
+        assert again.headers["etag"] == etag
+        assert metrics_client.get(url, headers={"If-Modified-Since": last_modified}).status_code == 304
+
+        time.sleep(1)  # Last-Modified has whole-second resolution
+        metrics_client.post("/api/metrics/event", json=make_event())
+        changed = metrics_client.get(url, headers={"If-None-Match": etag})
+        assert changed.status_code == 200
+        assert changed.headers["etag"] != etag
+        assert metrics_client.get(url, headers={"If-Modified-Since": last_modified}).status_code == 200
+
+
+class TestMetadataDimensions:
+    """Summaries and series should group by promoted metadata keys"""
+
+    def insert_voices(self, client):
+        events = [
+            make_event(event_type="tts_synthesize", duration_seconds=1.0, metadata={"voice": "amy"}),
+            make_event(event_type="tts_synthesize", duration_seconds=3.0, metadata={"voice": "amy"}),
+            make_event(event_type="tts_synthesize", status="error", metadata={"voice": "bob", "model": "piper"}),
+            make_event(event_type="asr_transcribe", metadata={"model": "whisper"}),
+            make_event(event_type="tts_synthesize"),
+        ]
+        assert client.post("/api/metrics/events", json=events).status_code == 200
+
+    def test_summary_groups(self, metrics_client):
+        """Groups should total each value, and leave out events without the key"""
+        self.insert_voices(metrics_client)
+        data = metrics_client.get("/api/metrics/summary?range=today&group_by=voice").json()
+
+        assert data["total_events"] == 5
+        assert data["group_by"] == "voice"
+        groups = {(g["group"], g["event_type"]): g for g in data["groups"]}
+        assert set(groups) == {("amy", "tts_synthesize"), ("bob", "tts_synthesize")}
+        assert groups["amy", "tts_synthesize"]["count"] == 2
+        assert groups["amy", "tts_synthesize"]["duration_seconds"] == pytest.approx(4.0)
+        assert groups["amy", "tts_synthesize"]["errors"] == 0
+        assert groups["bob", "tts_synthesize"]["errors"] == 1
+
+    def test_timeseries_groups(self, metrics_client):
+        """Series should have a point per bucket, value and event type"""
+        self.insert_voices(metrics_client)
+        data = metrics_client.get("/api/metrics/timeseries?range=today&group_by=model").json()
+
+        points = {(p["group"], p["event_type"]): p for p in data["series"]}
+        assert set(points) == {("piper", "tts_synthesize"), ("whisper", "asr_transcribe")}
+        assert all(p["bucket"].endswith(":00:00") and p["bucket"] >= data["start"] for p in data["series"])
+        assert points["whisper", "asr_transcribe"]["p50"] == pytest.approx(1.5, rel=0.01)
+        assert {t["group"] for t in data["totals"]} == {"piper", "whisper"}
+
+    def test_rejects_unknown_dimension(self, metrics_client):
+        """Only promoted keys can be grouped by"""
+        assert metrics_client.get("/api/metrics/summary?group_by=speed").status_code == 422
+        assert metrics_client.get("/api/metrics/timeseries?group_by=speed").status_code == 422
+
+    def test_migration_backfills_from_metadata(self, load_metrics_app, monkeypatch):
+        """Events stored before v9 should be grouped by their existing metadata"""
+        module = load_metrics_app()
+        monkeypatch.setattr(module, "MIGRATIONS", module.MIGRATIONS[:-1])
+        module.init_db()
+        with module.get_db() as conn:
+            for metadata in ({"voice": "amy", "language": "en"}, None):
+                event_id = conn.execute(
+                    "INSERT INTO events (timestamp, event_type) VALUES ('2024-05-01T10:00:00', 'tts_synthesize')"
+                ).lastrowid
+                conn.execute("INSERT INTO event_payloads (event_id, metadata) VALUES (?, ?)",
+                             (event_id, module.payload.compress(json.dumps(metadata)) if metadata else None))
+            conn.commit()
+
+            monkeypatch.undo()
+            assert module.migrate(conn) == [len(module.MIGRATIONS)]
+            rows = [tuple(row) for row in conn.execute("SELECT voice, language, model FROM events ORDER BY id")]
+        assert rows == [("amy", "en", None), (None, None, None)]
+
+    def test_grouping_uses_covering_index(self, metrics_client):
+        """Grouped queries should read only the dimension's partial index"""
+        module = metrics_client.module
+        epoch = module.EPOCH_MS_SQL.format("?")
+        with module.get_db() as conn:
+            plan = query_plan(conn, f"""
+                SELECT voice, event_type, COUNT(*), SUM(status != 'success'), SUM(duration_seconds)
+                FROM events WHERE voice IS NOT NULL AND epoch_ms >= {epoch} GROUP BY 1, 2
+            """, ("2024-05-01T10:00:00",))
+        assert "USING COVERING INDEX idx_events_voice" in plan
+
+
+class TestImport:
+    """Exports should load back in, each event once however often it is imported"""
+
+    @pytest.fixture
+    def client(self, load_metrics_app):
+        from fastapi.testclient import TestClient
+
+        module = load_metrics_app(METRICS_STORE_TEXT="true", METRICS_IMPORT_CHUNK="4")
+        with TestClient(module.app) as client:
+            client.module = module
+            events = [make_event(event_type="asr_record" if i % 2 else "tts_synthesize",
+                                 duration_seconds=float(i), text_content=f"note number {i}",
+                                 metadata={"voice": "amy"} if i % 3 == 0 else None,
+                                 uuid=str(uuid.uuid4()) if i % 2 else None,
+                                 timestamp=(datetime.utcnow() - timedelta(hours=i)).isoformat())
+                      for i in range(10)]
+            assert client.post("/api/metrics/events", json=events).status_code == 200
+            yield client
+
+    def snapshot(self, client):
+        history = client.get("/api/metrics/history?limit=100").json()["events"]
+        summary = client.get("/api/metrics/summary?range=all&group_by=voice").json()
+        # Ids are per database, and events stored without a uuid get one on import
+        return [{k: v for k, v in e.items() if k not in ("id", "uuid")} for e in history], summary
+
+    def test_restore_from_export(self, client):
+        """Importing an export into an empty database should restore everything"""
+        before = self.snapshot(client)
+        export = client.get("/api/metrics/export").content
+        uuids = {e["uuid"] for e in json.loads(export)["events"]} - {None}
+        client.delete("/api/metrics/history")
+
+        result = client.post("/api/metrics/import", content=export).json()
+        assert (result["count"], result["imported"], result["duplicates"]) == (10, 10, 0)
+        assert result["rows_per_second"] > 0
+        assert self.snapshot(client) == before
+        assert len(client.get("/api/metrics/search?q=number").json()["results"]) == 10
+
+        restored = json.loads(client.get("/api/metrics/export").content)["events"]
+        assert len(uuids) == 5 and uuids < {e["uuid"] for e in restored}
+        assert all(e["uuid"] for e in restored)
+
+    def test_reimport_stores_nothing(self, client):
+        """Events already stored, with or without a uuid, should be skipped"""
+        before = self.snapshot(client)
+        export = client.get("/api/metrics/export?format=ndjson").content
+
+        result = client.post("/api/metrics/import?format=ndjson", content=export).json()
+        assert (result["imported"], result["duplicates"]) == (0, 10)
+        assert self.snapshot(client) == before
+
+    def test_rollups_match_a_rebuild(self, client):
+        """Imported events should be rolled up as if rebuilt from scratch"""
+        module = client.module
+        export = client.get("/api/metrics/export").content
+        client.delete("/api/metrics/history")
+        client.post("/api/metrics/import", content=export)
+
+        def rollups():
+            with module.get_db() as conn:
+                return [tuple(row) for row in conn.execute("SELECT * FROM rollup_hourly ORDER BY 1, 2")]
+
+        imported = rollups()
+        module.rebuild_rollups()
+        assert imported == rollups()
+
+    @pytest.mark.parametrize("format", ["json", "ndjson"])
+    def test_reader_handles_any_split(self, client, format):
+        """Gzipped bodies should parse the same however the stream is split"""
+        module = client.module
+        body = gzip.compress(client.get(f"/api/metrics/export?format={format}").content)
+        expected = module.ImportReader(format)
+        events = expected.feed(body) + expected.close()
+
+        reader = module.ImportReader(format)
+        split = []
+        for i in range(0, len(body), 7):
+            split += reader.feed(body[i:i + 7])
+        assert split + reader.close() == events
+        assert len(events) == 10
+
+    def test_invalid_event_stops_the_import(self, client):
+        """A bad event should be reported, keeping the chunks before it"""
+        client.delete("/api/metrics/history")
+        events = [make_event(timestamp=f"2024-05-01T10:00:{i:02d}") for i in range(6)]
+        events.append({"event_type": "asr_record", "duration_seconds": "long"})
+        response = client.post("/api/metrics/import", json=events)
+
+        assert response.status_code == 422
+        assert "Event 7: duration_seconds" in response.json()["detail"]
+        assert client.get("/api/metrics/history").json()["total"] == 4
+        assert client.post("/api/metrics/import", content=b'{"events": [{').status_code == 422
+
+    def test_import_file(self, client, tmp_path):
+        """The command-line import should read a file straight into the database"""
+        path = tmp_path / "export.ndjson"
+        path.write_bytes(client.get("/api/metrics/export?format=ndjson").content)
+        client.delete("/api/metrics/history")
+
+        result = client.module.import_file(str(path), "ndjson")
+        assert (result.count, result.imported) == (10, 10)
+        assert client.get("/api/metrics/history").json()["total"] == 10
+
+
+class TestMemoryStorage:
+    """With METRICS_STORAGE=memory, nothing should touch the disk but snapshots"""
+
+    def load(self, load_metrics_app, **env):
+        return load_metrics_app(METRICS_STORAGE="memory", METRICS_STORE_TEXT="true",
+                                METRICS_SNAPSHOT_INTERVAL=3600, **env)
+
+    def stored(self, path):
+        import sqlite3
+
+        conn = sqlite3.connect(path)
+        try:
+            return conn.execute("SELECT COUNT(*) FROM events").fetchone()[0]
+        finally:
+            conn.close()
+
+    def test_endpoints_work_in_memory(self, load_metrics_app, tmp_path):
+        """Every read should see stored events, with no database file written"""
+        from fastapi.testclient import TestClient
+
+        module = self.load(load_metrics_app)
+        with TestClient(module.app) as client:
+            events = [make_event(text_content=f"memo {i}", metadata={"voice": "amy"}) for i in range(12)]
+            assert client.post("/api/metrics/events", json=events).status_code == 200
+
+            assert client.get("/api/metrics/summary?range=all").json()["total_events"] == 12
+            groups = client.get("/api/metrics/summary?range=all&group_by=voice").json()["groups"]
+            assert [(g["group"], g["count"]) for g in groups] == [("amy", 12)]
+            assert sum(t["count"] for t in client.get("/api/metrics/timeseries?range=all").json()["totals"]) == 12
+            assert len(client.get("/api/metrics/history?limit=100").json()["events"]) == 12
+            assert len(client.get("/api/metrics/search?q=memo&limit=100").json()["results"]) == 12
+            assert len(json.loads(client.get("/api/metrics/export").content)["events"]) == 12
+
+            health = client.get("/health").json()
+            assert health["storage"] == "memory"
+            assert health["snapshots"]["snapshots"] == 0
+            assert list(tmp_path.iterdir()) == []
+
+    def test_snapshots_are_atomic_and_skip_unchanged_data(self, load_metrics_app, tmp_path):
+        """A snapshot should replace the file whole, and only when something was committed"""
+        from fastapi.testclient import TestClient
+
+        module = self.load(load_metrics_app)
+        with TestClient(module.app) as client:
+            client.post("/api/metrics/events", json=[make_event() for _ in range(5)])
+            assert module.write_snapshot() > 0
+            assert self.stored(module.METRICS_DB_PATH) == 5
+            assert module.write_snapshot() is None
+
+            client.post("/api/metrics/event", json=make_event())
+            assert module.write_snapshot() > 0
+            assert self.stored(module.METRICS_DB_PATH) == 6
+            assert sorted(path.name for path in tmp_path.iterdir()) == ["metrics.sqlite"]
+
+    def test_restart_restores_last_snapshot(self, load_metrics_app):
+        """Shutdown should take a final snapshot, and startup load it back"""
+        from fastapi.testclient import TestClient
+
+        module = self.load(load_metrics_app)
+        with TestClient(module.app) as client:
+            client.post("/api/metrics/events", json=[make_event(text_content="kept") for _ in range(7)])
+        assert self.stored(module.METRICS_DB_PATH) == 7
+
+        module = self.load(load_metrics_app)
+        with TestClient(module.app) as client:
+            assert client.get("/api/metrics/summary?range=all").json()["total_events"] == 7
+            assert len(client.get("/api/metrics/search?q=kept&limit=100").json()["results"]) == 7
+            client.post("/api/metrics/event", json=make_event())
+        assert self.stored(module.METRICS_DB_PATH) == 8
+
+    def test_switching_from_sqlite_storage(self, load_metrics_app):
+        """A database written with METRICS_STORAGE=sqlite (in WAL mode) should load too"""
+        from fastapi.testclient import TestClient
+
+        module = load_metrics_app()
+        with TestClient(module.app) as client:
+            client.post("/api/metrics/events", json=[make_event() for _ in range(4)])
+
+        module = self.load(load_metrics_app)
+        with TestClient(module.app) as client:
+            assert client.get("/api/metrics/summary?range=all").json()["total_events"] == 4
+            client.post("/api/metrics/event", json=make_event())
+        with open(module.METRICS_DB_PATH, "rb") as f:
+            assert f.read(20)[18:20] == bytes([1, 1])  # Rollback journal, not WAL
+        assert self.stored(module.METRICS_DB_PATH) == 5
+
+    def test_max_events_bounds_memory(self, load_metrics_app):
+        """METRICS_MAX_EVENTS should evict the oldest events, ring-buffer style"""
+        from fastapi.testclient import TestClient
+
+        module = self.load(load_metrics_app, METRICS_MAX_EVENTS=10, METRICS_CLEANUP_INTERVAL=3600)
+        with TestClient(module.app) as client:
+            # Past timestamps: future ones are clamped to now, and could tie
+            count = module.retention_threshold() + 1
+            now = datetime.utcnow()
+            for i in range(count):
+                client.post("/api/metrics/event", json=make_event(
+                    duration_seconds=float(i), timestamp=(now - timedelta(seconds=count - i)).isoformat()))
+            assert wait_until(lambda: module.count_events() == 10)
+            newest = client.get("/api/metrics/history?limit=100").json()["events"]
+            assert min(e["duration_seconds"] for e in newest) == module.retention_threshold() - 9
+
+    def test_offline_writes_are_refused(self, tmp_path):
+        """CLI commands should not write a snapshot a running service would overwrite"""
+        import os
+        import subprocess
+        import sys
+
+        from tests.conftest import METRICS_DIR
+
+        env = {**os.environ, "METRICS_STORAGE": "memory", "METRICS_DB_PATH": str(tmp_path / "metrics.sqlite")}
+        for command, advice in ((["import", str(tmp_path / "export.json")], "POST /api/metrics/import"),
+                                 (["backfill-rollups"], "METRICS_STORAGE=sqlite")):
+            result = subprocess.run([sys.executable, str(METRICS_DIR / "app.py"), *command],
+                                    env=env, capture_output=True, text=True, timeout=60)
+            assert result.returncode == 2
+            assert advice in result.stderr
+        assert list(tmp_path.iterdir()) == []
+
+    def test_partitioning_is_rejected(self, load_metrics_app):
+        """Partitions are files, so they should not combine with memory storage"""
+        module = self.load(load_metrics_app, METRICS_PARTITION="week")
+        with pytest.raises(RuntimeError, match="METRICS_STORAGE=sqlite"):
+            module.init_db()
+
+
+class TestStorageMaintenance:
+    """Freed pages should go back to the filesystem, and the planner get statistics"""
+
+    @pytest.fixture
+    def client(self, load_metrics_app):
+        from fastapi.testclient import TestClient
+
+        module = load_metrics_app(METRICS_STORE_TEXT="true", METRICS_MAINTENANCE_IDLE=0)
+        with TestClient(module.app) as client:
+            client.module = module
+            yield client
+
+    def fill(self, client, count=400):
+        now = datetime.utcnow()
+        # Random text, so compression leaves the payloads a few pages' worth
+        events = [make_event(event_type=random.choice(["asr_transcribe", "tts_play", "asr_record"]),
+                             text_content=random.randbytes(1500).hex(),
+                             timestamp=(now - timedelta(minutes=i)).isoformat())
+                  for i in range(count)]
+        for start in range(0, count, 100):
+            assert client.post("/api/metrics/events", json=events[start:start + 100]).status_code == 200
+
+    def test_databases_use_incremental_vacuum(self, client):
+        """New files should be created with incremental auto-vacuum"""
+        storage = client.get("/api/metrics/storage").json()
+        assert [db["auto_vacuum"] for db in storage["databases"]] == ["incremental"]
+        assert storage["databases"][0]["name"] == "metrics.sqlite"
+        assert storage["page_count"] == storage["databases"][0]["page_count"] > 0
+
+    def test_opening_a_connection_writes_nothing(self, client, tmp_path):
+        """New pooled connections (readers included) should not start a write"""
+        module = client.module
+        with module.get_db() as conn:
+            assert conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()[0] == 0
+        module._pool._connect().close()
+        assert (tmp_path / "metrics.sqlite-wal").stat().st_size == 0
+
+    def test_existing_files_are_converted(self, load_metrics_app, tmp_path):
+        """A database from before should be rebuilt once, keeping its events"""
+        import sqlite3
+        from fastapi.testclient import TestClient
+
+        module = load_metrics_app()
+        with TestClient(module.app) as client:
+            client.post("/api/metrics/events", json=[make_event() for _ in range(5)])
+        conn = sqlite3.connect(tmp_path / "metrics.sqlite")
+        conn.execute("PRAGMA auto_vacuum=NONE")
+        conn.execute("VACUUM")
+        assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 0
+        conn.close()
+
+        module = load_metrics_app()
+        with TestClient(module.app) as client:
+            assert client.get("/api/metrics/storage").json()["databases"][0]["auto_vacuum"] == "incremental"
+            assert client.get("/api/metrics/summary?range=all").json()["total_events"] == 5
+
+    def test_cleared_history_is_vacuumed(self, client, tmp_path):
+        """Clearing history should wake maintenance, which shrinks the file"""
+        self.fill(client)
+        full = client.get("/api/metrics/storage").json()
+        assert client.delete("/api/metrics/history").status_code == 200
+
+        assert wait_until(lambda: client.get("/api/metrics/storage").json()["maintenance"]["runs"] >= 1)
+        storage = client.get("/api/metrics/storage").json()
+        assert storage["free_pages"] == 0
+        assert storage["page_count"] < full["page_count"] // 2
+        assert storage["maintenance"]["last_freed_pages"] > 0
+        assert storage["databases"][0]["analyzed"]
+        assert storage["wal_bytes"] == 0
+        assert (tmp_path / "metrics.sqlite").stat().st_size == storage["database_bytes"]
+        assert client.get("/health").json()["maintenance"]["runs"] >= 1
+
+    def test_vacuum_waits_for_idle(self, client, monkeypatch):
+        """While events keep arriving, maintenance should leave free pages alone"""
+        module = client.module
+        monkeypatch.setattr(module, "METRICS_MAINTENANCE_IDLE", 3600)
+        self.fill(client, 100)
+        client.delete("/api/metrics/history?clear_text_only=true")
+        free_pages = client.get("/api/metrics/storage").json()["free_pages"]
+        assert free_pages > 0
+
+        asyncio.run(module.run_maintenance())
+        storage = client.get("/api/metrics/storage").json()
+        assert storage["maintenance"]["last_freed_pages"] == 0
+        assert storage["free_pages"] > free_pages // 2  # ANALYZE may reuse a few
+
+    def test_statistics_reach_every_pooled_connection(self, client):
+        """After ANALYZE, connections opened before it should plan with the new statistics"""
+        module = client.module
+        events = list(bench_metrics.synthetic_events(500))
+        assert client.post("/api/metrics/events", json=events).status_code == 200
+        # With statistics, few event types make skipping through them cheaper than sorting
+        sql = """
+            SELECT event_type, COUNT(*), SUM(duration_seconds) FROM events
+            WHERE epoch_ms >= 0 AND epoch_ms < 3600000 GROUP BY event_type
+        """
+        with module.get_db() as first, module.get_db() as second:
+            assert all("idx_events_summary" in query_plan(conn, sql) for conn in (first, second))
+
+        module.analyze_database(module._main)
+        with module.get_db() as first, module.get_db() as second:
+            assert all("idx_events_type_epoch" in query_plan(conn, sql) for conn in (first, second))
+
+
+class TestBenchmarkHarness:
+    """tests/bench_metrics.py should run, and read endpoints keep their recorded query plans"""
+
+    def test_query_plans_match_snapshot(self, load_metrics_app):
+        """A plan change (say, a lost covering index) should fail until it is re-recorded"""
+        module = load_metrics_app(**bench_metrics.APP_ENV)
+        log = bench_metrics.trace_statements(module)
+        bench_metrics.seed(module, 500)
+        results = asyncio.run(bench_metrics.run(module, log, clients=2, ingest=20, batch_size=10, requests=4))
+
+        diff = bench_metrics.plan_diff(bench_metrics.load_plans(), results["plans"])
+        assert not diff, f"Query plans changed (if intended, run tests/bench_metrics.py --update-plans):\n{diff}"
+        assert set(results["reads"]) == {name for name, _, _ in bench_metrics.READ_SCENARIOS}
+        assert all(result["p99_ms"] >= result["p50_ms"] > 0 for result in results["reads"].values())
+        assert results["ingest"]["single"]["events"] == 20
@@ -0,0 +1,162 @@
+"""
+Tests for the sampling profiler debug endpoints
+
+These are unit tests that don't require running services; the TTS and
+metrics apps are exercised in-process.
+"""
+
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+TTS_DIR = Path(__file__).resolve().parent.parent / 'tts'
+sys.path.insert(0, str(TTS_DIR))
+os.environ.setdefault('PIPER_RELOAD_INTERVAL', '0')
+
+import profiler  # noqa: E402
+
+
+def busy_loop_for_profiler(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def wait_for_profile(get):
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        response = get()
+        if response.status_code != 202:
+            return response
+        time.sleep(0.05)
+    pytest.fail("Profile did not finish")
+
+
+class TestSampler:
+    """Test stack sampling and collapsed output"""
+
+    def test_cpu_sample_finds_busy_function(self):
+        """A busy thread's function should appear in the collapsed stacks"""
+        stop = threading.Event()
+        worker = threading.Thread(target=busy_loop_for_profiler, args=(stop,), name='busy')
+        worker.start()
+        try:
+            stacks, samples = profiler.sample_cpu(0.2, interval=0.005)
+        finally:
+            stop.set()
+            worker.join()
+
+        assert samples > 0
+        body = profiler.collapse(stacks)
+        busy_lines = [line for line in body.splitlines() if 'busy_loop_for_profiler' in line]
+        assert busy_lines
+        assert busy_lines[0].startswith('busy;')
+        assert busy_lines[0].rsplit(' ', 1)[1].isdigit()
+
+    def test_memory_sample_weights_by_bytes(self):
+        """Allocations during the capture should be reported in bytes"""
+        keep = []
+
+        def allocate():
+            time.sleep(0.05)
+            keep.append(bytearray(1024 * 1024))
+
+        allocator = threading.Thread(target=allocate)
+        allocator.start()
+        stacks, _ = profiler.sample_memory(0.2)
+        allocator.join()
+
+        assert max(stacks.values()) >= 1024 * 1024
+
+    def test_only_one_capture_at_a_time(self):
+        """Starting a second capture while one runs should be refused"""
+        p = profiler.Profiler()
+        assert p.start(0.2) is True
+        assert p.start(0.2) is False
+        assert p.status()[0] == 'running'
+
+    def test_interval_is_clamped(self):
+        """A huge or infinite interval should not keep a capture running past its duration"""
+        for interval in (1e6, float('inf')):
+            p = profiler.Profiler()
+            assert p.start(0.2, interval=interval) is True
+            deadline = time.monotonic() + 5
+            while p.status()[0] == 'running' and time.monotonic() < deadline:
+                time.sleep(0.05)
+            state, info = p.status()
+            assert state != 'running'
+            assert info['samples'] > 0
+
+    def test_rejects_unknown_mode(self):
+        """Unknown modes should raise ValueError"""
+        with pytest.raises(ValueError):
+            profiler.Profiler().start(1, mode='gpu')
+
+
+class TestTTSProfileEndpoint:
+    """Test the TTS /debug/profile endpoint"""
+
+    @pytest.fixture
+    def client(self, monkeypatch):
+        import app as tts_app
+        monkeypatch.setattr(tts_app, '_profiler', profiler.Profiler())
+        monkeypatch.setattr(tts_app, 'PROFILER_TOKEN', 'secret')
+        return tts_app.app.test_client(), tts_app
+
+    def test_disabled_without_token(self, client, monkeypatch):
+        """The profiler should not exist unless PROFILER_TOKEN is set"""
+        test_client, tts_app = client
+        monkeypatch.setattr(tts_app, 'PROFILER_TOKEN', '')
+        assert test_client.post('/debug/profile').status_code == 404
+
+    def test_requires_token(self, client):
+        """The profiler should require the bearer token"""
+        test_client, _ = client
+        response = test_client.post('/debug/profile', headers={'Authorization': 'Bearer wrong'})
+        assert response.status_code == 401
+        response = test_client.post('/debug/profile', headers={'Authorization': 'Bearer café'})
+        assert response.status_code == 401
+
+    def test_capture_returns_collapsed_stacks(self, client):
+        """A capture should return flamegraph-compatible collapsed stacks"""
+        test_client, _ = client
+        auth = {'Authorization': 'Bearer secret'}
+        assert test_client.post('/debug/profile?seconds=0.2', headers=auth).status_code == 202
+
+        response = wait_for_profile(lambda: test_client.get('/debug/profile', headers=auth))
+        assert response.status_code == 200
+        assert response.mimetype == 'text/plain'
+        assert 'tts-cpu.folded' in response.headers['Content-Disposition']
+        assert int(response.headers['X-Profile-Samples']) > 0
+
+
+class TestMetricsProfileEndpoint:
+    """Test the yap-metrics /debug/profile endpoint"""
+
+    def test_disabled_without_token(self, metrics_client):
+        """The profiler should not exist unless PROFILER_TOKEN is set"""
+        assert metrics_client.post('/debug/profile').status_code == 404
+
+    def test_capture_returns_collapsed_stacks(self, load_metrics_app):
+        """A memory capture should return collapsed stacks"""
+        from fastapi.testclient import TestClient
+
+        module = load_metrics_app(PROFILER_TOKEN='secret')
+        auth = {'Authorization': 'Bearer secret'}
+        with TestClient(module.app) as client:
+            assert client.post('/debug/profile?seconds=0.2').status_code == 401
+            non_ascii = {'Authorization': 'Bearer café'.encode()}
+            assert client.post('/debug/profile?seconds=0.2', headers=non_ascii).status_code == 401
+            assert client.post('/debug/profile?seconds=0.2&mode=bogus', headers=auth).status_code == 422
+
+            response = client.post('/debug/profile?seconds=0.2&mode=memory', headers=auth)
+            assert response.status_code == 202
+            client.get('/health')
+
+            response = wait_for_profile(lambda: client.get('/debug/profile', headers=auth))
+            assert response.status_code == 200
+            assert response.headers['content-type'].startswith('text/plain')
+            assert 'yap-metrics-memory.folded' in response.headers['content-disposition']
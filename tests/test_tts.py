@@ -45,6 +45,18 @@ class TestTTSVoices:
         data = response.json()
         assert isinstance(data, list)
 
+    def test_voices_details_returns_performance(self):
+        """Voices endpoint with details should return measured performance"""
+        response = requests.get(f'{TTS_BASE_URL}/voices?details=true')
+        assert response.status_code == 200
+        data = response.json()
+        assert isinstance(data, list)
+        for voice in data:
+            assert 'name' in voice
+            assert 'load_seconds' in voice
+            assert 'chars_per_second' in voice
+            assert 'rtf' in voice
+
 
 class TestTTSSynthesis:
     """Test TTS synthesis endpoint"""
@@ -0,0 +1,174 @@
+"""
+Tests for the offline TTS batch renderer (tts/batch.py)
+
+These are unit tests that don't require running services or Piper models;
+voice loading is replaced with a fake voice that emits silence.
+"""
+
+import os
+import sys
+import wave
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'tts'))
+
+import batch  # noqa: E402
+
+
+class FakeConfig:
+    sample_rate = 16000
+
+
+class FakeVoice:
+    """Emits 10ms of silence per input character"""
+    config = FakeConfig()
+
+    def synthesize_stream_raw(self, text, length_scale=1.0):
+        yield b'\x00\x00' * 160 * len(text)
+
+
+def fake_load_voice(voice_name, threads=None):
+    return FakeVoice() if voice_name == 'fake' else None
+
+
+class TestChunking:
+    """Test text chunking for batch synthesis"""
+
+    def test_paragraphs_become_chunks(self):
+        """Blank-line separated paragraphs should become separate chunks"""
+        chunks = batch.chunk_text("First paragraph.\nStill first.\n\nSecond paragraph.")
+        assert chunks == ["First paragraph. Still first.", "Second paragraph."]
+
+    def test_long_paragraph_split_on_sentences(self):
+        """Long paragraphs should be split at sentence boundaries"""
+        text = "One two three. Four five six. Seven eight nine."
+        chunks = batch.chunk_text(text, max_chars=30)
+        assert chunks == ["One two three. Four five six.", "Seven eight nine."]
+        assert all(len(chunk) <= 30 for chunk in chunks)
+
+    def test_long_sentence_split_on_words(self):
+        """A single sentence longer than the limit should be split on spaces"""
+        text = " ".join(["word"] * 50)
+        chunks = batch.chunk_text(text, max_chars=42)
+        assert all(len(chunk) <= 42 for chunk in chunks)
+        assert " ".join(chunks) == text
+
+    def test_empty_text_returns_no_chunks(self):
+        """Whitespace-only text should produce no chunks"""
+        assert batch.chunk_text("  \n\n  \n") == []
+
+    def test_markdown_syntax_removed(self):
+        """Markdown headings, links and emphasis should not be read aloud"""
+        text = "# Title\n\nSee [the docs](https://example.com) for **more**.\n\n- item"
+        assert batch.chunk_text(batch.strip_markdown(text)) == [
+            "Title", "See the docs for more.", "item"
+        ]
+
+
+class TestArguments:
+    """Test command line validation"""
+
+    @pytest.mark.parametrize('option', ['--max-chunk-chars', '--workers'])
+    @pytest.mark.parametrize('value', ['0', '-1'])
+    def test_values_below_one_are_rejected(self, tmp_path, capsys, option, value):
+        """Chunk sizes or worker counts below 1 should be refused up front"""
+        with pytest.raises(SystemExit) as exc:
+            batch.main([str(tmp_path), str(tmp_path / 'out'), '--voice', 'fake', option, value])
+        assert exc.value.code == 2
+        assert f'{option} must be at least 1' in capsys.readouterr().err
+
+
+class TestBatchRun:
+    """Test rendering a directory with a fake voice"""
+
+    @pytest.fixture
+    def docs(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(batch, 'load_voice', fake_load_voice)
+        input_dir = tmp_path / 'in'
+        (input_dir / 'sub').mkdir(parents=True)
+        (input_dir / 'a.txt').write_text("Hello there.\n\nSecond paragraph.")
+        (input_dir / 'sub' / 'b.md').write_text("# Heading\n\nBody text.")
+        (input_dir / 'ignored.pdf').write_text("not a document")
+        return input_dir, tmp_path / 'out'
+
+    def test_renders_all_documents(self, docs):
+        """Every .txt/.md file should produce one audio file in the mirrored tree"""
+        input_dir, output_dir = docs
+        stats = batch.run_batch(input_dir, output_dir, 'fake', workers=2, audio_format='wav')
+
+        assert stats['files_rendered'] == 2
+        assert stats['files_failed'] == 0
+        assert (output_dir / 'a.wav').exists()
+        assert (output_dir / 'sub' / 'b.wav').exists()
+
+        with wave.open(str(output_dir / 'a.wav'), 'rb') as wav_file:
+            expected_chars = len("Hello there.") + len("Second paragraph.")
+            assert wav_file.getnframes() == 160 * expected_chars
+        assert stats['audio_seconds'] == pytest.approx(stats['chars'] * 0.01)
+
+    def test_second_run_skips_finished_files(self, docs):
+        """Files already rendered should be skipped on re-run"""
+        input_dir, output_dir = docs
+        batch.run_batch(input_dir, output_dir, 'fake', workers=1, audio_format='wav')
+        stats = batch.run_batch(input_dir, output_dir, 'fake', workers=1, audio_format='wav')
+
+        assert stats['files_rendered'] == 0
+        assert stats['files_skipped'] == 2
+
+    def test_modified_source_is_rendered_again(self, docs):
+        """A source newer than its output should be re-rendered"""
+        input_dir, output_dir = docs
+        batch.run_batch(input_dir, output_dir, 'fake', workers=1, audio_format='wav')
+        output = output_dir / 'a.wav'
+        os.utime(output, (0, 0))
+
+        stats = batch.run_batch(input_dir, output_dir, 'fake', workers=1, audio_format='wav')
+        assert stats['files_rendered'] == 1
+        assert stats['files_skipped'] == 1
+
+    def test_missing_voice_marks_files_failed(self, docs):
+        """Synthesis errors should fail the file without writing partial output"""
+        input_dir, output_dir = docs
+        stats = batch.run_batch(input_dir, output_dir, 'missing', workers=1, audio_format='wav')
+
+        assert stats['files_failed'] == 2
+        assert not (output_dir / 'a.wav').exists()
+
+    def test_write_error_fails_only_that_file(self, docs, monkeypatch):
+        """A failed write should count the file as failed and let the batch continue"""
+        input_dir, output_dir = docs
+        write_audio = batch.write_audio
+
+        def flaky_write_audio(path, pcm, sample_rate, audio_format):
+            if path.name == 'b.wav':
+                raise OSError(28, 'No space left on device')
+            write_audio(path, pcm, sample_rate, audio_format)
+
+        monkeypatch.setattr(batch, 'write_audio', flaky_write_audio)
+        stats = batch.run_batch(input_dir, output_dir, 'fake', workers=1, audio_format='wav')
+
+        assert stats['files_rendered'] == 1
+        assert stats['files_failed'] == 1
+        assert (output_dir / 'a.wav').exists()
+        assert not (output_dir / 'sub' / 'b.wav').exists()
+
+    def test_write_error_removes_partial_output(self, tmp_path, monkeypatch):
+        """write_audio should not leave a .part file behind when it fails"""
+        def full_disk(src, dst):
+            raise OSError(28, 'No space left on device')
+
+        monkeypatch.setattr(batch.os, 'replace', full_disk)
+        output = tmp_path / 'a.wav'
+        with pytest.raises(OSError):
+            batch.write_audio(output, b'\x00\x00' * 160, 16000, 'wav')
+        assert list(tmp_path.iterdir()) == []
+
+    def test_report_includes_rtf_and_throughput(self, docs):
+        """The final report should include RTF and throughput"""
+        input_dir, output_dir = docs
+        stats = batch.run_batch(input_dir, output_dir, 'fake', workers=1, audio_format='wav')
+        report = batch.format_report(stats)
+        assert 'RTF' in report
+        assert 'chars/s' in report
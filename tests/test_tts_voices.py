@@ -0,0 +1,297 @@
+"""
+Tests for TTS voice hot-reload (tts/voices.py VoiceRegistry) and the
+per-voice performance catalog (tts/voice_stats.py)
+
+These are unit tests that don't require running services or Piper models;
+voices are loaded with a fake loader from a temporary models directory.
+"""
+
+import os
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+TTS_DIR = Path(__file__).resolve().parent.parent / 'tts'
+sys.path.insert(0, str(TTS_DIR))
+os.environ.setdefault('PIPER_RELOAD_INTERVAL', '0')
+
+import voices  # noqa: E402
+import voice_stats  # noqa: E402
+
+
+class FakeConfig:
+    sample_rate = 16000
+
+
+class FakeVoice:
+    """Stands in for a PiperVoice; remembers which model bytes it loaded"""
+    config = FakeConfig()
+
+    def __init__(self, model):
+        self.model = model
+
+    def synthesize_stream_raw(self, text, length_scale=1.0):
+        yield b'\x00\x00' * len(text)
+
+
+def fake_loader(voice_name, threads=None):
+    onnx_path, _ = voices.voice_paths(voice_name)
+    return FakeVoice(onnx_path.read_text())
+
+
+def install_voice(models, name, model='v1', mtime=None):
+    (models / f'{name}.onnx').write_text(model)
+    (models / f'{name}.onnx.json').write_text('{}')
+    if mtime is not None:
+        os.utime(models / f'{name}.onnx', (mtime, mtime))
+
+
+@pytest.fixture
+def models(tmp_path, monkeypatch):
+    monkeypatch.setattr(voices, 'MODELS_PATH', tmp_path)
+    return tmp_path
+
+
+class TestVoiceRegistry:
+    """Test loading, swapping and evicting voices"""
+
+    def test_loads_voice_lazily(self, models):
+        """Voices should be loaded on first use and then cached"""
+        install_voice(models, 'amy')
+        registry = voices.VoiceRegistry(loader=fake_loader)
+
+        first = registry.get('amy')
+        assert first.voice.model == 'v1'
+        assert registry.get('amy') is first
+
+    def test_missing_voice_returns_none(self, models):
+        """Unknown voices should return None"""
+        registry = voices.VoiceRegistry(loader=fake_loader)
+        assert registry.get('nobody') is None
+
+    def test_replaced_model_is_swapped_after_it_settles(self, models):
+        """A replaced model should be swapped in once its files stop changing"""
+        install_voice(models, 'amy', 'v1', mtime=1000)
+        registry = voices.VoiceRegistry(loader=fake_loader)
+        registry.scan()
+        old = registry.get('amy')
+
+        install_voice(models, 'amy', 'v2', mtime=2000)
+        changes = registry.scan()
+        assert changes['pending'] == ['amy']
+        assert registry.get('amy') is old
+
+        changes = registry.scan()
+        assert changes['reloaded'] == ['amy']
+        new = registry.get('amy')
+        assert new.voice.model == 'v2'
+        assert new.version != old.version
+        # The old entry is untouched for requests still using it
+        assert old.voice.model == 'v1'
+
+    def test_force_scan_reloads_immediately(self, models):
+        """A forced scan should not wait for the files to settle"""
+        install_voice(models, 'amy', 'v1', mtime=1000)
+        registry = voices.VoiceRegistry(loader=fake_loader)
+        registry.get('amy')
+
+        install_voice(models, 'amy', 'v2', mtime=2000)
+        assert registry.scan(force=True)['reloaded'] == ['amy']
+        assert registry.get('amy').voice.model == 'v2'
+
+    def test_failed_reload_keeps_old_model(self, models):
+        """If the new model fails to load, the old one keeps serving"""
+        install_voice(models, 'amy', 'v1', mtime=1000)
+        registry = voices.VoiceRegistry(loader=fake_loader)
+        old = registry.get('amy')
+
+        def broken_loader(voice_name, threads=None):
+            raise RuntimeError('corrupt model')
+
+        registry._loader = broken_loader
+        install_voice(models, 'amy', 'v2', mtime=2000)
+        assert registry.scan(force=True)['reloaded'] == []
+        assert registry.get('amy') is old
+
+        status = {voice['name']: voice for voice in registry.status()['voices']}
+        assert status['amy']['error'] == 'corrupt model'
+
+    def test_removed_voice_is_evicted(self, models):
+        """Deleting a voice's files should evict it from the cache"""
+        install_voice(models, 'amy')
+        registry = voices.VoiceRegistry(loader=fake_loader)
+        registry.get('amy')
+
+        (models / 'amy.onnx').unlink()
+        assert registry.scan()['removed'] == ['amy']
+        assert registry.get('amy') is None
+
+    def test_status_reports_versions_and_events(self, models):
+        """Status should list voices, versions and reload events"""
+        install_voice(models, 'amy')
+        install_voice(models, 'cori')
+        registry = voices.VoiceRegistry(loader=fake_loader)
+        registry.get('amy')
+
+        status = registry.status()
+        by_name = {voice['name']: voice for voice in status['voices']}
+        assert by_name['amy']['loaded'] is True
+        assert by_name['amy']['version'] == voices.voice_fingerprint('amy')
+        assert by_name['cori']['loaded'] is False
+        assert status['events'][-1]['action'] == 'loaded'
+
+
+def make_client(models, monkeypatch):
+    import app as tts_app
+    stats = voice_stats.VoiceStats(models / 'stats.json')
+    monkeypatch.setattr(tts_app, '_voice_stats', stats)
+    monkeypatch.setattr(tts_app, '_voice_registry',
+                        voices.VoiceRegistry(loader=fake_loader, on_load=stats.record_load))
+    monkeypatch.setattr(tts_app, 'ADMIN_TOKEN', 'secret')
+    return tts_app.app.test_client(), tts_app
+
+
+ADMIN_HEADERS = {'Authorization': 'Bearer secret'}
+
+
+class TestSynthesisCaching:
+    """Test that synthesized audio is keyed to the model version"""
+
+    @pytest.fixture
+    def client(self, models, monkeypatch):
+        return make_client(models, monkeypatch)
+
+    def test_unchanged_model_returns_304(self, models, client):
+        """Revalidating with the same model version should skip synthesis"""
+        install_voice(models, 'amy')
+        test_client, _ = client
+        first = test_client.get('/synthesize/amy?text=hello')
+        assert first.status_code == 200
+        etag = first.headers['ETag']
+
+        second = test_client.get('/synthesize/amy?text=hello', headers={'If-None-Match': etag})
+        assert second.status_code == 304
+
+    def test_swapped_model_invalidates_etag(self, models, client):
+        """Audio cached for the old model should not revalidate after a swap"""
+        install_voice(models, 'amy', 'v1', mtime=1000)
+        test_client, tts_app = client
+        first = test_client.get('/synthesize/amy?text=hello')
+
+        install_voice(models, 'amy', 'v2', mtime=2000)
+        reload_response = test_client.post('/admin/voices/reload', headers=ADMIN_HEADERS)
+        assert reload_response.status_code == 202
+        tts_app._reload_thread.join(timeout=5)
+        status = test_client.get('/admin/voices', headers=ADMIN_HEADERS).get_json()
+        assert status['reloading'] is False
+        assert status['events'][-1]['action'] == 'reloaded'
+
+        second = test_client.get('/synthesize/amy?text=hello',
+                                 headers={'If-None-Match': first.headers['ETag']})
+        assert second.status_code == 200
+        assert second.headers['X-Voice-Version'] != first.headers['X-Voice-Version']
+
+    def test_admin_requires_token(self, models, client):
+        """Admin endpoints should require the bearer token"""
+        test_client, _ = client
+        assert test_client.get('/admin/voices').status_code == 401
+        response = test_client.get('/admin/voices', headers=ADMIN_HEADERS)
+        assert response.status_code == 200
+        assert 'voices' in response.get_json()
+
+    def test_admin_hidden_without_token(self, models, client, monkeypatch):
+        """Without TTS_ADMIN_TOKEN the admin endpoints should not exist"""
+        test_client, tts_app = client
+        monkeypatch.setattr(tts_app, 'ADMIN_TOKEN', '')
+        assert test_client.get('/admin/voices').status_code == 404
+        assert test_client.post('/admin/voices/reload').status_code == 404
+
+    def test_reload_does_not_block_the_request(self, models, client, monkeypatch):
+        """A forced reload should answer at once and refuse to overlap itself"""
+        test_client, tts_app = client
+        started, release = threading.Event(), threading.Event()
+
+        def slow_scan(force=False):
+            started.set()
+            release.wait(5)
+            return {}
+
+        monkeypatch.setattr(tts_app._voice_registry, 'scan', slow_scan)
+        assert test_client.post('/admin/voices/reload', headers=ADMIN_HEADERS).status_code == 202
+        assert started.wait(5)
+        assert test_client.get('/admin/voices', headers=ADMIN_HEADERS).get_json()['reloading'] is True
+        assert test_client.post('/admin/voices/reload', headers=ADMIN_HEADERS).status_code == 409
+        release.set()
+        tts_app._reload_thread.join(timeout=5)
+        assert test_client.post('/admin/voices/reload', headers=ADMIN_HEADERS).status_code == 202
+        tts_app._reload_thread.join(timeout=5)
+
+
+class TestVoiceStats:
+    """Test per-voice load time and speed measurements"""
+
+    def test_describes_voice_name(self):
+        """Voice names should be split into language, speaker and quality"""
+        assert voice_stats.describe_voice_name('en_GB-cori-high') == {
+            'language': 'en_GB', 'speaker': 'cori', 'quality': 'high'
+        }
+        assert voice_stats.describe_voice_name('custom')['quality'] is None
+
+    def test_derives_speed_from_samples(self, tmp_path):
+        """Characters per second and RTF should be derived from totals"""
+        stats = voice_stats.VoiceStats(tmp_path / 'stats.json')
+        stats.record_synthesis('amy', 'v1', chars=100, synth_seconds=0.5, audio_seconds=5.0)
+        stats.record_synthesis('amy', 'v1', chars=100, synth_seconds=0.5, audio_seconds=5.0)
+
+        measured = stats.get('amy')
+        assert measured['samples'] == 2
+        assert measured['chars_per_second'] == 200.0
+        assert measured['rtf'] == 0.1
+
+    def test_new_model_version_resets_measurements(self, tmp_path):
+        """Measurements for an old model should not leak into a new one"""
+        stats = voice_stats.VoiceStats(tmp_path / 'stats.json')
+        stats.record_synthesis('amy', 'v1', chars=100, synth_seconds=1.0, audio_seconds=5.0)
+        stats.record_synthesis('amy', 'v2', chars=100, synth_seconds=0.5, audio_seconds=5.0)
+
+        measured = stats.get('amy')
+        assert measured['version'] == 'v2'
+        assert measured['samples'] == 1
+
+    def test_persists_across_restarts(self, tmp_path):
+        """Saved measurements should be reloaded by a new store"""
+        path = tmp_path / 'stats.json'
+        stats = voice_stats.VoiceStats(path)
+        stats.record_synthesis('amy', 'v1', chars=100, synth_seconds=0.5, audio_seconds=5.0)
+        stats.save()
+
+        reloaded = voice_stats.VoiceStats(path)
+        assert reloaded.get('amy')['chars_per_second'] == 200.0
+
+    def test_unwritable_path_does_not_raise(self, tmp_path):
+        """Failing to persist should not break synthesis"""
+        blocker = tmp_path / 'file'
+        blocker.write_text('')
+        stats = voice_stats.VoiceStats(blocker / 'stats.json')
+        stats.record_synthesis('amy', 'v1', chars=10, synth_seconds=0.1, audio_seconds=1.0)
+        stats.save()
+
+    def test_voices_details_reports_measurements(self, models, monkeypatch):
+        """/voices?details=true should include load time and measured speed"""
+        install_voice(models, 'en_GB-amy-medium')
+        install_voice(models, 'en_US-bob-high')
+        test_client, _ = make_client(models, monkeypatch)
+
+        assert test_client.get('/voices').get_json() == ['en_GB-amy-medium', 'en_US-bob-high']
+        test_client.get('/synthesize/en_GB-amy-medium?text=hello')
+
+        details = {v['name']: v for v in test_client.get('/voices?details=true').get_json()}
+        amy = details['en_GB-amy-medium']
+        assert amy['quality'] == 'medium'
+        assert amy['load_seconds'] is not None
+        assert amy['samples'] == 1
+        assert amy['chars_per_second'] > 0
+        assert amy['rtf'] > 0
+        assert details['en_US-bob-high']['samples'] == 0
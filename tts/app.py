@@ -8,16 +8,41 @@ import os
 import io
 import wave
 import sys
-from pathlib import Path
+import hmac
+import time
+import atexit
+import hashlib
+import threading
+from functools import wraps
 from flask import Flask, request, jsonify, send_file, Response
 
+from voices import MODELS_PATH, VoiceRegistry, get_available_voices
+from voice_stats import WARMUP_TEXT, VoiceStats
+from profiler import Profiler
+
 app = Flask(__name__)
 
 # Configuration
-MODELS_PATH = Path(os.environ.get('PIPER_MODELS_PATH', '/models'))
+RELOAD_INTERVAL = float(os.environ.get('PIPER_RELOAD_INTERVAL', '10'))
+ADMIN_TOKEN = os.environ.get('TTS_ADMIN_TOKEN', '')
+STATS_PATH = os.environ.get('PIPER_STATS_PATH', '/data/voice_stats.json')
+WARMUP = os.environ.get('PIPER_WARMUP', 'false').lower() == 'true'
+PROFILER_TOKEN = os.environ.get('PROFILER_TOKEN', '')
+
+# Measured load time and speed per voice, persisted across restarts
+_voice_stats = VoiceStats(STATS_PATH)
+atexit.register(_voice_stats.save)
+
+# Loaded voices, kept in sync with the models directory
+_voice_registry = VoiceRegistry(on_load=_voice_stats.record_load)
+
+# On-demand sampling profiler (only reachable when PROFILER_TOKEN is set)
+_profiler = Profiler()
 
-# Cache for loaded voices
-_voice_cache = {}
+# Forced voice reloads run on their own thread, one at a time, so model
+# loads never hold up the (single) worker serving synthesis requests
+_reload_lock = threading.Lock()
+_reload_thread = None
 
 
 def log_startup_info():
@@ -60,39 +85,73 @@ def log_startup_info():
         print("=" * 60, file=sys.stderr)
 
 
-def get_available_voices():
-    """Scan models directory for available voice files."""
-    voices = []
-    if MODELS_PATH.exists():
-        for onnx_file in MODELS_PATH.glob('*.onnx'):
-            voice_name = onnx_file.stem
-            json_file = onnx_file.with_suffix('.onnx.json')
-            if json_file.exists():
-                voices.append(voice_name)
-    return sorted(voices)
-
-
 def get_voice(voice_name):
-    """Load or retrieve cached Piper voice."""
-    if voice_name in _voice_cache:
-        return _voice_cache[voice_name]
-    
-    onnx_path = MODELS_PATH / f"{voice_name}.onnx"
-    json_path = MODELS_PATH / f"{voice_name}.onnx.json"
-    
-    if not onnx_path.exists() or not json_path.exists():
-        return None
-    
+    """Load or retrieve the cached voice (a LoadedVoice with model version)."""
     try:
-        from piper import PiperVoice
-        voice = PiperVoice.load(str(onnx_path), config_path=str(json_path))
-        _voice_cache[voice_name] = voice
-        return voice
+        return _voice_registry.get(voice_name)
     except Exception as e:
         app.logger.error(f"Failed to load voice {voice_name}: {e}")
         return None
 
 
+def synthesize_raw(loaded, text, length_scale):
+    """Yield raw PCM chunks, recording the voice's speed once finished."""
+    started = time.perf_counter()
+    audio_bytes_total = 0
+    for audio_bytes in loaded.voice.synthesize_stream_raw(text, length_scale=length_scale):
+        audio_bytes_total += len(audio_bytes)
+        yield audio_bytes
+    audio_seconds = audio_bytes_total / 2 / loaded.voice.config.sample_rate  # 16-bit mono
+    _voice_stats.record_synthesis(
+        loaded.name, loaded.version, len(text), time.perf_counter() - started, audio_seconds
+    )
+
+
+def warm_up_voices():
+    """Load every voice and synthesize a sample so the catalog has numbers."""
+    for voice_name in get_available_voices():
+        loaded = get_voice(voice_name)
+        if loaded is None:
+            continue
+        try:
+            for _ in synthesize_raw(loaded, WARMUP_TEXT, 1.0):
+                pass
+        except Exception as e:
+            app.logger.error(f"Warm-up failed for {voice_name}: {e}")
+    _voice_stats.save()
+
+
+def bearer_token_matches(expected):
+    """Check the request's Authorization: Bearer header against a token."""
+    supplied = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+    # Bytes, since compare_digest() refuses non-ASCII strings
+    return hmac.compare_digest(supplied.encode(), expected.encode())
+
+
+def admin_required(view):
+    """Hide the endpoint unless TTS_ADMIN_TOKEN is set, and require that token."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not ADMIN_TOKEN:
+            return jsonify({'error': 'Admin endpoints are disabled'}), 404
+        if not bearer_token_matches(ADMIN_TOKEN):
+            return jsonify({'error': 'Unauthorized'}), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def profiler_required(view):
+    """Hide the endpoint unless PROFILER_TOKEN is set, and require that token."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not PROFILER_TOKEN:
+            return jsonify({'error': 'Profiler is disabled'}), 404
+        if not bearer_token_matches(PROFILER_TOKEN):
+            return jsonify({'error': 'Unauthorized'}), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+
 @app.route('/health', methods=['GET'])
 def health():
     """Health check endpoint."""
@@ -105,8 +164,16 @@ def health():
 
 @app.route('/voices', methods=['GET'])
 def list_voices():
-    """List available voices."""
+    """
+    List available voices.
+    
+    Query Parameters:
+        details: If true, return objects with language, quality and measured
+                 load time, characters per second and real-time factor
+    """
     voices = get_available_voices()
+    if request.args.get('details', '').lower() in ('1', 'true', 'yes'):
+        return jsonify(_voice_stats.catalog(voices))
     return jsonify(voices)
 
 
@@ -143,9 +210,21 @@ def synthesize(voice):
         length_scale = 1.0
     
     # Load voice
-    piper_voice = get_voice(voice)
-    if piper_voice is None:
+    loaded = get_voice(voice)
+    if loaded is None:
         return jsonify({'error': f'Voice not found: {voice}'}), 404
+    piper_voice = loaded.voice
+    
+    # Audio is keyed to the model version, so a swapped model invalidates
+    # any cached copy and an unchanged one can be revalidated without synthesis
+    etag = hashlib.sha1(
+        f"{voice}\0{loaded.version}\0{length_scale}\0{text}".encode('utf-8')
+    ).hexdigest()
+    if request.method == 'GET' and request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        response.headers['X-Voice-Version'] = loaded.version
+        return response
     
     try:
         # Synthesize audio
@@ -156,26 +235,107 @@ def synthesize(voice):
             wav_file.setsampwidth(2)  # 16-bit
             wav_file.setframerate(piper_voice.config.sample_rate)
             
-            for audio_bytes in piper_voice.synthesize_stream_raw(
-                text,
-                length_scale=length_scale
-            ):
+            for audio_bytes in synthesize_raw(loaded, text, length_scale):
                 wav_file.writeframes(audio_bytes)
         
         audio_buffer.seek(0)
         
-        return send_file(
+        response = send_file(
             audio_buffer,
             mimetype='audio/wav',
             as_attachment=False,
             download_name=f'{voice}.wav'
         )
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Voice-Version'] = loaded.version
+        return response
         
     except Exception as e:
         app.logger.error(f"Synthesis error: {e}")
         return jsonify({'error': f'Synthesis failed: {str(e)}'}), 500
 
 
+@app.route('/admin/voices', methods=['GET'])
+@admin_required
+def admin_voices():
+    """Show loaded voices, model versions and recent reload events."""
+    return jsonify({**_voice_registry.status(), 'reloading': _reload_lock.locked()})
+
+
+def reload_voices():
+    """Rescan the models directory and swap in changed models (reload thread)."""
+    try:
+        _voice_registry.scan(force=True)
+    except Exception as e:
+        print(f"Voice reload failed: {e}", file=sys.stderr)
+    finally:
+        _reload_lock.release()
+
+
+@app.route('/admin/voices/reload', methods=['POST'])
+@admin_required
+def admin_reload_voices():
+    """
+    Start a rescan of the models directory in the background.
+
+    Changed models are loaded while the old ones keep serving; follow the
+    outcome in the events of GET /admin/voices.
+    """
+    global _reload_thread
+    if not _reload_lock.acquire(blocking=False):
+        return jsonify({'error': 'A reload is already running'}), 409
+    _reload_thread = threading.Thread(target=reload_voices, name='voice-reload', daemon=True)
+    _reload_thread.start()
+    return jsonify({'status': 'reloading'}), 202
+
+
+@app.route('/debug/profile', methods=['POST'])
+@profiler_required
+def start_profile():
+    """
+    Start a background profile capture.
+    
+    Query Parameters:
+        seconds: Capture duration (default: 10, max: 120)
+        mode: 'cpu' (stack sampling) or 'memory' (tracemalloc allocations)
+        interval: CPU sampling interval in seconds (default: 0.01)
+    """
+    try:
+        started = _profiler.start(
+            request.args.get('seconds', 10),
+            mode=request.args.get('mode', 'cpu'),
+            interval=request.args.get('interval', 0.01)
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not started:
+        return jsonify({'error': 'A profile is already running'}), 409
+    _, info = _profiler.status()
+    return jsonify({'status': 'running', **info}), 202
+
+
+@app.route('/debug/profile', methods=['GET'])
+@profiler_required
+def get_profile():
+    """Return the last capture as collapsed stacks (flamegraph input)."""
+    state, info = _profiler.status()
+    if state == 'idle':
+        return jsonify({'error': 'No profile captured yet'}), 404
+    if state == 'running':
+        return jsonify({'status': 'running', **info}), 202
+    if info['error']:
+        return jsonify({'error': f"Profile failed: {info['error']}"}), 500
+    return Response(
+        info['body'],
+        mimetype='text/plain',
+        headers={
+            'Content-Disposition': f"attachment; filename=tts-{info['mode']}.folded",
+            'X-Profile-Samples': str(info['samples'])
+        }
+    )
+
+
 @app.route('/', methods=['GET'])
 def index():
     """API info."""
@@ -184,15 +344,26 @@ def index():
         'version': '1.0.0',
         'endpoints': {
             '/health': 'Health check',
-            '/voices': 'List available voices',
-            '/synthesize/<voice>': 'Synthesize text to speech'
+            '/voices': 'List available voices (?details=true for measured speed)',
+            '/synthesize/<voice>': 'Synthesize text to speech',
+            '/admin/voices': 'Loaded voices and reload status',
+            '/admin/voices/reload': 'Rescan models directory (POST)'
         }
     })
 
 
+def start_background_tasks():
+    """Start the models directory watcher and, if enabled, voice warm-up."""
+    _voice_registry.start_watcher(RELOAD_INTERVAL)
+    if WARMUP:
+        threading.Thread(target=warm_up_voices, name='voice-warmup', daemon=True).start()
+
+
 if __name__ == '__main__':
     log_startup_info()
+    start_background_tasks()
     app.run(host='0.0.0.0', port=5000, debug=False)
 else:
     # When run via gunicorn, log startup info
     log_startup_info()
+    start_background_tasks()
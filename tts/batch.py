@@ -0,0 +1,305 @@
+"""
+Yap TTS - Offline bulk synthesis
+
+Renders every .txt/.md file under a directory to audio using a pool of
+worker processes, each holding its own cached Piper voice. Finished files
+are skipped on the next run, so an interrupted batch can simply be re-run.
+
+Usage:
+    python batch.py INPUT_DIR OUTPUT_DIR --voice en_GB-cori-high [--workers N]
+"""
+
+import argparse
+import os
+import re
+import sys
+import time
+import wave
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+
+from voices import get_available_voices, load_voice
+
+SOURCE_SUFFIXES = ('.txt', '.md')
+OUTPUT_FORMATS = ('flac', 'ogg', 'wav')
+DEFAULT_MAX_CHUNK_CHARS = 1000
+
+# Per-process voice cache (populated lazily inside each worker)
+_worker_voices = {}
+_worker_threads = 1
+
+
+def strip_markdown(text):
+    """Remove the markdown syntax that would otherwise be read aloud."""
+    text = re.sub(r'```.*?```', '', text, flags=re.DOTALL)
+    text = re.sub(r'!\[([^\]]*)\]\([^)]*\)', r'\1', text)
+    text = re.sub(r'\[([^\]]*)\]\([^)]*\)', r'\1', text)
+    text = re.sub(r'^[ \t]{0,3}#{1,6}[ \t]*', '', text, flags=re.MULTILINE)
+    text = re.sub(r'^[ \t]*(?:[-*+]|\d+[.)])[ \t]+', '', text, flags=re.MULTILINE)
+    text = re.sub(r'^[ \t]*>[ \t]?', '', text, flags=re.MULTILINE)
+    text = re.sub(r'[*_`~]+', '', text)
+    return text
+
+
+def chunk_text(text, max_chars=DEFAULT_MAX_CHUNK_CHARS):
+    """
+    Split text into synthesis chunks.
+
+    Paragraphs (blank-line separated) become chunks; paragraphs longer than
+    max_chars are split on sentence boundaries, and single sentences longer
+    than max_chars are split on whitespace.
+    """
+    chunks = []
+    for paragraph in re.split(r'\n\s*\n', text):
+        paragraph = ' '.join(paragraph.split())
+        if not paragraph:
+            continue
+        if len(paragraph) <= max_chars:
+            chunks.append(paragraph)
+            continue
+
+        current = ''
+        for sentence in re.split(r'(?<=[.!?])\s+', paragraph):
+            while len(sentence) > max_chars:
+                cut = sentence.rfind(' ', 0, max_chars)
+                if cut <= 0:
+                    cut = max_chars
+                if current:
+                    chunks.append(current)
+                    current = ''
+                chunks.append(sentence[:cut].strip())
+                sentence = sentence[cut:].strip()
+            if current and len(current) + 1 + len(sentence) > max_chars:
+                chunks.append(current)
+                current = sentence
+            else:
+                current = f"{current} {sentence}" if current else sentence
+        if current:
+            chunks.append(current)
+    return chunks
+
+
+def find_sources(input_dir):
+    """Return all source documents under input_dir, sorted for stable order."""
+    return sorted(
+        path for path in Path(input_dir).rglob('*')
+        if path.is_file() and path.suffix.lower() in SOURCE_SUFFIXES
+    )
+
+
+def output_path_for(source, input_dir, output_dir, audio_format):
+    """Mirror the source's relative path under output_dir."""
+    relative = Path(source).relative_to(input_dir)
+    return Path(output_dir) / relative.with_suffix(f'.{audio_format}')
+
+
+def is_done(source, output):
+    """A file is done when its output exists and is newer than the source."""
+    return output.exists() and output.stat().st_mtime >= source.stat().st_mtime
+
+
+def _init_worker(threads):
+    global _worker_threads
+    _worker_threads = threads
+
+
+def _synthesize_chunk(voice_name, text, length_scale):
+    """Worker task: synthesize one chunk and return raw 16-bit PCM."""
+    voice = _worker_voices.get(voice_name)
+    if voice is None:
+        voice = load_voice(voice_name, threads=_worker_threads)
+        if voice is None:
+            raise RuntimeError(f'Voice not found: {voice_name}')
+        _worker_voices[voice_name] = voice
+
+    started = time.perf_counter()
+    pcm = b''.join(voice.synthesize_stream_raw(text, length_scale=length_scale))
+    return pcm, voice.config.sample_rate, time.perf_counter() - started
+
+
+def write_audio(path, pcm, sample_rate, audio_format):
+    """Write mono 16-bit PCM atomically (via a .part file and rename)."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    partial = path.with_name(path.name + '.part')
+
+    try:
+        if audio_format == 'wav':
+            with wave.open(str(partial), 'wb') as wav_file:
+                wav_file.setnchannels(1)
+                wav_file.setsampwidth(2)  # 16-bit
+                wav_file.setframerate(sample_rate)
+                wav_file.writeframes(pcm)
+        else:
+            import soundfile
+            sf_format, subtype = ('FLAC', 'PCM_16') if audio_format == 'flac' else ('OGG', 'VORBIS')
+            with soundfile.SoundFile(str(partial), 'w', samplerate=sample_rate, channels=1,
+                                     format=sf_format, subtype=subtype) as audio_file:
+                audio_file.buffer_write(pcm, dtype='int16')
+
+        os.replace(partial, path)
+    except BaseException:
+        # Don't leave a half-written .part behind (e.g. on a full disk)
+        partial.unlink(missing_ok=True)
+        raise
+
+
+def run_batch(input_dir, output_dir, voice, workers=None, threads_per_worker=1,
+              length_scale=1.0, audio_format='flac', max_chunk_chars=DEFAULT_MAX_CHUNK_CHARS,
+              force=False):
+    """Render all documents under input_dir and return a stats dict."""
+    input_dir = Path(input_dir)
+    output_dir = Path(output_dir)
+    workers = workers or os.cpu_count() or 1
+
+    stats = {
+        'files_total': 0, 'files_rendered': 0, 'files_skipped': 0, 'files_failed': 0,
+        'chunks': 0, 'chars': 0, 'audio_seconds': 0.0, 'synth_seconds': 0.0,
+        'wall_seconds': 0.0,
+    }
+
+    # Build the job list, skipping files rendered by a previous run
+    jobs = []
+    for source in find_sources(input_dir):
+        stats['files_total'] += 1
+        output = output_path_for(source, input_dir, output_dir, audio_format)
+        if not force and is_done(source, output):
+            stats['files_skipped'] += 1
+            continue
+        text = source.read_text(encoding='utf-8', errors='replace')
+        if source.suffix.lower() == '.md':
+            text = strip_markdown(text)
+        chunks = chunk_text(text, max_chunk_chars)
+        if not chunks:
+            stats['files_skipped'] += 1
+            continue
+        jobs.append((source, output, chunks))
+
+    print(f"{stats['files_total']} files found, {len(jobs)} to render, "
+          f"{stats['files_skipped']} skipped, {workers} workers")
+
+    started = time.perf_counter()
+    tasks = ((job_index, chunk_index, chunk)
+             for job_index, (_, _, chunks) in enumerate(jobs)
+             for chunk_index, chunk in enumerate(chunks))
+    results = {}  # job_index -> {chunk_index: pcm}
+    failed = set()
+    max_pending = workers * 4
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(threads_per_worker,)) as executor:
+        pending = {}
+        exhausted = False
+        while pending or not exhausted:
+            # Keep a bounded window of chunks in flight so memory stays flat
+            while not exhausted and len(pending) < max_pending:
+                task = next(tasks, None)
+                if task is None:
+                    exhausted = True
+                    break
+                job_index, chunk_index, chunk = task
+                future = executor.submit(_synthesize_chunk, voice, chunk, length_scale)
+                pending[future] = (job_index, chunk_index, len(chunk))
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                job_index, chunk_index, chars = pending.pop(future)
+                source, output, chunks = jobs[job_index]
+                try:
+                    pcm, sample_rate, synth_seconds = future.result()
+                except Exception as e:
+                    if job_index not in failed:
+                        failed.add(job_index)
+                        stats['files_failed'] += 1
+                        print(f"FAILED {source}: {e}", file=sys.stderr)
+                    results.pop(job_index, None)
+                    continue
+                if job_index in failed:
+                    continue
+
+                stats['chunks'] += 1
+                stats['chars'] += chars
+                stats['synth_seconds'] += synth_seconds
+                stats['audio_seconds'] += len(pcm) / 2 / sample_rate
+
+                parts = results.setdefault(job_index, {})
+                parts[chunk_index] = pcm
+                if len(parts) == len(chunks):
+                    del results[job_index]
+                    try:
+                        write_audio(output, b''.join(parts[i] for i in range(len(chunks))),
+                                    sample_rate, audio_format)
+                    except Exception as e:
+                        # One unwritable file shouldn't abort the rest of the batch
+                        failed.add(job_index)
+                        stats['files_failed'] += 1
+                        print(f"FAILED {source}: {e}", file=sys.stderr)
+                        continue
+                    stats['files_rendered'] += 1
+                    print(f"[{stats['files_rendered']}/{len(jobs)}] {output}")
+
+    stats['wall_seconds'] = time.perf_counter() - started
+    return stats
+
+
+def format_report(stats):
+    """Summarize throughput and real-time factor (RTF, lower is faster)."""
+    wall = stats['wall_seconds'] or 1e-9
+    audio = stats['audio_seconds']
+    lines = [
+        f"Files: {stats['files_rendered']} rendered, {stats['files_skipped']} skipped, "
+        f"{stats['files_failed']} failed (of {stats['files_total']})",
+        f"Chunks: {stats['chunks']}, characters: {stats['chars']}",
+        f"Audio: {audio:.1f}s in {stats['wall_seconds']:.1f}s wall",
+    ]
+    if audio > 0:
+        lines.append(f"RTF: {wall / audio:.3f} overall, "
+                     f"{stats['synth_seconds'] / audio:.3f} per worker")
+        lines.append(f"Throughput: {stats['chars'] / wall:.0f} chars/s, "
+                     f"{audio / wall:.1f}x realtime")
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Render a directory of .txt/.md files to audio with Piper.')
+    parser.add_argument('input_dir', help='Directory containing .txt/.md documents')
+    parser.add_argument('output_dir', help='Directory to write audio files to')
+    parser.add_argument('--voice', required=True, help='Voice name (see /voices)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Worker processes (default: all CPU cores)')
+    parser.add_argument('--threads-per-worker', type=int, default=1,
+                        help='ONNX threads per worker (default: 1)')
+    parser.add_argument('--length-scale', type=float, default=1.0,
+                        help='Speaking rate (default: 1.0, higher = slower)')
+    parser.add_argument('--format', dest='audio_format', choices=OUTPUT_FORMATS, default='flac',
+                        help='Output format (default: flac)')
+    parser.add_argument('--max-chunk-chars', type=int, default=DEFAULT_MAX_CHUNK_CHARS,
+                        help=f'Maximum characters per synthesis chunk (default: {DEFAULT_MAX_CHUNK_CHARS})')
+    parser.add_argument('--force', action='store_true', help='Re-render files that are already done')
+    args = parser.parse_args(argv)
+
+    if args.max_chunk_chars < 1:
+        parser.error('--max-chunk-chars must be at least 1')
+    if args.workers is not None and args.workers < 1:
+        parser.error('--workers must be at least 1')
+    if args.voice not in get_available_voices():
+        parser.error(f'Voice not found: {args.voice}')
+    if not Path(args.input_dir).is_dir():
+        parser.error(f'Input directory not found: {args.input_dir}')
+
+    stats = run_batch(
+        args.input_dir,
+        args.output_dir,
+        args.voice,
+        workers=args.workers,
+        threads_per_worker=args.threads_per_worker,
+        length_scale=max(0.5, min(2.0, args.length_scale)),
+        audio_format=args.audio_format,
+        max_chunk_chars=args.max_chunk_chars,
+        force=args.force,
+    )
+    print(format_report(stats))
+    return 1 if stats['files_failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,130 @@
+"""
+Yap - In-process sampling profiler
+
+Captures what a running service is doing without restarting it under an
+external profiler. A background thread samples the stacks of all other
+threads at a fixed interval (CPU mode) or records allocations with
+tracemalloc (memory mode), and the result is rendered in the collapsed
+stack format read by flamegraph.pl, speedscope and inferno:
+
+    thread;outer (file.py:10);inner (file.py:42) 17
+
+The TTS and metrics services are built from separate Docker contexts, so
+each keeps an identical copy of this module.
+"""
+
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+MAX_SECONDS = 120
+DEFAULT_INTERVAL = 0.01  # 100 Hz
+MAX_INTERVAL = 1.0
+MEMORY_TRACEBACK_DEPTH = 32
+
+
+def _frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def collapse(stacks):
+    """Render a Counter of stack tuples as collapsed-stack text."""
+    lines = [f"{';'.join(stack)} {count}" for stack, count in stacks.most_common()]
+    return '\n'.join(lines) + '\n' if lines else ''
+
+
+def sample_cpu(seconds, interval=DEFAULT_INTERVAL):
+    """Sample every other thread's stack for the given duration."""
+    own_id = threading.get_ident()
+    stacks = Counter()
+    samples = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            stack.append(names.get(thread_id, f"thread-{thread_id}"))
+            stacks[tuple(reversed(stack))] += 1
+        samples += 1
+        time.sleep(interval)
+    return stacks, samples
+
+
+def sample_memory(seconds):
+    """Record allocations made during the given duration, weighted by bytes."""
+    already_tracing = tracemalloc.is_tracing()
+    if not already_tracing:
+        tracemalloc.start(MEMORY_TRACEBACK_DEPTH)
+    try:
+        time.sleep(seconds)
+        snapshot = tracemalloc.take_snapshot()
+    finally:
+        if not already_tracing:
+            tracemalloc.stop()
+
+    snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+    stacks = Counter()
+    for stat in snapshot.statistics('traceback'):
+        stack = tuple(
+            f"{os.path.basename(frame.filename)}:{frame.lineno}" for frame in stat.traceback
+        )
+        stacks[stack] += stat.size
+    return stacks, len(snapshot.traces)
+
+
+class Profiler:
+    """Runs one capture at a time in the background and keeps the last result."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._running = None
+        self._result = None
+
+    def start(self, seconds, mode='cpu', interval=DEFAULT_INTERVAL):
+        """Start a capture; returns False if one is already running."""
+        if mode not in ('cpu', 'memory'):
+            raise ValueError(f"Unknown profile mode: {mode}")
+        seconds = max(0.1, min(float(seconds), MAX_SECONDS))
+        # min() first, so an infinite interval is clamped and NaN ends up at the floor
+        interval = max(0.001, min(float(interval), MAX_INTERVAL))
+        with self._lock:
+            if self._running:
+                return False
+            self._running = {
+                'mode': mode,
+                'seconds': seconds,
+                'started_at': time.time(),
+            }
+
+        def capture():
+            try:
+                if mode == 'cpu':
+                    stacks, samples = sample_cpu(seconds, interval)
+                else:
+                    stacks, samples = sample_memory(seconds)
+                result = {'body': collapse(stacks), 'samples': samples, 'error': None}
+            except Exception as e:
+                result = {'body': '', 'samples': 0, 'error': str(e)}
+            with self._lock:
+                self._result = {**self._running, **result, 'finished_at': time.time()}
+                self._running = None
+
+        threading.Thread(target=capture, name='profiler', daemon=True).start()
+        return True
+
+    def status(self):
+        """Return ('running', info), ('done', result) or ('idle', None)."""
+        with self._lock:
+            if self._running:
+                return 'running', dict(self._running)
+            if self._result:
+                return 'done', dict(self._result)
+            return 'idle', None
@@ -0,0 +1,139 @@
+"""
+Yap TTS - Per-voice performance catalog
+
+Records how long each voice takes to load and how fast it synthesizes
+(characters per second and real-time factor), from warm-up runs and live
+traffic. Measurements are kept per model version and persisted to a JSON
+file so they survive restarts.
+"""
+
+import json
+import os
+import re
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+SAVE_INTERVAL = 30  # seconds between persisting updated measurements
+
+WARMUP_TEXT = (
+    "The quick brown fox jumps over the lazy dog. "
+    "This sentence is used to measure how fast each voice can speak."
+)
+
+_VOICE_NAME = re.compile(r'^(?P<language>[a-z]{2,3}_[A-Z]{2})-(?P<speaker>.+)-(?P<quality>x_low|low|medium|high)$')
+
+
+def describe_voice_name(voice_name):
+    """Split a Piper voice name like en_GB-cori-high into its parts."""
+    match = _VOICE_NAME.match(voice_name)
+    if not match:
+        return {'language': None, 'speaker': None, 'quality': None}
+    return match.groupdict()
+
+
+class VoiceStats:
+    """Thread-safe store of per-voice load and synthesis measurements."""
+
+    def __init__(self, path=None):
+        self.path = Path(path) if path else None
+        self._lock = threading.Lock()
+        self._voices = {}
+        self._dirty = False
+        self._last_save = time.monotonic()
+        self._load()
+
+    def _load(self):
+        if not self.path or not self.path.exists():
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as stats_file:
+                self._voices = json.load(stats_file).get('voices', {})
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable voice stats {self.path}: {e}", file=sys.stderr)
+
+    def _entry(self, voice_name, version):
+        """Return the entry for a voice, resetting it if the model changed."""
+        entry = self._voices.get(voice_name)
+        if entry is None or entry.get('version') != version:
+            entry = {
+                'version': version,
+                'load_seconds': None,
+                'samples': 0,
+                'chars': 0,
+                'synth_seconds': 0.0,
+                'audio_seconds': 0.0,
+                'updated_at': None,
+            }
+            self._voices[voice_name] = entry
+        return entry
+
+    def record_load(self, loaded):
+        """Record the load time of a LoadedVoice."""
+        with self._lock:
+            entry = self._entry(loaded.name, loaded.version)
+            entry['load_seconds'] = round(loaded.load_seconds, 4)
+            entry['updated_at'] = datetime.now(timezone.utc).isoformat()
+            self._dirty = True
+        self.maybe_save()
+
+    def record_synthesis(self, voice_name, version, chars, synth_seconds, audio_seconds):
+        """Record one synthesis run."""
+        if chars <= 0 or synth_seconds <= 0:
+            return
+        with self._lock:
+            entry = self._entry(voice_name, version)
+            entry['samples'] += 1
+            entry['chars'] += chars
+            entry['synth_seconds'] += synth_seconds
+            entry['audio_seconds'] += audio_seconds
+            entry['updated_at'] = datetime.now(timezone.utc).isoformat()
+            self._dirty = True
+        self.maybe_save()
+
+    def get(self, voice_name):
+        """Return derived measurements for a voice (empty values if unmeasured)."""
+        with self._lock:
+            entry = dict(self._voices.get(voice_name) or {})
+        synth = entry.get('synth_seconds') or 0
+        audio = entry.get('audio_seconds') or 0
+        return {
+            'version': entry.get('version'),
+            'load_seconds': entry.get('load_seconds'),
+            'samples': entry.get('samples', 0),
+            'chars_per_second': round(entry['chars'] / synth, 1) if synth else None,
+            'rtf': round(synth / audio, 4) if audio else None,
+            'measured_at': entry.get('updated_at'),
+        }
+
+    def catalog(self, voice_names):
+        """Describe each voice with its measured performance."""
+        return [
+            {'name': name, **describe_voice_name(name), **self.get(name)}
+            for name in voice_names
+        ]
+
+    def maybe_save(self):
+        """Persist if there are changes and SAVE_INTERVAL has passed."""
+        if self._dirty and time.monotonic() - self._last_save >= SAVE_INTERVAL:
+            self.save()
+
+    def save(self):
+        """Atomically write all measurements to the stats file."""
+        if not self.path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            payload = json.dumps({'voices': self._voices}, indent=2)
+            self._dirty = False
+            self._last_save = time.monotonic()
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            partial = self.path.with_name(self.path.name + '.part')
+            partial.write_text(payload, encoding='utf-8')
+            os.replace(partial, self.path)
+        except OSError as e:
+            print(f"Could not save voice stats to {self.path}: {e}", file=sys.stderr)
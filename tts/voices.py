@@ -0,0 +1,283 @@
+"""
+Yap TTS - Piper voice discovery and loading
+
+Shared by the HTTP service (app.py) and the offline batch renderer
+(batch.py) so both resolve and load voices the same way. The service keeps
+its loaded voices in a VoiceRegistry, which follows changes to the models
+directory and swaps replaced models in without a restart.
+"""
+
+import hashlib
+import os
+import sys
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+
+# Configuration
+MODELS_PATH = Path(os.environ.get('PIPER_MODELS_PATH', '/models'))
+
+
+def voice_paths(voice_name):
+    """Return the (.onnx, .onnx.json) paths for a voice name."""
+    onnx_path = MODELS_PATH / f"{voice_name}.onnx"
+    json_path = MODELS_PATH / f"{voice_name}.onnx.json"
+    return onnx_path, json_path
+
+
+def get_available_voices():
+    """Scan models directory for available voice files."""
+    voices = []
+    if MODELS_PATH.exists():
+        for onnx_file in MODELS_PATH.glob('*.onnx'):
+            voice_name = onnx_file.stem
+            json_file = onnx_file.with_suffix('.onnx.json')
+            if json_file.exists():
+                voices.append(voice_name)
+    return sorted(voices)
+
+
+def voice_fingerprint(voice_name):
+    """
+    Return a short version string for a voice's files on disk.
+
+    The version changes whenever either file is replaced or rewritten, and
+    is None if the voice is not (fully) installed.
+    """
+    try:
+        stats = [path.stat() for path in voice_paths(voice_name)]
+    except FileNotFoundError:
+        return None
+    raw = '|'.join(f"{stat.st_mtime_ns}:{stat.st_size}" for stat in stats)
+    return hashlib.sha1(raw.encode()).hexdigest()[:12]
+
+
+def load_voice(voice_name, threads=None):
+    """
+    Load a Piper voice from the models directory.
+
+    Returns None if the model files are missing; load errors propagate.
+    When threads is set, the ONNX session is limited to that many intra-op
+    threads so several processes can share the CPU without oversubscribing.
+    """
+    onnx_path, json_path = voice_paths(voice_name)
+    if not onnx_path.exists() or not json_path.exists():
+        return None
+
+    from piper import PiperVoice
+
+    if threads is None:
+        return PiperVoice.load(str(onnx_path), config_path=str(json_path))
+
+    import json
+    import onnxruntime
+    from piper.config import PiperConfig
+
+    with open(json_path, 'r', encoding='utf-8') as config_file:
+        config = PiperConfig.from_dict(json.load(config_file))
+
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = threads
+    options.inter_op_num_threads = 1
+    session = onnxruntime.InferenceSession(
+        str(onnx_path),
+        sess_options=options,
+        providers=['CPUExecutionProvider'],
+    )
+    return PiperVoice(config=config, session=session)
+
+
+@dataclass
+class LoadedVoice:
+    """A loaded Piper voice and the version of the files it came from."""
+    name: str
+    voice: object
+    version: str
+    loaded_at: float
+    load_seconds: float
+
+
+def _iso(timestamp):
+    if timestamp is None:
+        return None
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat()
+
+
+class VoiceRegistry:
+    """
+    Thread-safe cache of loaded voices that follows the models directory.
+
+    Voices are loaded lazily on first use. scan() compares the files on disk
+    with what is loaded: removed voices are evicted, and replaced models are
+    loaded in the background while the old session keeps serving, then
+    swapped in with a single dict assignment. Requests already holding the
+    old LoadedVoice finish with it.
+    """
+
+    def __init__(self, loader=None, on_load=None):
+        self._loader = loader or load_voice
+        self._on_load = on_load
+        self._lock = threading.Lock()
+        self._loaded = {}       # name -> LoadedVoice
+        self._seen = {}         # name -> fingerprint at the last scan
+        self._load_locks = {}   # name -> Lock, so a voice is only loaded once at a time
+        self._errors = {}       # name -> last load error
+        self._failed = {}       # name -> version whose reload failed
+        self._events = deque(maxlen=50)
+        self._watch_interval = 0
+        self.last_scan = None
+
+    def _name_lock(self, name):
+        with self._lock:
+            return self._load_locks.setdefault(name, threading.Lock())
+
+    def _record(self, name, action, detail=None):
+        self._events.append({
+            'time': _iso(time.time()),
+            'voice': name,
+            'action': action,
+            'detail': detail,
+        })
+
+    def _load(self, name):
+        version = voice_fingerprint(name)
+        if version is None:
+            return None
+        started = time.perf_counter()
+        voice = self._loader(name)
+        if voice is None:
+            return None
+        entry = LoadedVoice(name, voice, version, time.time(), time.perf_counter() - started)
+        if self._on_load:
+            self._on_load(entry)
+        return entry
+
+    def get(self, name):
+        """Return the LoadedVoice for name, loading it if needed (None if missing)."""
+        entry = self._loaded.get(name)
+        if entry is not None:
+            return entry
+
+        with self._name_lock(name):
+            entry = self._loaded.get(name)
+            if entry is not None:
+                return entry
+            try:
+                entry = self._load(name)
+            except Exception as e:
+                self._errors[name] = str(e)
+                raise
+            if entry is not None:
+                with self._lock:
+                    self._loaded[name] = entry
+                self._errors.pop(name, None)
+                self._record(name, 'loaded', f"{entry.load_seconds:.2f}s")
+            return entry
+
+    def _reload(self, name):
+        with self._name_lock(name):
+            old = self._loaded.get(name)
+            try:
+                new = self._load(name)
+            except Exception as e:
+                # Keep serving the previous model; retry on the next change
+                self._errors[name] = str(e)
+                self._failed[name] = voice_fingerprint(name)
+                self._record(name, 'reload_failed', str(e))
+                return False
+            if new is None:
+                return False
+            with self._lock:
+                if name not in self._loaded:
+                    return False
+                self._loaded[name] = new
+            self._errors.pop(name, None)
+            self._failed.pop(name, None)
+            self._record(name, 'reloaded', f"{old.version if old else None} -> {new.version} "
+                                           f"in {new.load_seconds:.2f}s")
+            return True
+
+    def scan(self, force=False):
+        """
+        Compare the models directory with loaded voices and apply changes.
+
+        A changed model is only reloaded once its files are unchanged across
+        two consecutive scans, so a copy still in progress is not picked up
+        half-written. force=True reloads changed models immediately.
+        """
+        current = {name: voice_fingerprint(name) for name in get_available_voices()}
+        with self._lock:
+            previous = self._seen
+            self._seen = current
+            loaded = dict(self._loaded)
+            self.last_scan = time.time()
+
+        changes = {'added': [], 'removed': [], 'reloaded': [], 'pending': []}
+        for name in sorted(current.keys() - previous.keys()):
+            changes['added'].append(name)
+            if previous:
+                self._record(name, 'added')
+
+        for name in sorted(set(loaded) - current.keys()):
+            with self._lock:
+                self._loaded.pop(name, None)
+            changes['removed'].append(name)
+            self._record(name, 'removed')
+
+        for name, entry in sorted(loaded.items()):
+            version = current.get(name)
+            if version is None or version == entry.version:
+                continue
+            if not force and previous.get(name) != version:
+                changes['pending'].append(name)
+                continue
+            if not force and self._failed.get(name) == version:
+                continue
+            if self._reload(name):
+                changes['reloaded'].append(name)
+
+        return changes
+
+    def start_watcher(self, interval):
+        """Poll the models directory every interval seconds (0 disables)."""
+        if interval <= 0 or self._watch_interval:
+            return
+        self._watch_interval = interval
+        self.scan()
+
+        def watch():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.scan()
+                except Exception as e:
+                    print(f"Voice scan failed: {e}", file=sys.stderr)
+
+        threading.Thread(target=watch, name='voice-watcher', daemon=True).start()
+
+    def status(self):
+        """Describe available and loaded voices plus recent reload events."""
+        with self._lock:
+            loaded = dict(self._loaded)
+            seen = dict(self._seen)
+        voices = []
+        for name in sorted(set(get_available_voices()) | set(loaded)):
+            entry = loaded.get(name)
+            voices.append({
+                'name': name,
+                'available': voice_fingerprint(name) is not None,
+                'loaded': entry is not None,
+                'version': entry.version if entry else seen.get(name),
+                'loaded_at': _iso(entry.loaded_at) if entry else None,
+                'load_seconds': round(entry.load_seconds, 3) if entry else None,
+                'error': self._errors.get(name),
+            })
+        return {
+            'watch_interval': self._watch_interval,
+            'last_scan': _iso(self.last_scan),
+            'voices': voices,
+            'events': list(self._events),
+        }